@@ -0,0 +1,47 @@
+"""Compares Result codec with pickle: throughput and stored bytes.
+
+usage: python -m benchmarks.codec [--number N]
+"""
+import argparse
+import pickle
+import timeit
+from typing import Any, Callable
+
+from filter.codec import encode_result, decode_result
+from filter.main import Result, ProcessingStatus
+
+RESULT = Result(
+    status=ProcessingStatus.OK,
+    url="https://inosmi.ru/economic/20190629/245384784.html",
+    score=1.43,
+    words_count=1046,
+)
+
+
+def ops_per_second(func: Callable[[Any], Any], arg: Any, number: int) -> float:
+    elapsed = min(timeit.repeat(lambda: func(arg), number=number, repeat=3))
+    return number / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--number", type=int, default=100000)
+    args = parser.parse_args()
+
+    codecs = [
+        ("pickle", pickle.dumps, pickle.loads),
+        ("codec", encode_result, decode_result),
+    ]
+    print(f"{'':<8} {'encode/s':>12} {'decode/s':>12} {'bytes':>6}")
+    for name, encode, decode in codecs:
+        data = encode(RESULT)
+        assert decode(data) == RESULT
+        encode_rate = ops_per_second(encode, RESULT, args.number)
+        decode_rate = ops_per_second(decode, data, args.number)
+        print(
+            f"{name:<8} {encode_rate:12.0f} {decode_rate:12.0f} {len(data):6}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Compares two json results of benchmarks.pipeline.
+
+usage: python -m benchmarks.compare old.json new.json
+"""
+import argparse
+import json
+from typing import Any, Dict, Iterator, Tuple
+
+
+def flatten(data: Any, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield from flatten(value, f"{prefix}.{key}" if prefix else key)
+    elif isinstance(data, list):
+        for item in data:
+            # throughput items are identified by page and concurrency
+            name = "{page}@{concurrency}".format(**item)
+            yield from flatten(item, f"{prefix}.{name}")
+    elif isinstance(data, (int, float)) and not isinstance(data, bool):
+        yield prefix, float(data)
+
+
+def load(path: str) -> Dict[str, float]:
+    with open(path) as f:
+        data = json.load(f)
+    data.pop("environment", None)
+    return dict(flatten(data))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("old")
+    parser.add_argument("new")
+    args = parser.parse_args()
+
+    old, new = load(args.old), load(args.new)
+    for key in sorted(old.keys() & new.keys()):
+        ratio = new[key] / old[key] if old[key] else float("nan")
+        print(f"{key:<60} {old[key]:12.2f} {new[key]:12.2f} {ratio:8.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Compares encoding of results to json: stdlib encoder with
+dataclasses.asdict (as it used to be) and filter.server.encoder.
+
+usage: python -m benchmarks.encoder [--results N] [--repeat N]
+"""
+import argparse
+import dataclasses
+import json
+import random
+import timeit
+from typing import Any, Callable, List
+
+from filter.main import Result, ProcessingStatus
+from filter.server.encoder import dumps
+
+
+class AsdictEncoder(json.JSONEncoder):
+    def default(self, o: Any) -> Any:
+        if isinstance(o, Result):
+            return dataclasses.asdict(o)
+        if isinstance(o, ProcessingStatus):
+            return o.value
+        return super().default(o)
+
+
+def asdict_dumps(obj: Any) -> str:
+    return json.dumps(obj, cls=AsdictEncoder)
+
+
+def make_results(count: int) -> List[Result]:
+    rnd = random.Random(0)
+    results = []
+    for i in range(count):
+        url = f"https://inosmi.ru/politic/20191211/{246417356 + i}.html"
+        if rnd.random() < 0.9:
+            score = round(rnd.uniform(0, 10), 2)
+            words_count = rnd.randint(100, 3000)
+            results.append(
+                Result(ProcessingStatus.OK, url, score, words_count)
+            )
+        else:
+            results.append(Result(ProcessingStatus.TIMEOUT, url))
+    return results
+
+
+def best_time(func: Callable[[], Any], repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--results", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = make_results(args.results)
+    assert dumps(results) == asdict_dumps(results)
+    print(f"{args.results} results, best of {args.repeat}")
+    print(f"{'':<16} {'asdict ms':>10} {'encoder ms':>10} {'speedup':>8}")
+    cases = [
+        ("json list", lambda f: f(results)),
+        ("json lines", lambda f: [f(result) for result in results]),
+    ]
+    for name, case in cases:
+        old = best_time(lambda: case(asdict_dumps), args.repeat)
+        new = best_time(lambda: case(dumps), args.repeat)
+        print(
+            f"{name:<16} {old * 1000:10.1f} {new * 1000:10.1f} "
+            f"{old / new:7.1f}x"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""Benchmarks of the whole scoring pipeline against a local http server.
+
+Pages are served by a local aiohttp server: tests/html/inosmi.html
+and synthetic large articles. Measured are per-stage latency
+(fetch, sanitize, lemmatize, score, batch lemmatization and scoring
+of lemma counts), throughput of handle_news_list at several
+concurrency levels and peak RSS. Results are printed
+as json, compare runs with benchmarks.compare.
+
+usage: python -m benchmarks.pipeline [--output results.json]
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import resource
+import statistics
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import aiohttp
+import aiohttp.web as web
+import pymorphy2
+
+from benchmarks.sanitize import HTML_PATH, make_large_article
+from filter.adapters import inosmi_ru, register
+from filter.adapters.inosmi_ru import sanitize
+from filter.main import fetch_article
+from filter.server.args import Config
+from filter.server.server import get_app
+from filter.text_tools import (
+    split_by_words, calculate_jaundice_rate, ChargedDictionary, LemmaCache,
+    count_lemmas,
+)
+
+CHARGED_WORDS = ["сделка", "президент", "китай", "переговоры", "война"]
+
+
+def summary(samples: List[float]) -> Dict[str, float]:
+    """latency summary in milliseconds"""
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[int(len(ordered) * 0.95)] * 1000,
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def pages_app(pages: Dict[str, str]) -> web.Application:
+    """serves pages by name, number in url makes every url unique:
+    /inosmi/1.html, /large/2.html..."""
+    async def handle(request: web.Request) -> web.Response:
+        page = pages.get(request.match_info["page"])
+        if page is None:
+            raise web.HTTPNotFound()
+        return web.Response(text=page, content_type="text/html")
+
+    app = web.Application()
+    app.add_routes([web.get("/{page}/{number}.html", handle)])
+    return app
+
+
+async def start_server(app: web.Application) -> Tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]  # type: ignore
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def timed(
+        timings: Dict[str, List[float]],
+        stage: str,
+        func: Callable[[], Any],
+) -> Any:
+    start = time.perf_counter()
+    result = func()
+    if asyncio.iscoroutine(result):
+        result = await result
+    timings[stage].append(time.perf_counter() - start)
+    return result
+
+
+async def measure_stages(
+        pages_url: str,
+        page: str,
+        repeat: int,
+) -> Dict[str, Dict[str, float]]:
+    morph = pymorphy2.MorphAnalyzer()
+    charged_words = ChargedDictionary(CHARGED_WORDS, morph)
+    timings: Dict[str, List[float]] = {
+        stage: []
+        for stage in ["fetch", "sanitize", "lemmatize", "lemmatize_cached",
+                      "lemmatize_batch", "score", "score_counts"]
+    }
+    lemma_cache = LemmaCache()
+    async with aiohttp.ClientSession() as session:
+        for i in range(repeat):
+            url = f"{pages_url}/{page}/{i}.html"
+            html = await timed(
+                timings, "fetch", lambda: fetch_article(session, url)
+            )
+            text = await timed(
+                timings, "sanitize", lambda: sanitize(html, plaintext=True)
+            )
+            words = await timed(
+                timings, "lemmatize", lambda: split_by_words(morph, text)
+            )
+            await timed(
+                timings, "lemmatize_cached",
+                lambda: split_by_words(morph, text, lemma_cache),
+            )
+            counts = await timed(
+                timings, "lemmatize_batch",
+                lambda: count_lemmas(morph, text, charged_words=charged_words),
+            )
+            await timed(
+                timings, "score",
+                lambda: calculate_jaundice_rate(words, charged_words),
+            )
+            await timed(
+                timings, "score_counts",
+                lambda: calculate_jaundice_rate(counts, charged_words),
+            )
+    return {stage: summary(samples) for stage, samples in timings.items()}
+
+
+async def measure_throughput(
+        pages_url: str,
+        page: str,
+        concurrency: int,
+        requests: int,
+        urls_per_request: int,
+) -> Dict[str, Any]:
+    config = Config()
+    config.cache_size = 0  # every url is new anyway, measure processing
+    config.urls_limit = urls_per_request
+    config.request_timeout = 60
+    config.processing_timeout = 60
+    runner, api_url = await start_server(get_app(config))
+
+    numbers = itertools.count()
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async def client(session: aiohttp.ClientSession, count: int) -> None:
+        for _ in range(count):
+            urls = ",".join(
+                f"{pages_url}/{page}/{next(numbers)}.html"
+                for _ in range(urls_per_request)
+            )
+            start = time.perf_counter()
+            async with session.get(api_url, params={"urls": urls}) as resp:
+                results = await resp.json()
+            latencies.append(time.perf_counter() - start)
+            for result in results:
+                status = result["status"]
+                statuses[status] = statuses.get(status, 0) + 1
+
+    try:
+        async with aiohttp.ClientSession() as session:
+            start = time.perf_counter()
+            await asyncio.gather(*[
+                client(session, requests // concurrency)
+                for _ in range(concurrency)
+            ])
+            elapsed = time.perf_counter() - start
+    finally:
+        await runner.cleanup()
+
+    return {
+        "page": page,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "requests_per_second": len(latencies) / elapsed,
+        "articles_per_second": len(latencies) * urls_per_request / elapsed,
+        "latency": summary(latencies),
+        "statuses": statuses,
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    # local pages server serves inosmi.ru articles
+    register(inosmi_ru.ADAPTER, hosts=["127.0.0.1"])
+    with open(HTML_PATH) as f:
+        html = f.read()
+    pages = {
+        "inosmi": html,
+        "large": make_large_article(html, args.large_factor),
+    }
+    runner, pages_url = await start_server(pages_app(pages))
+    try:
+        stages = {
+            page: await measure_stages(pages_url, page, args.repeat)
+            for page in pages
+        }
+        throughput = [
+            await measure_throughput(
+                pages_url, page, concurrency,
+                args.requests, args.urls_per_request,
+            )
+            for page in pages
+            for concurrency in args.concurrency
+        ]
+    finally:
+        await runner.cleanup()
+
+    return {
+        "environment": {
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+        },
+        "stages": stages,
+        "throughput": throughput,
+        # kilobytes on linux, bytes on macos
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="articles per stage measurement")
+    parser.add_argument("--concurrency", type=int, nargs="+",
+                        default=[1, 4, 16],
+                        help="concurrency levels of api clients")
+    parser.add_argument("--requests", type=int, default=32,
+                        help="api requests per concurrency level")
+    parser.add_argument("--urls_per_request", type=int, default=5)
+    parser.add_argument("--large_factor", type=int, default=50,
+                        help="size of large article body, in inosmi bodies")
+    parser.add_argument("--output", help="write json to file")
+    args = parser.parse_args()
+
+    results = asyncio.get_event_loop().run_until_complete(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compares BeautifulSoup and event-based plaintext sanitizing.
+
+usage: python -m benchmarks.sanitize [--repeat N]
+"""
+import argparse
+import os.path
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+from filter.adapters.inosmi_ru import sanitize_plaintext, sanitize_soup
+
+HTML_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "tests", "html", "inosmi.html"
+)
+
+
+def soup_plaintext(html: str) -> str:
+    return sanitize_soup(html, plaintext=True)
+
+
+def make_large_article(html: str, factor: int) -> str:
+    """inflate article body, keeping the rest of the page intact"""
+    start = html.index('<div class="article-body')
+    start = html.index('>', start) + 1
+    # body up to the last paragraph, its tags are balanced
+    end = html.rindex('</p>', start, html.index('</article>', start)) + 4
+    return html[:start] + html[start:end] * factor + html[end:]
+
+
+def measure(
+        func: Callable[[str], str],
+        html: str,
+        repeat: int,
+) -> Tuple[float, int]:
+    """returns mean time in seconds and peak of allocated memory in bytes"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(html)
+    elapsed = (time.perf_counter() - start) / repeat
+
+    tracemalloc.start()
+    func(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(HTML_PATH) as f:
+        html = f.read()
+
+    documents = [
+        ("inosmi.html", html),
+        ("inosmi.html x20 body", make_large_article(html, 20)),
+    ]
+    for name, document in documents:
+        print(f"{name} ({len(document)} chars)")
+        assert sanitize_plaintext(document) == soup_plaintext(document)
+        for label, func in [
+            ("beautifulsoup", soup_plaintext),
+            ("streaming", sanitize_plaintext),
+        ]:
+            elapsed, peak = measure(func, document, args.repeat)
+            print(
+                f"  {label:<14} {elapsed * 1000:8.2f} ms"
+                f"  peak {peak / 1024:9.1f} KiB"
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Measures server cold start: time from process start to the first
+served request, also time of building apps in one process.
+
+usage: python -m benchmarks.startup [--repeat N] [server args...]
+"""
+import argparse
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+from typing import List
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return int(sock.getsockname()[1])
+
+
+def time_to_first_request(server_args: List[str], timeout: float) -> float:
+    """starts server process, polls /metrics until it responds"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "filter.server.server",
+         "--port", str(port), *server_args],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError("server exited")
+            try:
+                with urllib.request.urlopen(
+                    f"http://127.0.0.1:{port}/metrics", timeout=1,
+                ) as response:
+                    response.read()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise TimeoutError("server didn't start")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def time_get_app(repeat: int) -> List[float]:
+    """first get_app call loads dictionaries, next ones reuse them"""
+    start = time.perf_counter()
+    from filter.server.server import get_app
+    samples = [time.perf_counter() - start]  # import is part of cold start
+    for _ in range(repeat):
+        start = time.perf_counter()
+        get_app()
+        samples.append(time.perf_counter() - start)
+    samples[1] += samples.pop(0)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    args, server_args = parser.parse_known_args()
+
+    samples = [
+        time_to_first_request(server_args, args.timeout)
+        for _ in range(args.repeat)
+    ]
+    print(
+        f"first request   median {statistics.median(samples) * 1000:7.1f} ms"
+        f"  min {min(samples) * 1000:7.1f} ms"
+    )
+    cold, *warm = time_get_app(args.repeat)
+    print(f"get_app cold    {cold * 1000:7.1f} ms")
+    print(f"get_app warm    median {statistics.median(warm) * 1000:7.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
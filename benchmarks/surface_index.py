@@ -0,0 +1,93 @@
+"""Compares scoring with lemmatization and with surface forms index:
+accuracy of scores and time per article, also index startup time.
+
+usage: python -m benchmarks.surface_index [--repeat N] [html files...]
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+import pymorphy2
+
+from benchmarks.sanitize import HTML_PATH, make_large_article
+from filter import CHARGED_DICT_FILES
+from filter.adapters import ArticleNotFound
+from filter.adapters.inosmi_ru import sanitize
+from filter.main import read_charged_words
+from filter.text_tools import (
+    ChargedDictionary, SurfaceFormIndex, calculate_jaundice_rate,
+    lemmatize_text, tokenize,
+)
+
+
+def timed(
+        func: Callable[[], List[str]],
+        repeat: int,
+) -> Tuple[List[str], float]:
+    """returns result and mean time in milliseconds"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("files", nargs="*", help="inosmi.ru article pages")
+    args = parser.parse_args()
+
+    morph = pymorphy2.MorphAnalyzer()
+    entries = read_charged_words(CHARGED_DICT_FILES)
+    dictionary = ChargedDictionary(entries, morph)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "surface_index.json")
+        start = time.perf_counter()
+        index = SurfaceFormIndex.load_or_build(path, entries, morph)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        SurfaceFormIndex.load_or_build(path, entries, morph)
+        loaded = time.perf_counter() - start
+    print(
+        f"index: {len(index.forms)} forms of {len(dictionary)} entries, "
+        f"build {built * 1000:.0f} ms, load {loaded * 1000:.0f} ms"
+    )
+
+    with open(HTML_PATH) as f:
+        html = f.read()
+    pages = [("inosmi", html), ("large", make_large_article(html, 50))]
+    for filename in args.files:
+        with open(filename) as f:
+            pages.append((os.path.basename(filename), f.read()))
+
+    print(
+        f"{'':<12} {'words':>14} {'charged':>10} {'score':>12} "
+        f"{'lemmatize ms':>12} {'index ms':>9}"
+    )
+    for name, page in pages:
+        try:
+            text = sanitize(page, plaintext=True)
+        except ArticleNotFound:
+            print(f"{name:<12} article not found")
+            continue
+        lemmas, lemmatize_ms = timed(
+            lambda: lemmatize_text(morph, text), args.repeat
+        )
+        forms, index_ms = timed(
+            lambda: index.lemmatize(tokenize(text)), args.repeat
+        )
+        print(
+            f"{name:<12} "
+            f"{len(lemmas):>6} / {len(forms):<6} "
+            f"{dictionary.count(lemmas):>4} / {index.count(forms):<4} "
+            f"{calculate_jaundice_rate(lemmas, dictionary):>5} / "
+            f"{calculate_jaundice_rate(forms, index):<5} "
+            f"{lemmatize_ms:12.1f} {index_ms:9.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,8 @@
 import os.path
 
 BASE_DIR = os.path.dirname(__file__)
+
+CHARGED_DICT_FILES = [
+    os.path.join(BASE_DIR, "charged_dict/negative_words.txt"),
+    os.path.join(BASE_DIR, "charged_dict/positive_words.txt"),
+]
@@ -1,8 +1,39 @@
+from typing import Callable, Dict, Iterable, Optional
+
+import yarl
+
 from . import inosmi_ru
-from .exceptions import ArticleNotFound
+from .base import Adapter
+from .exceptions import ArticleNotFound, UnsupportedSite
+
+__all__ = [
+    'ADAPTERS', 'SANITIZERS', 'Adapter', 'ArticleNotFound',
+    'UnsupportedSite', 'register', 'find_adapter',
+]
+
+ADAPTERS: Dict[str, Adapter] = {}
+ADAPTERS_BY_HOST: Dict[str, Adapter] = {}
+SANITIZERS: Dict[str, Callable[..., str]] = {}
+
+
+def register(adapter: Adapter, hosts: Optional[Iterable[str]] = None) -> None:
+    """adapter serves its own hosts and their subdomains,
+    or the hosts given"""
+    ADAPTERS[adapter.name] = adapter
+    SANITIZERS[adapter.name] = adapter.sanitize
+    for host in adapter.hosts if hosts is None else hosts:
+        ADAPTERS_BY_HOST[host.lower()] = adapter
+
+
+def find_adapter(url: str) -> Adapter:
+    """adapter for site of url, raises UnsupportedSite if there is none"""
+    host = (yarl.URL(url).host or "").lower()
+    while host:
+        adapter = ADAPTERS_BY_HOST.get(host)
+        if adapter is not None:
+            return adapter
+        _, _, host = host.partition(".")  # try parent domain
+    raise UnsupportedSite(url)
 
-__all__ = ['SANITIZERS', 'ArticleNotFound']
 
-SANITIZERS = {
-    'inosmi_ru': inosmi_ru.sanitize,
-}
+register(inosmi_ru.ADAPTER)
@@ -0,0 +1,77 @@
+from typing import Iterable, Sequence
+
+from .exceptions import ArticleNotFound
+from .html_tools import (
+    remove_buzz_attrs, remove_buzz_tags, remove_all_tags,
+    compile_selector, PlaintextExtractor, DEFAULT_BLACKLIST_TAGS,
+)
+
+
+class Adapter:
+    """Sanitizer of articles of some site.
+
+    Site is described by selectors of the article element and of buzz
+    blocks inside it, selectors are compiled once.
+    """
+
+    def __init__(
+            self,
+            name: str,
+            hosts: Iterable[str],
+            article_selector: str,
+            buzz_selectors: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.hosts = tuple(host.lower() for host in hosts)
+        self.article = compile_selector(article_selector)
+        self.buzz = tuple(compile_selector(s) for s in buzz_selectors)
+        self._plaintext_skip = (
+            *self.buzz, *map(compile_selector, DEFAULT_BLACKLIST_TAGS),
+        )
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.name!r})"
+
+    def get_plaintext_extractor(self) -> PlaintextExtractor:
+        return PlaintextExtractor(self.article, self._plaintext_skip)
+
+    def sanitize_plaintext(self, html: str) -> str:
+        """same as sanitize(html, plaintext=True), but doesn't build soup"""
+        extractor = self.get_plaintext_extractor()
+        extractor.feed(html)
+        return extractor.get_text()
+
+    def sanitize_soup(self, html: str, plaintext: bool = False) -> str:
+        # bs4 takes a while to import, plaintext path doesn't need it
+        from bs4 import BeautifulSoup
+
+        soup = BeautifulSoup(html, 'html.parser')
+        articles = soup.find_all(self.article.matches_tag)
+
+        if len(articles) != 1:
+            raise ArticleNotFound()
+
+        article = articles[0]
+        article.attrs = {}
+
+        buzz_blocks = [
+            el for selector in self.buzz
+            for el in article.find_all(selector.matches_tag)
+        ]
+        for el in buzz_blocks:
+            el.decompose()
+
+        remove_buzz_attrs(article)
+        remove_buzz_tags(article)
+
+        if not plaintext:
+            text = article.prettify()
+        else:
+            remove_all_tags(article)
+            text = article.get_text()
+        return text.strip()
+
+    def sanitize(self, html: str, plaintext: bool = False) -> str:
+        if plaintext:
+            return self.sanitize_plaintext(html)
+        return self.sanitize_soup(html)
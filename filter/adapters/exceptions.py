@@ -1,2 +1,6 @@
 class ArticleNotFound(Exception):
     pass
+
+
+class UnsupportedSite(ArticleNotFound):
+    """there is no adapter for the site, article isn't even fetched"""
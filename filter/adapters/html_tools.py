@@ -1,6 +1,12 @@
-from typing import Optional, List
+from html.parser import HTMLParser
+from typing import (
+    FrozenSet, List, NamedTuple, Optional, Sequence, Tuple, TYPE_CHECKING
+)
 
-import bs4
+from .exceptions import ArticleNotFound
+
+if TYPE_CHECKING:
+    import bs4
 
 DEFAULT_BLACKLIST_TAGS = [
     'script',
@@ -17,8 +23,21 @@ DEFAULT_UNWRAPLIST_TAGS = [
     'footer'
 ]
 
+# tags which can't have children, like in html.parser tree builder of bs4
+VOID_TAGS = frozenset([
+    'area', 'base', 'basefont', 'bgsound', 'br', 'col', 'command', 'embed',
+    'frame', 'hr', 'image', 'img', 'input', 'isindex', 'keygen', 'link',
+    'menuitem', 'meta', 'nextid', 'param', 'source', 'spacer', 'track', 'wbr',
+])
+
+# bs4 doesn't count content of these tags as text
+NON_TEXT_TAGS = frozenset(['script', 'style', 'template'])
+
+# bs4 keeps whitespace-only strings inside these tags as is
+PRESERVE_WHITESPACE_TAGS = frozenset(['pre', 'textarea'])
+
 
-def remove_buzz_attrs(soup: bs4.Tag) -> bs4.Tag:
+def remove_buzz_attrs(soup: 'bs4.Tag') -> 'bs4.Tag':
     """Remove all attributes except some special tags."""
     for tag in soup.find_all(True):
         if tag.name == 'a':
@@ -36,7 +55,7 @@ def remove_buzz_attrs(soup: bs4.Tag) -> bs4.Tag:
 
 
 def remove_buzz_tags(
-        soup: bs4.Tag,
+        soup: 'bs4.Tag',
         blacklist: Optional[List[str]] = None,
         unwraplist: Optional[List[str]] = None,
 ) -> None:
@@ -54,7 +73,150 @@ def remove_buzz_tags(
             tag.unwrap()
 
 
-def remove_all_tags(soup: bs4.Tag) -> None:
+def remove_all_tags(soup: 'bs4.Tag') -> None:
     """Unwrap all tags."""
     for tag in soup.find_all(True):
         tag.unwrap()
+
+
+class Selector(NamedTuple):
+    """compiled simple css selector, e.g. footer.article-footer"""
+    tag: Optional[str]
+    classes: FrozenSet[str]
+
+    def matches(
+            self,
+            tag: str,
+            attrs: Sequence[Tuple[str, Optional[str]]],
+    ) -> bool:
+        if self.tag is not None and self.tag != tag:
+            return False
+        if not self.classes:
+            return True
+        for name, value in attrs:
+            if name == 'class' and value:
+                return self.classes.issubset(value.split())
+        return False
+
+    def matches_tag(self, tag: 'bs4.Tag') -> bool:
+        """the same for BeautifulSoup tag, e.g. for soup.find_all"""
+        if self.tag is not None and self.tag != tag.name:
+            return False
+        return self.classes.issubset(tag.get('class') or ())
+
+
+def compile_selector(selector: str) -> Selector:
+    """supports only tag name and classes: tag, .cls, tag.cls1.cls2"""
+    tag, *classes = selector.strip().split('.')
+    return Selector(tag.lower() or None, frozenset(classes))
+
+
+class PlaintextExtractor(HTMLParser):
+    """Event-based alternative to BeautifulSoup for plaintext sanitizing.
+
+    Collects text inside the single container element and skips subtrees
+    matching skip selectors while html is fed chunk by chunk,
+    so no document tree is ever built.
+    """
+
+    def __init__(
+            self,
+            container: Selector,
+            skip: Sequence[Selector] = (),
+    ) -> None:
+        super().__init__(convert_charrefs=True)
+        self.container = container
+        self.skip = tuple(skip)
+        self.containers_found = 0
+        self._open_tags: List[str] = []
+        self._container_depth: Optional[int] = None
+        self._skip_depth: Optional[int] = None
+        self._chunks: List[str] = []
+        self._string: List[str] = []
+
+    def _end_string(self) -> None:
+        """text node is finished, called on every markup event"""
+        if not self._string:
+            return
+        string = ''.join(self._string)
+        self._string = []
+        # collapse whitespace-only strings the same way bs4 does
+        if not string.strip() and not any(
+                t in PRESERVE_WHITESPACE_TAGS for t in self._open_tags
+        ):
+            string = '\n' if '\n' in string else ' '
+        self._chunks.append(string)
+
+    def handle_starttag(
+            self,
+            tag: str,
+            attrs: List[Tuple[str, Optional[str]]],
+    ) -> None:
+        self._end_string()
+        is_container = self.container.matches(tag, attrs)
+        if is_container:
+            self.containers_found += 1
+        if tag in VOID_TAGS:
+            return
+
+        self._open_tags.append(tag)
+        depth = len(self._open_tags)
+        if self._container_depth is None:
+            if is_container:
+                self._container_depth = depth
+        elif self._skip_depth is None and (
+                tag in NON_TEXT_TAGS or
+                any(s.matches(tag, attrs) for s in self.skip)
+        ):
+            self._skip_depth = depth
+
+    def handle_startendtag(
+            self,
+            tag: str,
+            attrs: List[Tuple[str, Optional[str]]],
+    ) -> None:
+        self._end_string()
+        if self.container.matches(tag, attrs):
+            self.containers_found += 1
+
+    def handle_endtag(self, tag: str) -> None:
+        self._end_string()
+        if tag not in self._open_tags:
+            return  # stray end tag, ignored by bs4 too
+        while self._open_tags.pop() != tag:
+            pass
+        depth = len(self._open_tags)
+        if self._skip_depth is not None and depth < self._skip_depth:
+            self._skip_depth = None
+        if self._container_depth is not None and depth < self._container_depth:
+            self._container_depth = None
+
+    def handle_data(self, data: str) -> None:
+        if self._container_depth is not None and self._skip_depth is None:
+            self._string.append(data)
+
+    def handle_comment(self, data: str) -> None:
+        self._end_string()
+
+    def handle_decl(self, decl: str) -> None:
+        self._end_string()
+
+    def handle_pi(self, data: str) -> None:
+        self._end_string()
+
+    def close(self) -> None:
+        super().close()
+        self._end_string()
+
+    def pop_text(self) -> str:
+        """text of strings finished since previous call"""
+        text = ''.join(self._chunks)
+        self._chunks = []
+        return text
+
+    def get_text(self) -> str:
+        """finish parsing and return text of the container"""
+        self.close()
+        if self.containers_found != 1:
+            raise ArticleNotFound()
+        return self.pop_text().strip()
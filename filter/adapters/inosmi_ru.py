@@ -1,33 +1,30 @@
-from bs4 import BeautifulSoup
+from .base import Adapter
+from .html_tools import PlaintextExtractor
 
-from .exceptions import ArticleNotFound
-from .html_tools import remove_buzz_attrs, remove_buzz_tags, remove_all_tags
+ARTICLE_SELECTOR = "article.article"
+BUZZ_SELECTORS = [
+    ".article-disclaimer",
+    "footer.article-footer",
+    "aside",
+]
+
+ADAPTER = Adapter(
+    "inosmi_ru", ["inosmi.ru"], ARTICLE_SELECTOR, BUZZ_SELECTORS
+)
+
+
+def get_plaintext_extractor() -> PlaintextExtractor:
+    return ADAPTER.get_plaintext_extractor()
+
+
+def sanitize_plaintext(html: str) -> str:
+    """same as sanitize(html, plaintext=True), but doesn't build soup"""
+    return ADAPTER.sanitize_plaintext(html)
+
+
+def sanitize_soup(html: str, plaintext: bool = False) -> str:
+    return ADAPTER.sanitize_soup(html, plaintext)
 
 
 def sanitize(html: str, plaintext: bool = False) -> str:
-    soup = BeautifulSoup(html, 'html.parser')
-    articles = soup.select("article.article")
-
-    if len(articles) != 1:
-        raise ArticleNotFound()
-
-    article = articles[0]
-    article.attrs = {}
-
-    buzz_blocks = [
-        *article.select('.article-disclaimer'),
-        *article.select('footer.article-footer'),
-        *article.select('aside'),
-    ]
-    for el in buzz_blocks:
-        el.decompose()
-
-    remove_buzz_attrs(article)
-    remove_buzz_tags(article)
-
-    if not plaintext:
-        text = article.prettify()
-    else:
-        remove_all_tags(article)
-        text = article.get_text()
-    return text.strip()
+    return ADAPTER.sanitize(html, plaintext)
@@ -0,0 +1,428 @@
+"""Offline scoring of saved pages, no network involved.
+
+Pages are read from a directory, a tarball or a WARC file (plain or
+gzipped) one by one, so archives of any size never sit in memory.
+They are scored in worker processes, results are written in input
+order to JSON lines or CSV. Progress is saved to a checkpoint file,
+an interrupted job started again continues where it stopped.
+
+usage: score-archive crawl.warc.gz --output results.jsonl --workers 8
+"""
+import argparse
+import collections
+import contextlib
+import csv
+import dataclasses
+import functools
+import gzip
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import tarfile
+import zlib
+from concurrent.futures import Executor, Future
+from typing import (
+    IO, Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple,
+    cast,
+)
+
+from filter import CHARGED_DICT_FILES
+from filter.adapters import ADAPTERS, ArticleNotFound, find_adapter
+from filter.charset import find_charset
+from filter.main import Result, ProcessingStatus, read_charged_words
+from filter.pool import create_pool, process_article
+from filter.server.encoder import dumps
+from filter.text_tools import (
+    ChargedDictionary, calculate_jaundice_rate, get_morph_analyzer,
+    DEFAULT_LEMMA_CACHE_SIZE,
+)
+
+HTML_EXTENSIONS = (".html", ".htm")
+DEFAULT_CHECKPOINT_EVERY = 100
+PENDING_PER_WORKER = 4  # pages read ahead, bounds memory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass()
+class Page:
+    url: str  # url of archived page or path of saved file
+    content: bytes
+    charset: Optional[str] = None
+    http_status: Optional[int] = None
+    adapter: Optional[str] = None  # name, found by url if None
+
+
+def _is_html(name: str) -> bool:
+    return name.lower().endswith(HTML_EXTENSIONS)
+
+
+def read_directory(path: str) -> Iterator[Page]:
+    """html files of directory and subdirectories in stable order"""
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for filename in sorted(files):
+            if not _is_html(filename):
+                continue
+            filepath = os.path.join(root, filename)
+            with open(filepath, "rb") as f:
+                content = f.read()
+            yield Page(os.path.relpath(filepath, path), content)
+
+
+def read_tarball(path: str) -> Iterator[Page]:
+    """html files of tarball, read as a stream"""
+    with tarfile.open(path, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile() or not _is_html(member.name):
+                continue
+            f = tar.extractfile(member)
+            if f is not None:
+                yield Page(member.name, f.read())
+
+
+def _read_headers(f: IO[bytes]) -> Dict[str, str]:
+    """reads "Name: value" lines until empty line, names are lowercase"""
+    headers = {}
+    for line in iter(f.readline, b""):
+        line = line.strip()
+        if not line:
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+
+def _charset(content_type: str) -> Optional[str]:
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.partition("=")
+        if name.strip().lower() == "charset":
+            return value.strip().strip('"') or None
+    return None
+
+
+def _dechunk(body: bytes) -> bytes:
+    """decodes chunked transfer encoding, tolerates truncated bodies"""
+    chunks = []
+    stream = io.BytesIO(body)
+    for line in iter(stream.readline, b""):
+        size = int(line.split(b";")[0].strip() or b"0", 16)
+        if not size:
+            break
+        chunks.append(stream.read(size))
+        stream.readline()
+    return b"".join(chunks)
+
+
+def _decompress(body: bytes, encoding: str) -> bytes:
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+    if encoding == "deflate":
+        return zlib.decompress(body)
+    return body
+
+
+def _parse_http_response(url: str, block: bytes) -> Optional[Page]:
+    """page of archived http response, None if it isn't html"""
+    stream = io.BytesIO(block)
+    status_line = stream.readline().split()
+    headers = _read_headers(stream)
+    body = stream.read()
+    content_type = headers.get("content-type", "")
+    if content_type and "html" not in content_type.lower():
+        return None
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        body = _dechunk(body)
+    try:
+        body = _decompress(body, headers.get("content-encoding", "").lower())
+    except zlib.error:
+        logger.warning("Couldn't decompress %s", url)
+    status = int(status_line[1]) if len(status_line) > 1 else None
+    return Page(url, body, _charset(content_type), status)
+
+
+def read_warc(path: str) -> Iterator[Page]:
+    """html pages of response and resource records of WARC file,
+    gzipped files are read as a stream too"""
+    if path.endswith(".gz"):
+        f = cast(IO[bytes], gzip.open(path, "rb"))
+    else:
+        f = open(path, "rb")
+    with f:
+        skipping = False
+        for line in iter(f.readline, b""):
+            if not line.strip():
+                continue  # records are separated with empty lines
+            if not line.startswith(b"WARC/"):
+                if not skipping:  # look for the next record
+                    logger.warning(
+                        "%s: not a WARC record: %r", path, line[:20]
+                    )
+                    skipping = True
+                continue
+            skipping = False
+            headers = _read_headers(f)
+            url = headers.get("warc-target-uri", "").strip("<>")
+            try:
+                length = int(headers.get("content-length", 0))
+                if length < 0:  # f.read would read the rest of the file
+                    raise ValueError(f"negative Content-Length {length}")
+            except ValueError:
+                logger.warning("%s: malformed WARC record of %s", path, url)
+                skipping = True
+                continue
+            block = f.read(length)
+            record_type = headers.get("warc-type")
+            content_type = headers.get("content-type", "")
+            if not url:
+                continue
+            if record_type == "response" \
+                    and content_type.startswith("application/http"):
+                try:
+                    page = _parse_http_response(url, block)
+                except ValueError:
+                    logger.warning("%s: malformed http response of %s",
+                                   path, url, exc_info=True)
+                    continue
+                if page is not None:
+                    yield page
+            elif record_type == "resource" and "html" in content_type:
+                yield Page(url, block, _charset(content_type))
+
+
+def read_pages(path: str) -> Iterator[Page]:
+    if os.path.isdir(path):
+        return read_directory(path)
+    if ".warc" in os.path.basename(path):
+        return read_warc(path)
+    return read_tarball(path)
+
+
+@functools.lru_cache(maxsize=None)
+def load_charged_words() -> ChargedDictionary:
+    """loaded once per process, forked workers inherit it"""
+    return ChargedDictionary(
+        read_charged_words(CHARGED_DICT_FILES), get_morph_analyzer()
+    )
+
+
+def _page_url(page: Page) -> str:
+    """saved files may be named like host/path, as wget saves them"""
+    return page.url if "://" in page.url else f"http://{page.url}"
+
+
+def score_page(page: Page) -> Result:
+    """runs in worker process"""
+    if page.http_status is not None and not 200 <= page.http_status < 300:
+        return Result(ProcessingStatus.FETCH_ERROR, page.url)
+    try:
+        adapter = ADAPTERS[page.adapter] if page.adapter \
+            else find_adapter(_page_url(page))
+        charset = find_charset(page.content, page.charset)
+        words, _ = process_article(page.content, adapter.name, charset)
+    except ArticleNotFound:
+        return Result(ProcessingStatus.PARSING_ERROR, page.url)
+    except Exception:
+        # one broken page must not stop the job, it would fail again
+        # on the same page after restart
+        logger.exception("Couldn't score %s", page.url)
+        return Result(ProcessingStatus.PARSING_ERROR, page.url)
+    score = calculate_jaundice_rate(words, load_charged_words())
+    return Result(ProcessingStatus.OK, page.url, score, len(words))
+
+
+def score_pages(
+        pages: Iterable[Page],
+        executor: Optional[Executor] = None,
+        workers: int = 1,
+) -> Iterator[Result]:
+    """results in order of pages, only a few pages per worker
+    are read ahead"""
+    if executor is None:
+        yield from map(score_page, pages)
+        return
+    pending: Deque[Future] = collections.deque()
+    for page in pages:
+        pending.append(executor.submit(score_page, page))
+        if len(pending) >= workers * PENDING_PER_WORKER:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def format_jsonl(result: Result) -> bytes:
+    return dumps(result).encode() + b"\n"
+
+
+CSV_FIELDS = [field.name for field in dataclasses.fields(Result)]
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, ProcessingStatus):
+        return value.value
+    return value
+
+
+def format_csv(result: Result) -> bytes:
+    row = io.StringIO()
+    csv.writer(row).writerow([
+        _csv_value(getattr(result, name)) for name in CSV_FIELDS
+    ])
+    return row.getvalue().encode()
+
+
+FORMATS: Dict[str, Tuple[bytes, Callable[[Result], bytes]]] = {
+    "jsonl": (b"", format_jsonl),
+    "csv": (",".join(CSV_FIELDS).encode() + b"\r\n", format_csv),
+}
+
+
+@dataclasses.dataclass()
+class Checkpoint:
+    """number of pages done and size of output holding their results"""
+    input: str
+    done: int = 0
+    output_size: int = 0
+
+    @classmethod
+    def load(cls, path: str, input_path: str) -> Optional['Checkpoint']:
+        try:
+            with open(path) as f:
+                checkpoint = cls(**json.load(f))
+        except FileNotFoundError:
+            return None
+        if checkpoint.input != input_path:
+            raise ValueError(
+                f"checkpoint {path} is for {checkpoint.input}, "
+                f"not {input_path}"
+            )
+        return checkpoint
+
+    def save(self, path: str) -> None:
+        with open(path + ".tmp", "w") as f:
+            json.dump(dataclasses.asdict(self), f)
+        os.replace(path + ".tmp", path)
+
+
+def run(
+        input_path: str,
+        output: str,
+        output_format: str = "jsonl",
+        workers: int = 1,
+        adapter: Optional[str] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+        lemma_cache_size: int = DEFAULT_LEMMA_CACHE_SIZE,
+) -> Dict[str, int]:
+    """scores pages of input, returns number of results by status"""
+    header, format_result = FORMATS[output_format]
+    if checkpoint_path is None:
+        checkpoint_path = output + ".checkpoint"
+    input_path = os.path.abspath(input_path)
+    checkpoint = Checkpoint.load(checkpoint_path, input_path)
+    if checkpoint is None:
+        checkpoint = Checkpoint(input_path)
+    else:
+        logger.info("Resuming after %s pages", checkpoint.done)
+
+    pages: Iterable[Page] = itertools.islice(
+        read_pages(input_path), checkpoint.done, None
+    )
+    if adapter is not None:
+        pages = (dataclasses.replace(page, adapter=adapter) for page in pages)
+
+    load_charged_words()  # before forking, so workers share it
+    executor = create_pool(workers, lemma_cache_size) if workers > 1 \
+        else None
+    statuses: Dict[str, int] = collections.Counter()
+    try:
+        with open(output, "ab") as sink:
+            sink.truncate(checkpoint.output_size)  # drop unsaved results
+            if not checkpoint.output_size:
+                sink.write(header)
+            results = score_pages(pages, executor, workers)
+            for i, result in enumerate(results, 1):
+                sink.write(format_result(result))
+                statuses[result.status.value] += 1
+                if i % checkpoint_every == 0:
+                    sink.flush()
+                    checkpoint.done += checkpoint_every
+                    checkpoint.output_size = sink.tell()
+                    checkpoint.save(checkpoint_path)
+                    logger.info("%s pages done", checkpoint.done)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(checkpoint_path)  # job is done
+    return dict(statuses)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="scores saved pages: directory of html files, "
+                    "tarball or WARC file",
+    )
+    parser.add_argument("input", help="directory, tarball or WARC file")
+    parser.add_argument(
+        "--output", "-o", required=True, help="file for results",
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="jsonl",
+        help="format of results",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes, 1 means scoring in this process",
+    )
+    parser.add_argument(
+        "--adapter",
+        choices=sorted(ADAPTERS),
+        help="adapter for all pages, by default it is found by url, "
+             "files named like host/path are treated as urls",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="progress file, output file name with .checkpoint by default",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        default=DEFAULT_CHECKPOINT_EVERY,
+        help="save progress after this number of pages",
+    )
+    parser.add_argument(
+        "--lemma_cache_size",
+        type=int,
+        default=DEFAULT_LEMMA_CACHE_SIZE,
+        help="max number of cached word normal forms per worker",
+    )
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    statuses = run(
+        args.input,
+        args.output,
+        output_format=args.format,
+        workers=args.workers,
+        adapter=args.adapter,
+        checkpoint_path=args.checkpoint,
+        checkpoint_every=args.checkpoint_every,
+        lemma_cache_size=args.lemma_cache_size,
+    )
+    for status, count in sorted(statuses.items()):
+        print(f"{status:<15} {count}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
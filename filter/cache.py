@@ -0,0 +1,177 @@
+"""Two-tier cache of scoring results.
+
+L1 is a bounded in-process LRU cache with TTL,
+L2 is an optional shared cache (redis), any aiocache backend fits.
+Results are keyed by normalized url and version of charged dictionary.
+"""
+import dataclasses
+import functools
+import logging
+import time
+from collections import OrderedDict
+from typing import (
+    Any, Callable, Dict, Generic, Hashable, Optional, Tuple, TypeVar, cast,
+    TYPE_CHECKING,
+)
+
+from filter.main import Result, ProcessingStatus
+from filter.text_tools import ChargedWords, dictionary_version
+from filter.urls import normalize_url
+
+if TYPE_CHECKING:
+    from filter.main import ArticleScorerStrategy
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60
+
+# results of these statuses depend on network luck, so never cached
+NOT_CACHEABLE_STATUSES = frozenset([
+    ProcessingStatus.TIMEOUT,
+    ProcessingStatus.FETCH_ERROR,
+])
+
+logger = logging.getLogger(__name__)
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class MemoryCache(Generic[K, V]):
+    """bounded LRU cache, entries expire after ttl seconds"""
+
+    def __init__(
+            self,
+            maxsize: int = DEFAULT_CACHE_SIZE,
+            ttl: Optional[float] = DEFAULT_CACHE_TTL,
+            clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: 'OrderedDict[K, Tuple[float, V]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        try:
+            expires_at, value = self._entries[key]
+        except KeyError:
+            return None
+        if expires_at <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: K, value: V) -> None:
+        if self.maxsize <= 0:
+            return
+        ttl = float("inf") if self.ttl is None else self.ttl
+        self._entries[key] = (self._clock() + ttl, value)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)  # evict least recently used
+
+    def delete(self, key: K) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+@dataclasses.dataclass()
+class TierStats:
+    hits: int = 0
+    misses: int = 0
+    errors: int = 0
+
+
+def is_cacheable(result: Result) -> bool:
+    return result.status not in NOT_CACHEABLE_STATUSES
+
+
+def cache_key(url: str, charged_words: Optional[ChargedWords] = None) -> str:
+    """normalized url prefixed with version of charged dictionary,
+    so results scored with another dictionary are never returned"""
+    url = normalize_url(url)
+    version = dictionary_version(charged_words or ())
+    return f"{version}:{url}" if version else url
+
+
+class ResultsCache:
+    """Looks for results in memory first, then in shared cache.
+
+    Shared cache is any aiocache-compatible object, its failures
+    are logged and treated as misses.
+    """
+
+    def __init__(
+            self,
+            memory: MemoryCache[str, Result],
+            shared: Any = None,
+            ttl: Optional[float] = DEFAULT_CACHE_TTL,
+    ) -> None:
+        self.memory = memory
+        self.shared = shared
+        self.ttl = ttl
+        self.stats: Dict[str, TierStats] = {"memory": TierStats()}
+        if shared is not None:
+            self.stats["shared"] = TierStats()
+
+    async def get(self, key: str) -> Optional[Result]:
+        result = self.memory.get(key)
+        if result is not None:
+            self.stats["memory"].hits += 1
+            return result
+        self.stats["memory"].misses += 1
+
+        if self.shared is None:
+            return None
+        stats = self.stats["shared"]
+        try:
+            result = await self.shared.get(key)
+        except Exception:
+            stats.errors += 1
+            logger.exception("Couldn't retrieve %s from shared cache", key)
+            return None
+        if result is None:
+            stats.misses += 1
+            return None
+        stats.hits += 1
+        self.memory.set(key, result)
+        return result
+
+    async def set(self, key: str, result: Result) -> None:
+        if not is_cacheable(result):
+            return
+        self.memory.set(key, result)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(key, result, ttl=self.ttl)
+        except Exception:
+            self.stats["shared"].errors += 1
+            logger.exception("Couldn't set %s in shared cache", key)
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+    def decorate(
+            self,
+            score_article: 'ArticleScorerStrategy',
+    ) -> 'ArticleScorerStrategy':
+        """wraps scoring strategy, results are cached by normalized url
+        and dictionary version, see cache_key"""
+        @functools.wraps(score_article)
+        async def cached_score_article(url: str, **kwargs: Any) -> Result:
+            key = cache_key(url, kwargs.get("charged_words"))
+            result = await self.get(key)
+            if result is None:
+                result = await score_article(url=url, **kwargs)
+                await self.set(key, result)
+            elif result.url != url:  # cached for another form of the url
+                result = dataclasses.replace(result, url=url)
+            return result
+        return cast('ArticleScorerStrategy', cached_score_article)
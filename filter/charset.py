@@ -0,0 +1,78 @@
+"""Decoding of fetched pages.
+
+Charset is taken from Content-Type header, byte order mark or
+<meta> tag, in this order. Only pages declaring nothing are checked
+for utf-8 and, if they aren't utf-8, run through charset detection,
+which is slow on large pages. Wrong charsets never fail decoding,
+undecodable bytes are replaced.
+"""
+import codecs
+import re
+from typing import Optional, Tuple
+
+from filter.metrics import CHARSETS
+
+META_SNIFF_SIZE = 4096  # html spec says 1024, but pages are sloppy
+META_CHARSET_REGEX = re.compile(
+    rb"""<meta[^>]+?charset\s*=\s*["']?\s*([a-z0-9_.:-]+)""",
+    flags=re.IGNORECASE,
+)
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+def _known(charset: Optional[str]) -> Optional[str]:
+    """charset if python has a codec for it"""
+    if not charset:
+        return None
+    try:
+        return codecs.lookup(charset).name
+    except LookupError:
+        return None
+
+
+def sniff_charset(body: bytes) -> Tuple[Optional[str], str]:
+    """charset declared by byte order mark or <meta> tag,
+    returns charset and where it was found"""
+    for bom, charset in BOMS:
+        if body.startswith(bom):
+            return charset, "bom"
+    match = META_CHARSET_REGEX.search(body, 0, META_SNIFF_SIZE)
+    if match is not None:
+        meta_charset = _known(match.group(1).decode("ascii"))
+        if meta_charset is not None:
+            return meta_charset, "meta"
+    return None, "none"
+
+
+def find_charset(body: bytes, declared: Optional[str] = None) -> Optional[str]:
+    """charset declared in header, by byte order mark or in <meta>,
+    None if page declares nothing"""
+    charset = _known(declared)
+    source = "header"
+    if charset is None:
+        charset, source = sniff_charset(body)
+    CHARSETS.inc(source=source)
+    return charset
+
+
+def _detect(body: bytes) -> str:
+    # aiohttp depends on one of them
+    try:
+        import cchardet as chardet  # type: ignore
+    except ImportError:
+        import chardet  # type: ignore
+    return _known(chardet.detect(body)["encoding"]) or "utf-8"
+
+
+def decode_html(body: bytes, charset: Optional[str] = None) -> str:
+    """decodes page with charset found by find_charset"""
+    if charset is None:
+        try:
+            return body.decode("utf-8")
+        except UnicodeDecodeError:
+            charset = _detect(body)
+    return body.decode(charset, errors="replace")
@@ -0,0 +1,130 @@
+"""Compact binary representation of Result for caches.
+
+Layout (network byte order):
+version (1 byte), status (1 byte), flags (1 byte),
+score (8 bytes double), words_count (4 bytes unsigned),
+url (utf-8, rest of the value).
+Values of unknown version are treated as missing, so old entries
+are safely ignored after layout changes.
+
+Validated results (see filter.revalidation) are prefixed with
+version (1 byte), lengths of ETag and Last-Modified (2 bytes each,
+0xffff if missing) and the values (utf-8).
+"""
+import struct
+from typing import List, Optional, Tuple
+
+from filter.main import Result, ProcessingStatus
+from filter.revalidation import Validated
+
+VERSION = 1
+
+_HEADER = struct.Struct("!BBBdI")
+
+# codes are part of stored data, never reuse or change them
+STATUS_CODES = {
+    ProcessingStatus.OK: 0,
+    ProcessingStatus.FETCH_ERROR: 1,
+    ProcessingStatus.PARSING_ERROR: 2,
+    ProcessingStatus.TIMEOUT: 3,
+}
+_STATUSES = {code: status for status, code in STATUS_CODES.items()}
+
+_VALIDATORS_HEADER = struct.Struct("!BHH")
+_MISSING = 0xffff
+
+_HAS_SCORE = 1
+_HAS_WORDS_COUNT = 2
+
+
+def encode_result(result: Result) -> bytes:
+    flags = 0
+    if result.score is not None:
+        flags |= _HAS_SCORE
+    if result.words_count is not None:
+        flags |= _HAS_WORDS_COUNT
+    header = _HEADER.pack(
+        VERSION,
+        STATUS_CODES[result.status],
+        flags,
+        result.score or 0.0,
+        result.words_count or 0,
+    )
+    return header + result.url.encode("utf-8")
+
+
+def decode_result(data: bytes) -> Optional[Result]:
+    """returns None for data of unknown format"""
+    if len(data) < _HEADER.size or data[0] != VERSION:
+        return None
+    _, code, flags, score, words_count = _HEADER.unpack_from(data)
+    status = _STATUSES.get(code)
+    if status is None:
+        return None
+    return Result(
+        status=status,
+        url=data[_HEADER.size:].decode("utf-8"),
+        score=score if flags & _HAS_SCORE else None,
+        words_count=words_count if flags & _HAS_WORDS_COUNT else None,
+    )
+
+
+class ResultSerializer:
+    """aiocache serializer based on encode_result/decode_result"""
+    encoding = None  # values are bytes
+
+    def dumps(self, value: Result) -> bytes:
+        return encode_result(value)
+
+    def loads(self, value: Optional[bytes]) -> Optional[Result]:
+        if value is None:
+            return None
+        return decode_result(value)
+
+
+def _encode_validator(value: Optional[str]) -> Tuple[int, bytes]:
+    if value is None:
+        return _MISSING, b""
+    data = value.encode("utf-8")[:_MISSING - 1]
+    return len(data), data
+
+
+def encode_validated(validated: Validated) -> bytes:
+    etag_len, etag = _encode_validator(validated.etag)
+    last_modified_len, last_modified = _encode_validator(
+        validated.last_modified
+    )
+    header = _VALIDATORS_HEADER.pack(VERSION, etag_len, last_modified_len)
+    return header + etag + last_modified + encode_result(validated.result)
+
+
+def decode_validated(data: bytes) -> Optional[Validated]:
+    """returns None for data of unknown format"""
+    if len(data) < _VALIDATORS_HEADER.size or data[0] != VERSION:
+        return None
+    _, etag_len, last_modified_len = _VALIDATORS_HEADER.unpack_from(data)
+    values: List[Optional[str]] = []
+    offset = _VALIDATORS_HEADER.size
+    for length in [etag_len, last_modified_len]:
+        if length == _MISSING:
+            values.append(None)
+        else:
+            values.append(data[offset:offset + length].decode("utf-8"))
+            offset += length
+    result = decode_result(data[offset:])
+    if result is None:
+        return None
+    return Validated(result, *values)
+
+
+class ValidatedSerializer:
+    """aiocache serializer based on encode_validated/decode_validated"""
+    encoding = None  # values are bytes
+
+    def dumps(self, value: Validated) -> bytes:
+        return encode_validated(value)
+
+    def loads(self, value: Optional[bytes]) -> Optional[Validated]:
+        if value is None:
+            return None
+        return decode_validated(value)
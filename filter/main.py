@@ -1,12 +1,15 @@
 import asyncio
+import codecs
 import enum
 import contextlib
 import dataclasses
 import logging
 import time
+from concurrent.futures import Executor
 
 from typing import (
-    List, Optional, Generator, Coroutine, Any, TYPE_CHECKING
+    Any, AsyncGenerator, AsyncIterator, Coroutine, Dict, Generator, Iterable,
+    List, Optional, Set, Tuple, TYPE_CHECKING,
 )
 
 import aiohttp
@@ -14,13 +17,24 @@ import aionursery
 import pymorphy2
 import async_timeout
 
-from filter.adapters import ArticleNotFound
-from filter.adapters.inosmi_ru import sanitize
-from filter.text_tools import split_by_words, calculate_jaundice_rate
+from filter.adapters import ArticleNotFound, find_adapter
+from filter.charset import META_SNIFF_SIZE, decode_html, find_charset
+from filter.metrics import OVERSIZED, RESULTS, StageTimings, measure
+from filter.pool import process_in_pool
+from filter.scheduler import PRIORITY_INTERACTIVE, requested_by
+from filter.urls import normalize_url
+from filter.text_tools import (
+    split_by_words, calculate_jaundice_rate, LemmaCache, ChargedWords,
+    WordsCounter, SurfaceFormIndex, ScoresCache, dictionary_version, tokenize,
+)
 
 if TYPE_CHECKING:
     from typing_extensions import Protocol
 
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_BODY_SIZE = 5 * 1024 * 1024
+WORDS_PER_STEP = 200  # words lemmatized between releases of event loop
+
 
 class ProcessingStatus(enum.Enum):
     OK = "OK"
@@ -39,6 +53,26 @@ def timer() -> Generator[None, None, None]:
         logging.info(message.format(time.monotonic() - start))
 
 
+class TimeBudget:
+    """Timeout shared by several awaits,
+    only time spent inside timeout() blocks is counted."""
+
+    def __init__(self, seconds: float) -> None:
+        self.left = seconds
+
+    @contextlib.asynccontextmanager
+    async def timeout(self) -> AsyncIterator[None]:
+        start = time.monotonic()
+        try:
+            async with async_timeout.timeout(max(self.left, 0)):
+                yield
+        finally:
+            self.left -= time.monotonic() - start
+        if self.left < 0:
+            # synchronous code inside block can't be interrupted
+            raise asyncio.TimeoutError()
+
+
 @dataclasses.dataclass()
 class Result:
     status: ProcessingStatus
@@ -55,30 +89,230 @@ def read_charged_words(files: List[str]) -> List[str]:
     return words
 
 
+class BodyTooLarge(aiohttp.ClientPayloadError):
+    """page is larger than allowed, it isn't read to the end"""
+
+
+def _check_body_size(size: Optional[int], max_body_size: int) -> None:
+    if size is not None and size > max_body_size:
+        OVERSIZED.inc()
+        raise BodyTooLarge(f"body exceeds {max_body_size} bytes")
+
+
+async def fetch_article_bytes(
+        session: aiohttp.ClientSession,
+        url: str,
+        timings: Optional[StageTimings] = None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+) -> Tuple[bytes, Optional[str]]:
+    """body of the page and its charset, see charset.find_charset"""
+    with measure(timings, "fetch"):
+        async with session.get(url) as response:
+            response.raise_for_status()
+            _check_body_size(response.content_length, max_body_size)
+            chunks = []
+            size = 0
+            async for chunk in response.content.iter_any():
+                size += len(chunk)
+                _check_body_size(size, max_body_size)
+                chunks.append(chunk)
+            body = b"".join(chunks)
+    return body, find_charset(body, response.charset)
+
+
 async def fetch_article(
         session: aiohttp.ClientSession,
         url: str,
+        timings: Optional[StageTimings] = None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
 ) -> str:
-    async with session.get(url) as response:
+    body, charset = await fetch_article_bytes(
+        session, url, timings, max_body_size
+    )
+    with measure(timings, "decode"):
+        return decode_html(body, charset)
+
+
+async def fetch_article_chunks(
+        session: aiohttp.ClientSession,
+        url: str,
+        request_timeout: float = 2,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        timings: Optional[StageTimings] = None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+) -> AsyncGenerator[str, None]:
+    """yields decoded parts of the body as they arrive,
+    request_timeout limits total time of waiting for network"""
+    budget = TimeBudget(request_timeout)
+    with measure(timings, "fetch"):
+        async with budget.timeout():
+            response = await session.get(url)
+    try:
         response.raise_for_status()
-        return await response.text()
+        _check_body_size(response.content_length, max_body_size)
+        decoder = None
+        head = b""  # beginning of the body, sniffed for charset
+        size = 0
+        while True:
+            with measure(timings, "fetch"):
+                async with budget.timeout():
+                    chunk = await response.content.read(chunk_size)
+            size += len(chunk)
+            _check_body_size(size, max_body_size)
+            if decoder is None:
+                # detection needs the whole body, so charset is declared
+                # in header or at the beginning of the body, or it is utf-8;
+                # reads may return a few bytes, so the beginning is buffered
+                head += chunk
+                if chunk and len(head) < META_SNIFF_SIZE:
+                    continue
+                with measure(timings, "decode"):
+                    charset = find_charset(head, response.charset)
+                    decoder = codecs.getincrementaldecoder(
+                        charset or "utf-8"
+                    )(errors="replace")
+                chunk, head = head, b""
+            if not chunk:
+                break
+            with measure(timings, "decode"):
+                text = decoder.decode(chunk)
+            yield text
+        with measure(timings, "decode"):
+            text = decoder.decode(b"", final=True)
+        yield text
+    finally:
+        response.release()
 
 
 async def score_article(
         url: str,
         session: aiohttp.ClientSession,
         morph: pymorphy2.MorphAnalyzer,
-        charged_words: List[str],
+        charged_words: ChargedWords,
+        request_timeout: float = 2,
+        processing_timeout: float = 3,
+        lemma_cache: Optional[LemmaCache] = None,
+        executor: Optional[Executor] = None,
+        scores_cache: Optional[ScoresCache] = None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
+) -> Result:
+    """scores article in event loop or,
+    if executor is given, decodes, sanitizes and lemmatizes it in worker
+    process, articles are not lemmatized if charged_words is
+    SurfaceFormIndex. In event loop scores_cache is looked up by sanitized
+    text, so the same text isn't lemmatized twice. Articles of unsupported
+    sites and bodies larger than max_body_size aren't fetched."""
+    timings = StageTimings()
+    article_text: Optional[str] = None
+    scored: Optional[Tuple[float, int]] = None  # score and words count
+    try:
+        adapter = find_adapter(url)
+        if executor is not None:
+            async with async_timeout.timeout(request_timeout):
+                body, charset = await fetch_article_bytes(
+                    session, url, timings, max_body_size
+                )
+            async with async_timeout.timeout(processing_timeout):
+                with timer():
+                    words = await process_in_pool(
+                        executor, body, adapter.name, timings, charset
+                    )
+        else:
+            async with async_timeout.timeout(request_timeout):
+                raw_html = await fetch_article(
+                    session, url, timings, max_body_size
+                )
+            with timings.measure("sanitize"):
+                article_text = adapter.sanitize(raw_html, plaintext=True)
+            if scores_cache is not None:
+                scored = scores_cache.get(article_text, charged_words)
+            if scored is None:
+                async with async_timeout.timeout(processing_timeout):
+                    with timer():
+                        if isinstance(charged_words, SurfaceFormIndex):
+                            with timings.measure("lemmatize"):
+                                words = charged_words.lemmatize(
+                                    tokenize(article_text)
+                                )
+                        else:
+                            words = await split_by_words(
+                                morph, article_text, lemma_cache, timings
+                            )
+    except asyncio.TimeoutError:
+        result = Result(ProcessingStatus.TIMEOUT, url)
+    except aiohttp.ClientError:
+        result = Result(ProcessingStatus.FETCH_ERROR, url)
+    except ArticleNotFound:
+        result = Result(ProcessingStatus.PARSING_ERROR, url)
+    else:
+        if scored is None:
+            with timings.measure("score"):
+                score = calculate_jaundice_rate(words, charged_words)
+            scored = (score, len(words))
+            if scores_cache is not None and article_text is not None:
+                scores_cache.put(article_text, charged_words, *scored)
+        result = Result(ProcessingStatus.OK, url, *scored)
+    timings.observe()
+    return result
+
+
+async def count_words(
+        counter: WordsCounter,
+        text: str,
+        timings: StageTimings,
+        step: int = WORDS_PER_STEP,
+) -> None:
+    """feeds text to counter by step words,
+    releases event loop before every step"""
+    tokens = counter.split(text)
+    for start in range(0, len(tokens), step):
+        await asyncio.sleep(0)
+        with timings.measure("lemmatize"):
+            counter.feed_tokens(tokens[start:start + step])
+
+
+async def stream_score_article(
+        url: str,
+        session: aiohttp.ClientSession,
+        morph: pymorphy2.MorphAnalyzer,
+        charged_words: ChargedWords,
         request_timeout: float = 2,
         processing_timeout: float = 3,
+        lemma_cache: Optional[LemmaCache] = None,
+        executor: Optional[Executor] = None,
+        scores_cache: Optional[ScoresCache] = None,
+        max_body_size: int = DEFAULT_MAX_BODY_SIZE,
 ) -> Result:
+    """Scores article while it is downloading: every received chunk goes
+    through sanitizer, tokenizer and lemmatizer at once.
+
+    request_timeout limits total time of waiting for network,
+    processing_timeout limits total time of processing.
+    Processing always runs in event loop, executor is ignored,
+    scores_cache is ignored too: text is lemmatized before it is complete.
+    """
+    timings = StageTimings()
+    processing_budget = TimeBudget(processing_timeout)
+    counter = WordsCounter(morph, charged_words, lemma_cache)
+    chunks = fetch_article_chunks(
+        session, url, request_timeout,
+        timings=timings, max_body_size=max_body_size,
+    )
     try:
-        async with async_timeout.timeout(request_timeout):
-            raw_html = await fetch_article(session, url)
-        article_text = sanitize(raw_html, plaintext=True)
-        async with async_timeout.timeout(processing_timeout):
-            with timer():
-                words = await split_by_words(morph, article_text)
+        extractor = find_adapter(url).get_plaintext_extractor()
+        with timer():
+            async for chunk in chunks:
+                async with processing_budget.timeout():
+                    with timings.measure("sanitize"):
+                        extractor.feed(chunk)
+                        text = extractor.pop_text()
+                    await count_words(counter, text, timings)
+            async with processing_budget.timeout():
+                with timings.measure("sanitize"):
+                    text = extractor.get_text()
+                await count_words(counter, text, timings)
+                with timings.measure("lemmatize"):
+                    counter.finish()
     except asyncio.TimeoutError:
         result = Result(ProcessingStatus.TIMEOUT, url)
     except aiohttp.ClientError:
@@ -86,8 +320,12 @@ async def score_article(
     except ArticleNotFound:
         result = Result(ProcessingStatus.PARSING_ERROR, url)
     else:
-        score = calculate_jaundice_rate(words, charged_words)
-        result = Result(ProcessingStatus.OK, url, score, len(words))
+        result = Result(
+            ProcessingStatus.OK, url, counter.score, counter.words_count
+        )
+    finally:
+        await chunks.aclose()
+    timings.observe()
     return result
 
 # module typing_extensions is not available in runtime, so add this check
@@ -99,9 +337,13 @@ if TYPE_CHECKING:
                 url: str,
                 session: aiohttp.ClientSession,
                 morph: pymorphy2.MorphAnalyzer,
-                charged_words: List[str],
+                charged_words: ChargedWords,
                 request_timeout: float = 2,
                 processing_timeout: float = 3,
+                lemma_cache: Optional[LemmaCache] = None,
+                executor: Optional[Executor] = None,
+                scores_cache: Optional[ScoresCache] = None,
+                max_body_size: int = DEFAULT_MAX_BODY_SIZE,
         ) -> Coroutine[Any, Any, Result]: ...
 else:
     ArticleScorerStrategy = None
@@ -110,13 +352,97 @@ else:
 class ArticlesScorer:
     def __init__(
             self,
-            charged_words: List[str],
+            charged_words: ChargedWords,
             morph: pymorphy2.MorphAnalyzer,
-            score_article: ArticleScorerStrategy = score_article
+            score_article: ArticleScorerStrategy = score_article,
+            lemma_cache: Optional[LemmaCache] = None,
+            executor: Optional[Executor] = None,
+            scores_cache: Optional[ScoresCache] = None,
+            max_body_size: int = DEFAULT_MAX_BODY_SIZE,
     ) -> None:
         self.charged_words = charged_words
         self.morph = morph
         self.score_article = score_article
+        self.lemma_cache = lemma_cache
+        self.executor = executor
+        self.scores_cache = scores_cache
+        self.max_body_size = max_body_size
+        # scoring in progress, shared by all concurrent callers,
+        # keyed by normalized url, timeouts and dictionary version
+        self.in_flight: Dict[
+            Tuple[str, float, float, str], asyncio.Future
+        ] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        self.coalesced = 0
+        self.cancelled = 0  # scorings nobody waited for anymore
+
+    async def score_one_article(
+            self,
+            url: str,
+            session: aiohttp.ClientSession,
+            request_timeout: float = 2,
+            processing_timeout: float = 3,
+            client: str = "",
+            priority: int = PRIORITY_INTERACTIVE,
+    ) -> Result:
+        """Concurrent calls for the same url await the same scoring.
+
+        Cancellation of a caller doesn't affect other callers, scoring
+        is shielded. When the last caller is cancelled, scoring
+        is cancelled too. Scoring is attributed to the client who
+        asked first, joined callers take no slots (see Scheduler).
+        """
+        # dictionary may be replaced, see server.reload_charged_words
+        charged_words = self.charged_words
+        key = (
+            normalize_url(url), request_timeout, processing_timeout,
+            dictionary_version(charged_words),
+        )
+        future = self.in_flight.get(key)
+        if future is None:
+            async def counted_score_article() -> Result:
+                result = await self.score_article(
+                    url=url,
+                    session=session,
+                    morph=self.morph,
+                    charged_words=charged_words,
+                    request_timeout=request_timeout,
+                    processing_timeout=processing_timeout,
+                    lemma_cache=self.lemma_cache,
+                    executor=self.executor,
+                    scores_cache=self.scores_cache,
+                    max_body_size=self.max_body_size,
+                )
+                # once per scoring, however many callers wait for it
+                RESULTS.inc(status=result.status.value)
+                return result
+
+            with requested_by(client, priority):
+                future = asyncio.ensure_future(counted_score_article())
+            self.in_flight[key] = future
+
+            def forget(f: asyncio.Future) -> None:
+                if self.in_flight.get(key) is f:
+                    del self.in_flight[key]
+            future.add_done_callback(forget)
+        else:
+            self.coalesced += 1
+        self._waiters[future] = self._waiters.get(future, 0) + 1
+        try:
+            result: Result = await asyncio.shield(future)
+        finally:
+            self._waiters[future] -= 1
+            if not self._waiters[future]:
+                del self._waiters[future]
+                if not future.done():
+                    # new callers start afresh, not join the cancelled one
+                    if self.in_flight.get(key) is future:
+                        del self.in_flight[key]
+                    future.cancel()
+                    self.cancelled += 1
+        if result.url != url:  # joined scoring of the same normalized url
+            return dataclasses.replace(result, url=url)
+        return result
 
     async def score_many_articles(
             self,
@@ -124,19 +450,73 @@ class ArticlesScorer:
             session: aiohttp.ClientSession,
             request_timeout: float = 2,
             processing_timeout: float = 3,
+            deadline: Optional[float] = None,
+            client: str = "",
+            priority: int = PRIORITY_INTERACTIVE,
     ) -> List[Result]:
+        """Results are in order of urls. Urls not scored in deadline
+        seconds get TIMEOUT status, their scoring is cancelled
+        (see score_one_article). Waiting for scheduler slots counts
+        towards deadline, admission is up to the caller,
+        see Scheduler.admit."""
         async with aionursery.Nursery() as nursery:
             tasks = [
                 nursery.start_soon(
-                    self.score_article(
+                    self.score_one_article(
                         url=url,
                         session=session,
-                        morph=self.morph,
-                        charged_words=self.charged_words,
                         request_timeout=request_timeout,
                         processing_timeout=processing_timeout,
+                        client=client,
+                        priority=priority,
                     )
                 ) for url in urls
             ]
-            results, _ = await asyncio.wait(tasks)
-        return [task.result() for task in results]
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+        results = []
+        for url, task in zip(urls, tasks):
+            if task.cancelled():
+                results.append(Result(ProcessingStatus.TIMEOUT, url))
+            else:
+                results.append(task.result())
+        return results
+
+    async def score_as_completed(
+            self,
+            urls: Iterable[str],
+            session: aiohttp.ClientSession,
+            request_timeout: float = 2,
+            processing_timeout: float = 3,
+            concurrency: int = 10,
+            client: str = "",
+            priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncGenerator[Result, None]:
+        """yields results as soon as they are ready,
+        no more than concurrency urls are scored at once"""
+        urls_iter = iter(urls)
+        pending: Set[asyncio.Future] = set()
+        try:
+            while True:
+                for url in urls_iter:
+                    pending.add(asyncio.ensure_future(self.score_one_article(
+                        url=url,
+                        session=session,
+                        request_timeout=request_timeout,
+                        processing_timeout=processing_timeout,
+                        client=client,
+                        priority=priority,
+                    )))
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
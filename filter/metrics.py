@@ -0,0 +1,322 @@
+"""Minimal Prometheus-style metrics.
+
+Metrics are plain in-process objects, cheap enough to be always on,
+REGISTRY renders them in Prometheus text exposition format.
+"""
+import abc
+import asyncio
+import bisect
+import contextlib
+import time
+from typing import (
+    Any, Dict, Generator, Iterable, Iterator, List, Mapping, Optional,
+    Sequence, Tuple,
+)
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+
+
+class Metric(abc.ABC):
+    type = "untyped"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, values: LabelValues) -> Dict[str, str]:
+        return dict(zip(self.labelnames, values))
+
+    @abc.abstractmethod
+    def samples(self) -> Iterator[Sample]:
+        """name, labels and value of every sample"""
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._label_values(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        for key, value in self.values.items():
+            yield self.name, self._labels(key), value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[self._label_values(labels)] = value
+
+
+class _HistogramValue:
+    def __init__(self, buckets_count: int) -> None:
+        self.counts = [0] * buckets_count
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            labelnames: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values: Dict[LabelValues, _HistogramValue] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        histogram = self.values.get(key)
+        if histogram is None:
+            histogram = self.values[key] = _HistogramValue(len(self.buckets))
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            histogram.counts[index] += 1
+        histogram.sum += value
+        histogram.count += 1
+
+    @contextlib.contextmanager
+    def time(self, **labels: str) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[Sample]:
+        for key, histogram in self.values.items():
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram.counts):
+                cumulative += count
+                yield (
+                    self.name + "_bucket",
+                    {**labels, "le": _format_value(bound)},
+                    cumulative,
+                )
+            yield (
+                self.name + "_bucket", {**labels, "le": "+Inf"},
+                histogram.count,
+            )
+            yield self.name + "_sum", labels, histogram.sum
+            yield self.name + "_count", labels, histogram.count
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return f"{value:.1f}"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+def render(metrics: Iterable[Metric]) -> str:
+    """Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        for name, labels, value in metric.samples():
+            if labels:
+                formatted = ",".join(
+                    f'{k}="{_escape(v)}"' for k, v in labels.items()
+                )
+                name = f"{name}{{{formatted}}}"
+            lines.append(f"{name} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def dump(metrics: Iterable[Metric]) -> List[Dict[str, Any]]:
+    """json serializable samples of metrics, see merge()"""
+    return [
+        {
+            "name": metric.name,
+            "documentation": metric.documentation,
+            "type": metric.type,
+            "samples": list(metric.samples()),
+        }
+        for metric in metrics
+    ]
+
+
+class _Samples(Metric):
+    """metric restored from dumped samples"""
+
+    def __init__(
+            self,
+            name: str,
+            documentation: str,
+            type: str,
+            samples: Iterable[Sample],
+    ) -> None:
+        super().__init__(name, documentation)
+        self.type = type
+        self._samples = list(samples)
+
+    def samples(self) -> Iterator[Sample]:
+        return iter(self._samples)
+
+
+def merge(dumps: Mapping[str, List[Dict[str, Any]]]) -> List[Metric]:
+    """Merges metrics dumped by several processes, keyed by process name.
+
+    Counters and histograms are summed up. Gauges can't be,
+    so they are kept apart, labelled with "worker" name.
+    """
+    families: Dict[str, Tuple[str, str, Dict[Any, float]]] = {}
+    for worker, metrics in dumps.items():
+        for metric in metrics:
+            name = metric["name"]
+            if name not in families:
+                families[name] = (metric["documentation"], metric["type"], {})
+            _, metric_type, values = families[name]
+            for sample_name, labels, value in metric["samples"]:
+                if metric_type == Gauge.type:
+                    labels = {**labels, "worker": worker}
+                key = (sample_name, tuple(labels.items()))
+                values[key] = values.get(key, 0.0) + value
+    return [
+        _Samples(name, documentation, metric_type, [
+            (sample_name, dict(labels), value)
+            for (sample_name, labels), value in values.items()
+        ])
+        for name, (documentation, metric_type, values) in families.items()
+    ]
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self, extra: Iterable[Metric] = ()) -> str:
+        return render([*self.metrics.values(), *extra])
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = Histogram(
+    "filter_stage_duration_seconds",
+    "Time spent in article processing stages.",
+    ["stage"],
+)
+RESULTS = Counter(
+    "filter_results_total",
+    "Scoring results by status, once per scoring shared by "
+    "all requests waiting for it.",
+    ["status"],
+)
+EVENT_LOOP_LAG = Histogram(
+    "filter_event_loop_lag_seconds",
+    "Delay of event loop callbacks.",
+)
+CHARSETS = Counter(
+    "filter_charsets_total",
+    "Fetched pages by where their charset is declared.",
+    ["source"],
+)
+OVERSIZED = Counter(
+    "filter_oversized_articles_total",
+    "Pages not fetched because their body exceeded max size.",
+)
+SCHEDULER_WAIT = Histogram(
+    "filter_scheduler_wait_seconds",
+    "Time urls of admitted requests wait for a scoring slot.",
+)
+for _metric in [
+    STAGE_DURATION, RESULTS, EVENT_LOOP_LAG, CHARSETS, OVERSIZED,
+    SCHEDULER_WAIT,
+]:
+    REGISTRY.register(_metric)
+
+
+class StageTimings:
+    """Durations of processing stages of one article.
+
+    Stages may be measured several times (e.g. chunk by chunk),
+    durations are summed up and observed once.
+    """
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def measure(self, stage: str) -> Generator[None, None, None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def update(self, durations: Dict[str, float]) -> None:
+        for stage, seconds in durations.items():
+            self.add(stage, seconds)
+
+    def observe(self, histogram: Histogram = STAGE_DURATION) -> None:
+        for stage, seconds in self.durations.items():
+            histogram.observe(seconds, stage=stage)
+
+
+@contextlib.contextmanager
+def measure(
+        timings: Optional[StageTimings],
+        stage: str,
+) -> Generator[None, None, None]:
+    """like StageTimings.measure, does nothing if timings is None"""
+    if timings is None:
+        yield
+    else:
+        with timings.measure(stage):
+            yield
+
+
+async def monitor_event_loop_lag(
+        interval: float = 0.5,
+        histogram: Histogram = EVENT_LOOP_LAG,
+) -> None:
+    """runs forever, observes how late sleep wakes up"""
+    loop = asyncio.get_event_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        histogram.observe(max(loop.time() - start - interval, 0.0))
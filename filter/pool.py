@@ -0,0 +1,80 @@
+"""Text processing in worker processes.
+
+Every worker gets MorphAnalyzer (and pymorphy2 dictionaries) once
+at startup, forked workers inherit the one already loaded by the server.
+Decoding, sanitizing, tokenizing and lemmatizing of articles runs on all cores
+and doesn't block the event loop.
+"""
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import pymorphy2
+
+from filter.adapters import ADAPTERS
+from filter.charset import decode_html
+from filter.metrics import StageTimings
+from filter.text_tools import (
+    LemmaCache, tokenize, lemmatize_batch, get_morph_analyzer,
+    DEFAULT_LEMMA_CACHE_SIZE,
+)
+
+# per-process state, initialized by init_worker
+_morph: Optional[pymorphy2.MorphAnalyzer] = None
+_lemma_cache: Optional[LemmaCache] = None
+
+
+def init_worker(lemma_cache_size: int = DEFAULT_LEMMA_CACHE_SIZE) -> None:
+    global _morph, _lemma_cache
+    _morph = get_morph_analyzer()
+    _lemma_cache = LemmaCache(lemma_cache_size)
+
+
+def process_article(
+        html: Union[str, bytes],
+        adapter: str,
+        charset: Optional[str] = None,
+) -> Tuple[List[str], Dict[str, float]]:
+    """decode html if it is bytes, sanitize it with adapter of given name
+    and split it by normalized words, runs inside worker process,
+    returns words and stage durations"""
+    if _morph is None:
+        init_worker()
+    timings = StageTimings()
+    if isinstance(html, bytes):
+        with timings.measure("decode"):
+            html = decode_html(html, charset)
+    with timings.measure("sanitize"):
+        article_text = ADAPTERS[adapter].sanitize(html, plaintext=True)
+    with timings.measure("tokenize"):
+        tokens = tokenize(article_text)
+    with timings.measure("lemmatize"):
+        words = lemmatize_batch(_morph, tokens, _lemma_cache)
+    return words, timings.durations
+
+
+def create_pool(
+        workers: int,
+        lemma_cache_size: int = DEFAULT_LEMMA_CACHE_SIZE,
+) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(lemma_cache_size,),
+    )
+
+
+async def process_in_pool(
+        executor: Executor,
+        html: Union[str, bytes],
+        adapter: str,
+        timings: Optional[StageTimings] = None,
+        charset: Optional[str] = None,
+) -> List[str]:
+    loop = asyncio.get_event_loop()
+    words, durations = await loop.run_in_executor(
+        executor, process_article, html, adapter, charset
+    )
+    if timings is not None:
+        timings.update(durations)
+    return words
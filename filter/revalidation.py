@@ -0,0 +1,227 @@
+"""Conditional fetching of articles.
+
+Scores are stored along with ETag and Last-Modified of the page
+(keyed like results cache, see cache.cache_key),
+when the page is needed again it is requested with If-None-Match
+and If-Modified-Since. On 304 Not Modified the stored score is reused,
+the page is neither downloaded nor processed again.
+"""
+import dataclasses
+import functools
+import logging
+import time
+from typing import (
+    Any, Dict, Generator, Optional, cast, Coroutine, TYPE_CHECKING,
+)
+
+import aiohttp
+
+from filter.cache import MemoryCache, TierStats, cache_key, is_cacheable
+from filter.main import Result
+from filter.metrics import StageTimings
+
+if TYPE_CHECKING:
+    from filter.main import ArticleScorerStrategy
+
+DEFAULT_REVALIDATION_CACHE_SIZE = 100000
+DEFAULT_REVALIDATION_TTL = 7 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass()
+class Validated:
+    """result of scoring of the page with validators of the page"""
+    result: Result
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+    def conditional_headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class NotModified(Exception):
+    """page wasn't changed since the stored result,
+    elapsed is time of the conditional request"""
+
+    def __init__(self, url: str, elapsed: float = 0.0) -> None:
+        super().__init__(url)
+        self.elapsed = elapsed
+
+
+class _RequestContext:
+    """like result of ClientSession.get: awaitable and context manager"""
+
+    def __init__(self, coro: Coroutine[Any, Any, aiohttp.ClientResponse]):
+        self._coro = coro
+        self._response: Optional[aiohttp.ClientResponse] = None
+
+    def __await__(self) -> Generator[Any, None, aiohttp.ClientResponse]:
+        return self._coro.__await__()
+
+    async def __aenter__(self) -> aiohttp.ClientResponse:
+        self._response = await self._coro
+        return self._response
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._response is not None:
+            self._response.release()
+
+
+class ConditionalSession:
+    """Proxy of aiohttp session used for fetching of one article.
+
+    Requests are conditional if there is stored result, 304 response
+    raises NotModified, validators of other responses are remembered.
+    """
+
+    def __init__(
+            self,
+            session: aiohttp.ClientSession,
+            stored: Optional[Validated] = None,
+    ) -> None:
+        self.session = session
+        self.stored = stored
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.session, name)
+
+    def get(self, url: str, **kwargs: Any) -> _RequestContext:
+        return _RequestContext(self._get(url, **kwargs))
+
+    async def _get(self, url: str, **kwargs: Any) -> aiohttp.ClientResponse:
+        headers = dict(kwargs.pop("headers", None) or {})
+        if self.stored is not None:
+            headers.update(self.stored.conditional_headers())
+        start = time.perf_counter()
+        response = await self.session.get(url, headers=headers, **kwargs)
+        if response.status == 304 and self.stored is not None:
+            response.release()
+            raise NotModified(url, time.perf_counter() - start)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        return response
+
+    def validated(self, result: Result) -> Optional[Validated]:
+        """result with validators of the response, if there were any"""
+        if self.etag is None and self.last_modified is None:
+            return None
+        return Validated(result, self.etag, self.last_modified)
+
+
+class RevalidationStore:
+    """Results with validators, kept much longer than results cache.
+
+    Looks in memory first, then in shared cache (any aiocache backend),
+    failures of shared cache are logged and treated as misses.
+    """
+
+    def __init__(
+            self,
+            memory: MemoryCache[str, Validated],
+            shared: Any = None,
+            ttl: Optional[float] = DEFAULT_REVALIDATION_TTL,
+    ) -> None:
+        self.memory = memory
+        self.shared = shared
+        self.ttl = ttl
+        self.stats: Dict[str, TierStats] = {"memory": TierStats()}
+        if shared is not None:
+            self.stats["shared"] = TierStats()
+        self.not_modified = 0
+        self.modified = 0
+
+    async def get(self, url: str) -> Optional[Validated]:
+        validated = self.memory.get(url)
+        if validated is not None:
+            self.stats["memory"].hits += 1
+            return validated
+        self.stats["memory"].misses += 1
+
+        if self.shared is None:
+            return None
+        stats = self.stats["shared"]
+        try:
+            validated = await self.shared.get(url)
+        except Exception:
+            stats.errors += 1
+            logger.exception("Couldn't retrieve %s from shared store", url)
+            return None
+        if validated is None:
+            stats.misses += 1
+            return None
+        stats.hits += 1
+        self.memory.set(url, validated)
+        return validated
+
+    async def set(self, url: str, validated: Validated) -> None:
+        self.memory.set(url, validated)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.set(url, validated, ttl=self.ttl)
+        except Exception:
+            self.stats["shared"].errors += 1
+            logger.exception("Couldn't set %s in shared store", url)
+
+    async def delete(self, url: str) -> None:
+        self.memory.delete(url)
+        if self.shared is None:
+            return
+        try:
+            await self.shared.delete(url)
+        except Exception:
+            self.stats["shared"].errors += 1
+            logger.exception("Couldn't delete %s from shared store", url)
+
+    async def close(self) -> None:
+        if self.shared is not None:
+            await self.shared.close()
+
+    def decorate(
+            self,
+            score_article: 'ArticleScorerStrategy',
+    ) -> 'ArticleScorerStrategy':
+        """wraps scoring strategy, so pages are fetched conditionally"""
+        @functools.wraps(score_article)
+        async def revalidated_score_article(
+                url: str,
+                session: aiohttp.ClientSession,
+                **kwargs: Any,
+        ) -> Result:
+            key = cache_key(url, kwargs.get("charged_words"))
+            stored = await self.get(key)
+            conditional_session = ConditionalSession(session, stored)
+            try:
+                result = await score_article(
+                    url=url,
+                    session=cast(aiohttp.ClientSession, conditional_session),
+                    **kwargs,
+                )
+            except NotModified as ex:
+                assert stored is not None  # only conditional requests
+                self.not_modified += 1
+                # strategy didn't get to observe its timings
+                timings = StageTimings()
+                timings.add("fetch", ex.elapsed)
+                timings.observe()
+                await self.set(key, stored)  # keep it longer
+                if stored.result.url != url:
+                    return dataclasses.replace(stored.result, url=url)
+                return stored.result
+            if stored is not None:
+                self.modified += 1
+            validated = conditional_session.validated(result)
+            if validated is not None and is_cacheable(result):
+                await self.set(key, validated)
+            elif stored is not None:
+                await self.delete(key)  # validators are outdated
+            return result
+        return cast('ArticleScorerStrategy', revalidated_score_article)
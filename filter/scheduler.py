@@ -0,0 +1,284 @@
+"""Fair scheduling of article scoring between api clients.
+
+Requests are admitted as a whole or rejected at once, before any url
+is scored: a client having too many urls in progress gets
+ClientOverloaded (429), a server having too many urls in progress
+gets Overloaded (503). Admitted urls wait for one of scoring slots,
+limited in total and per host. Free slot goes to the next client in
+round robin order, one url at a time, so a client sending many
+requests queues up behind itself and doesn't delay others. A client
+whose urls all wait for a busy host lets the next one go. Lower
+priority numbers go first, batch urls are scored only when no
+interactive ones can be.
+
+Scorings started by ArticlesScorer are attributed to the client
+which asked first, see requested_by.
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import math
+import time
+from types import TracebackType
+from typing import (
+    Any, AsyncIterator, Counter, Deque, Dict, Iterator, Optional, Tuple,
+    Type, cast, TYPE_CHECKING,
+)
+
+import yarl
+
+from filter.metrics import SCHEDULER_WAIT
+
+if TYPE_CHECKING:
+    from filter.main import ArticleScorerStrategy, Result
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# client and priority of scorings started in current context
+_requester: contextvars.ContextVar[Tuple[str, int]] = contextvars.ContextVar(
+    "requester", default=("", PRIORITY_INTERACTIVE)
+)
+
+
+@contextlib.contextmanager
+def requested_by(client: str, priority: int) -> Iterator[None]:
+    """tasks created inside wait for slots of client with priority"""
+    token = _requester.set((client, priority))
+    try:
+        yield
+    finally:
+        _requester.reset(token)
+
+
+@dataclasses.dataclass()
+class WaitStats:
+    """time spent in queue waiting for a free slot"""
+    count: int = 0
+    total: float = 0.0
+    max: float = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+
+class Overloaded(Exception):
+    """no room for more urls, retry_after is estimated wait in seconds"""
+    def __init__(self, message: str, retry_after: int) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ClientOverloaded(Overloaded):
+    """no room for more urls of this client"""
+
+
+class Admission:
+    """place of admitted urls, released on exit"""
+    def __init__(
+            self, scheduler: "Scheduler", client: str, count: int,
+    ) -> None:
+        self.scheduler = scheduler
+        self.client = client
+        self.count = count
+
+    def release(self) -> None:
+        if self.count:
+            self.scheduler._release_admission(self.client, self.count)
+            self.count = 0
+
+    def __enter__(self) -> "Admission":
+        return self
+
+    def __exit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc: Optional[BaseException],
+            tb: Optional[TracebackType],
+    ) -> None:
+        self.release()
+
+
+class Scheduler:
+    """Shares scoring slots between clients.
+
+    slots is max number of urls scored at once, limit_per_host is max
+    number of them from one host, queue_size is max number of admitted
+    urls above slots, client_queue_size is max number of admitted urls
+    of one client. Zero means no limit.
+    """
+
+    def __init__(
+            self,
+            slots: int = 0,
+            limit_per_host: int = 0,
+            queue_size: int = 0,
+            client_queue_size: int = 0,
+    ) -> None:
+        self.slots = slots
+        self.limit_per_host = limit_per_host
+        self.queue_size = queue_size
+        self.client_queue_size = client_queue_size
+        self.admitted: Dict[str, int] = {}  # by client
+        self.admitted_total = 0
+        self.running = 0
+        self.waiting = 0
+        self.rejected: Counter[str] = collections.Counter()
+        self.wait_stats = WaitStats()
+        # priority -> client -> (waiter, host), clients in round robin order
+        self._queues: Dict[
+            int,
+            'collections.OrderedDict[str, Deque[Tuple[asyncio.Future, str]]]',
+        ] = {}
+        self._hosts: Counter[str] = collections.Counter()  # running ones
+        self._busy_total = 0.0  # slot holding time, for retry_after
+        self._busy_count = 0
+
+    def retry_after(self) -> int:
+        """estimated seconds until urls waiting now are scored"""
+        mean = self._busy_total / self._busy_count if self._busy_count else 1
+        rounds = self.waiting / self.slots + 1 if self.slots > 0 else 1
+        return max(1, math.ceil(mean * rounds))
+
+    def admit(self, client: str, count: int) -> Admission:
+        """reserves place for count urls of client or raises Overloaded,
+        a request is admitted when nothing else is, however large it is"""
+        client_count = self.admitted.get(client, 0)
+        limit = self.client_queue_size
+        if limit > 0 and client_count and client_count + count > limit:
+            self.rejected["client"] += 1
+            raise ClientOverloaded(
+                f"too many urls in progress, should be less than {limit}",
+                self.retry_after(),
+            )
+        limit = self.slots + self.queue_size
+        if (self.queue_size > 0 and self.admitted_total
+                and self.admitted_total + count > limit):
+            self.rejected["overload"] += 1
+            raise Overloaded("server is overloaded", self.retry_after())
+        self.admitted[client] = client_count + count
+        self.admitted_total += count
+        return Admission(self, client, count)
+
+    def _release_admission(self, client: str, count: int) -> None:
+        self.admitted[client] -= count
+        if not self.admitted[client]:
+            del self.admitted[client]
+        self.admitted_total -= count
+
+    @contextlib.asynccontextmanager
+    async def slot(
+            self,
+            url: str = "",
+            client: str = "",
+            priority: int = PRIORITY_INTERACTIVE,
+    ) -> AsyncIterator[None]:
+        host = ""
+        if self.limit_per_host > 0:
+            host = yarl.URL(url).host or ""
+        start = time.monotonic()
+        await self._acquire(host, client, priority)
+        taken = time.monotonic()
+        SCHEDULER_WAIT.observe(taken - start)
+        self.wait_stats.observe(taken - start)
+        try:
+            yield
+        finally:
+            self._busy_total += time.monotonic() - taken
+            self._busy_count += 1
+            self._release(host)
+
+    def decorate(
+            self,
+            score_article: 'ArticleScorerStrategy',
+    ) -> 'ArticleScorerStrategy':
+        """wraps scoring strategy, so it waits for a free slot
+        of the client, see requested_by"""
+        @functools.wraps(score_article)
+        async def scheduled_score_article(url: str, **kwargs: Any) -> 'Result':
+            client, priority = _requester.get()
+            async with self.slot(url, client, priority):
+                return await score_article(url=url, **kwargs)
+        return cast('ArticleScorerStrategy', scheduled_score_article)
+
+    async def _acquire(self, host: str, client: str, priority: int) -> None:
+        waiter = asyncio.get_event_loop().create_future()
+        clients = self._queues.setdefault(priority, collections.OrderedDict())
+        clients.setdefault(client, collections.deque()).append(
+            (waiter, host)
+        )
+        self.waiting += 1
+        self._dispatch()  # gives the slot at once when nobody is ahead
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():  # still in queue
+                self._remove(priority, client, waiter)
+            else:  # slot is given already, pass it on
+                self._release(host)
+            raise
+
+    def _remove(
+            self, priority: int, client: str, waiter: asyncio.Future,
+    ) -> None:
+        # cancelled waiters are never given a slot, see _grant_next
+        clients = self._queues[priority]
+        waiters = clients[client]
+        waiters.remove(next(x for x in waiters if x[0] is waiter))
+        if not waiters:
+            del clients[client]
+            if not clients:
+                del self._queues[priority]
+        self.waiting -= 1
+
+    def _has_room(self, host: str) -> bool:
+        return (self.slots <= 0 or self.running < self.slots) and (
+            self.limit_per_host <= 0
+            or self._hosts[host] < self.limit_per_host
+        )
+
+    def _release(self, host: str) -> None:
+        self.running -= 1
+        self._hosts[host] -= 1
+        if not self._hosts[host]:
+            del self._hosts[host]
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self.waiting and self._grant_next():
+            pass
+
+    def _grant_next(self) -> bool:
+        """gives a slot to the first client in turn having a waiter
+        for a host with room, False when there is no such client"""
+        if self.slots > 0 and self.running >= self.slots:
+            return False
+        for priority in sorted(self._queues):
+            clients = self._queues[priority]
+            for client, waiters in clients.items():
+                entry = next((
+                    x for x in waiters
+                    # cancelled ones are removed by their _acquire
+                    if not x[0].done() and self._has_room(x[1])
+                ), None)
+                if entry is None:
+                    continue
+                waiter, host = entry
+                waiters.remove(entry)
+                if waiters:
+                    clients.move_to_end(client)
+                else:
+                    del clients[client]
+                    if not clients:
+                        del self._queues[priority]
+                self.waiting -= 1
+                self.running += 1
+                self._hosts[host] += 1
+                waiter.set_result(None)
+                return True
+        return False
@@ -1,13 +1,48 @@
 import argparse
 import os
-from typing import Optional
+from typing import Optional, Tuple
+
+from filter import CHARGED_DICT_FILES
 
 DEFAULT_PORT = 8080
 DEFAULT_REQUEST_TIMEOUT = 2
 DEFAULT_PROCESSING_TIMEOUT = 3
 DEFAULT_URLS_LIMIT = 10
+DEFAULT_DEADLINE = 5
 DEFAULT_REDIS_HOST = None
 DEFAULT_REDIS_PORT = 6379
+DEFAULT_LEMMA_CACHE_SIZE = 50000
+DEFAULT_SCORES_CACHE_SIZE = 10000
+DEFAULT_PROCESSING_WORKERS = 0
+DEFAULT_STREAMING = False
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_CACHE_TTL = 60
+DEFAULT_BATCH_URLS_LIMIT = 10000
+DEFAULT_BATCH_CONCURRENCY = 20
+DEFAULT_CONCURRENCY_LIMIT = 100
+DEFAULT_CONCURRENCY_PER_HOST = 10
+DEFAULT_CONNECTIONS_LIMIT = 100
+DEFAULT_CONNECTIONS_PER_HOST = 10
+DEFAULT_DNS_CACHE_TTL = 300
+DEFAULT_KEEPALIVE_TIMEOUT = 30
+DEFAULT_MAX_BODY_SIZE = 5 * 1024 * 1024
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_CLIENT_QUEUE_SIZE = 100
+DEFAULT_CLIENT_HEADER = None
+DEFAULT_RELOAD_TOKEN = None
+DEFAULT_REVALIDATION_CACHE_SIZE = 100000
+DEFAULT_REVALIDATION_TTL = 7 * 24 * 3600
+DEFAULT_WORKERS = 1
+DEFAULT_SHUTDOWN_TIMEOUT = 10
+DEFAULT_CHARGED_DICT = tuple(CHARGED_DICT_FILES)
+DEFAULT_CHARGED_DICT_RELOAD_INTERVAL = 5
+DEFAULT_SURFACE_INDEX = False
+# per-user cache dir: the index is trusted when loaded
+DEFAULT_SURFACE_INDEX_PATH = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "jaundice-rate",
+    "surface_index.json",
+)
 
 
 class Config:
@@ -16,8 +51,44 @@ class Config:
     request_timeout: float = DEFAULT_REQUEST_TIMEOUT
     processing_timeout: float = DEFAULT_PROCESSING_TIMEOUT
     urls_limit: int = DEFAULT_URLS_LIMIT
+    deadline: float = DEFAULT_DEADLINE
     redis_host: Optional[str] = DEFAULT_REDIS_HOST
     redis_port: int = DEFAULT_REDIS_PORT
+    lemma_cache_size: int = DEFAULT_LEMMA_CACHE_SIZE
+    scores_cache_size: int = DEFAULT_SCORES_CACHE_SIZE
+    processing_workers: int = DEFAULT_PROCESSING_WORKERS
+    streaming: bool = DEFAULT_STREAMING
+    cache_size: int = DEFAULT_CACHE_SIZE
+    cache_ttl: float = DEFAULT_CACHE_TTL
+    batch_urls_limit: int = DEFAULT_BATCH_URLS_LIMIT
+    batch_concurrency: int = DEFAULT_BATCH_CONCURRENCY
+    concurrency_limit: int = DEFAULT_CONCURRENCY_LIMIT
+    concurrency_per_host: int = DEFAULT_CONCURRENCY_PER_HOST
+    connections_limit: int = DEFAULT_CONNECTIONS_LIMIT
+    connections_per_host: int = DEFAULT_CONNECTIONS_PER_HOST
+    dns_cache_ttl: int = DEFAULT_DNS_CACHE_TTL
+    keepalive_timeout: float = DEFAULT_KEEPALIVE_TIMEOUT
+    max_body_size: int = DEFAULT_MAX_BODY_SIZE
+    queue_size: int = DEFAULT_QUEUE_SIZE
+    client_queue_size: int = DEFAULT_CLIENT_QUEUE_SIZE
+    client_header: Optional[str] = DEFAULT_CLIENT_HEADER
+    reload_token: Optional[str] = DEFAULT_RELOAD_TOKEN
+    revalidation_cache_size: int = DEFAULT_REVALIDATION_CACHE_SIZE
+    revalidation_ttl: float = DEFAULT_REVALIDATION_TTL
+    workers: int = DEFAULT_WORKERS
+    shutdown_timeout: float = DEFAULT_SHUTDOWN_TIMEOUT
+    charged_dict: Tuple[str, ...] = DEFAULT_CHARGED_DICT
+    charged_dict_reload_interval: float = DEFAULT_CHARGED_DICT_RELOAD_INTERVAL
+    surface_index: bool = DEFAULT_SURFACE_INDEX
+    surface_index_path: str = DEFAULT_SURFACE_INDEX_PATH
+
+
+def env_flag(name: str, default: bool) -> bool:
+    """true for 1, true, yes, on in any case, false for other values"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
 
 
 def get_args() -> Config:
@@ -57,6 +128,14 @@ def get_args() -> Config:
         default=os.getenv("FILTER_PROCESSING_TIMEOUT", DEFAULT_URLS_LIMIT),
     )
 
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        help="max seconds to score urls of one request, urls not scored "
+             "in time get TIMEOUT status, 0 means no deadline",
+        default=os.getenv("FILTER_DEADLINE", DEFAULT_DEADLINE)
+    )
+
     parser.add_argument(
         "--redis_host",
         type=str,
@@ -70,7 +149,251 @@ def get_args() -> Config:
         help="redis cache port",
         default=os.getenv("FILTER_REDIS_PORT", DEFAULT_REDIS_PORT)
     )
+
+    parser.add_argument(
+        "--lemma_cache_size",
+        type=int,
+        help="max number of cached word normal forms, 0 disables cache",
+        default=os.getenv(
+            "FILTER_LEMMA_CACHE_SIZE", DEFAULT_LEMMA_CACHE_SIZE
+        )
+    )
+
+    parser.add_argument(
+        "--scores_cache_size",
+        type=int,
+        help="max number of scores cached by article text, "
+             "0 disables cache",
+        default=os.getenv(
+            "FILTER_SCORES_CACHE_SIZE", DEFAULT_SCORES_CACHE_SIZE
+        )
+    )
+
+    parser.add_argument(
+        "--processing_workers",
+        type=int,
+        help="number of processes for text processing, "
+             "0 means processing in event loop",
+        default=os.getenv(
+            "FILTER_PROCESSING_WORKERS", DEFAULT_PROCESSING_WORKERS
+        )
+    )
+
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="process articles while they are downloading, "
+             "processing_workers are not used in this mode",
+        default=env_flag("FILTER_STREAMING", DEFAULT_STREAMING)
+    )
+
+    parser.add_argument(
+        "--cache_size",
+        type=int,
+        help="max number of results cached in memory, 0 disables cache",
+        default=os.getenv("FILTER_CACHE_SIZE", DEFAULT_CACHE_SIZE)
+    )
+
+    parser.add_argument(
+        "--cache_ttl",
+        type=float,
+        help="results cache ttl in seconds, both for memory and redis",
+        default=os.getenv("FILTER_CACHE_TTL", DEFAULT_CACHE_TTL)
+    )
+
+    parser.add_argument(
+        "--batch_urls_limit",
+        type=int,
+        help="urls limit per batch request",
+        default=os.getenv("FILTER_BATCH_URLS_LIMIT", DEFAULT_BATCH_URLS_LIMIT)
+    )
+
+    parser.add_argument(
+        "--batch_concurrency",
+        type=int,
+        help="max number of urls scored at once per batch request",
+        default=os.getenv(
+            "FILTER_BATCH_CONCURRENCY", DEFAULT_BATCH_CONCURRENCY
+        )
+    )
+
+    parser.add_argument(
+        "--concurrency_limit",
+        type=int,
+        help="max number of articles scored at once, shared fairly "
+             "between clients, 0 means no limit",
+        default=os.getenv(
+            "FILTER_CONCURRENCY_LIMIT", DEFAULT_CONCURRENCY_LIMIT
+        )
+    )
+
+    parser.add_argument(
+        "--concurrency_per_host",
+        type=int,
+        help="max number of articles of one host scored at once, "
+             "0 means no limit",
+        default=os.getenv(
+            "FILTER_CONCURRENCY_PER_HOST", DEFAULT_CONCURRENCY_PER_HOST
+        )
+    )
+
+    parser.add_argument(
+        "--connections_limit",
+        type=int,
+        help="http connections pool size, 0 means no limit",
+        default=os.getenv(
+            "FILTER_CONNECTIONS_LIMIT", DEFAULT_CONNECTIONS_LIMIT
+        )
+    )
+
+    parser.add_argument(
+        "--connections_per_host",
+        type=int,
+        help="max number of http connections to one host, 0 means no limit",
+        default=os.getenv(
+            "FILTER_CONNECTIONS_PER_HOST", DEFAULT_CONNECTIONS_PER_HOST
+        )
+    )
+
+    parser.add_argument(
+        "--dns_cache_ttl",
+        type=int,
+        help="dns cache ttl in seconds, 0 disables dns cache",
+        default=os.getenv("FILTER_DNS_CACHE_TTL", DEFAULT_DNS_CACHE_TTL)
+    )
+
+    parser.add_argument(
+        "--keepalive_timeout",
+        type=float,
+        help="keep-alive timeout of idle http connections in seconds",
+        default=os.getenv(
+            "FILTER_KEEPALIVE_TIMEOUT", DEFAULT_KEEPALIVE_TIMEOUT
+        )
+    )
+
+    parser.add_argument(
+        "--max_body_size",
+        type=int,
+        help="max size of article page in bytes, larger ones are not "
+             "fetched to the end and get FETCH_ERROR",
+        default=os.getenv("FILTER_MAX_BODY_SIZE", DEFAULT_MAX_BODY_SIZE)
+    )
+
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        help="max number of urls waiting for scheduler slots, requests "
+             "above it get 503, 0 means no limit",
+        default=os.getenv("FILTER_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)
+    )
+
+    parser.add_argument(
+        "--client_queue_size",
+        type=int,
+        help="max number of urls of one client in progress, requests "
+             "above it get 429, 0 means no limit",
+        default=os.getenv(
+            "FILTER_CLIENT_QUEUE_SIZE", DEFAULT_CLIENT_QUEUE_SIZE
+        )
+    )
+
+    parser.add_argument(
+        "--client_header",
+        type=str,
+        help="request header identifying clients, e.g. X-Api-Key, "
+             "clients are told apart by ip address if argument not used",
+        default=os.getenv("FILTER_CLIENT_HEADER", DEFAULT_CLIENT_HEADER)
+    )
+
+    parser.add_argument(
+        "--reload_token",
+        type=str,
+        help="token for POST /charged_words/reload, sent as "
+             "Authorization: Bearer <token>, the endpoint is disabled "
+             "if argument not used",
+        default=os.getenv("FILTER_RELOAD_TOKEN", DEFAULT_RELOAD_TOKEN)
+    )
+
+    parser.add_argument(
+        "--revalidation_cache_size",
+        type=int,
+        help="max number of results kept in memory with ETag and "
+             "Last-Modified of their pages for conditional requests, "
+             "0 disables conditional requests",
+        default=os.getenv(
+            "FILTER_REVALIDATION_CACHE_SIZE", DEFAULT_REVALIDATION_CACHE_SIZE
+        )
+    )
+
+    parser.add_argument(
+        "--revalidation_ttl",
+        type=float,
+        help="how long results are kept for conditional requests, seconds",
+        default=os.getenv(
+            "FILTER_REVALIDATION_TTL", DEFAULT_REVALIDATION_TTL
+        )
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        help="number of server processes sharing the port, "
+             "crashed ones are restarted",
+        default=os.getenv("FILTER_WORKERS", DEFAULT_WORKERS)
+    )
+
+    parser.add_argument(
+        "--shutdown_timeout",
+        type=float,
+        help="seconds to finish requests in progress on shutdown",
+        default=os.getenv("FILTER_SHUTDOWN_TIMEOUT", DEFAULT_SHUTDOWN_TIMEOUT)
+    )
+
+    parser.add_argument(
+        "--charged_dict",
+        type=str,
+        action="append",
+        help="file of charged words, one per line, may be repeated; "
+             f"FILTER_CHARGED_DICT is a list separated with {os.pathsep!r}",
+        default=None,
+    )
+
+    parser.add_argument(
+        "--charged_dict_reload_interval",
+        type=float,
+        help="seconds between checks of charged_dict files, changed files "
+             "are reloaded without restart, 0 disables checks",
+        default=os.getenv(
+            "FILTER_CHARGED_DICT_RELOAD_INTERVAL",
+            DEFAULT_CHARGED_DICT_RELOAD_INTERVAL,
+        )
+    )
+
+    parser.add_argument(
+        "--surface_index",
+        action="store_true",
+        help="find charged words by inflected forms instead of "
+             "lemmatizing articles, processing_workers are not used "
+             "in this mode",
+        default=env_flag("FILTER_SURFACE_INDEX", DEFAULT_SURFACE_INDEX)
+    )
+
+    parser.add_argument(
+        "--surface_index_path",
+        type=str,
+        help="file to keep inflected forms of charged words between runs",
+        default=os.getenv(
+            "FILTER_SURFACE_INDEX_PATH", DEFAULT_SURFACE_INDEX_PATH
+        )
+    )
     config = Config()
     c = parser.parse_args()  # kwarg namespace=config doesn't work as expected
     config.__dict__.update(**c.__dict__)  # so we use some dirty magic
+    if c.charged_dict is None:  # append action would extend the default
+        env_files = os.getenv("FILTER_CHARGED_DICT")
+        config.charged_dict = tuple(env_files.split(os.pathsep)) \
+            if env_files else DEFAULT_CHARGED_DICT
+    else:
+        config.charged_dict = tuple(c.charged_dict)
     return config
@@ -0,0 +1,200 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+from typing import Any, AsyncGenerator, Dict, List, Optional
+
+import aiohttp.web as web
+
+from filter.cache import ResultsCache
+from filter.main import ArticlesScorer
+from filter.metrics import REGISTRY, Counter, Gauge, Metric, dump, merge
+from filter.revalidation import RevalidationStore
+from filter.scheduler import Scheduler
+from filter.text_tools import dictionary_version
+
+SNAPSHOT_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+def app_metrics(app: web.Application) -> List[Metric]:
+    """metrics of app components, collected at scrape time"""
+    cache_hits = Counter(
+        "filter_cache_hits_total", "Cache hits.", ["cache"]
+    )
+    cache_misses = Counter(
+        "filter_cache_misses_total", "Cache misses.", ["cache"]
+    )
+    cache_errors = Counter(
+        "filter_cache_errors_total", "Cache failures.", ["cache"]
+    )
+    cache_hit_ratio = Gauge(
+        "filter_cache_hit_ratio", "Share of cache hits.", ["cache"]
+    )
+
+    def add_cache(cache: str, hits: int, misses: int, errors: int = 0) -> None:
+        cache_hits.inc(hits, cache=cache)
+        cache_misses.inc(misses, cache=cache)
+        cache_errors.inc(errors, cache=cache)
+        total = hits + misses
+        cache_hit_ratio.set(hits / total if total else 0.0, cache=cache)
+
+    results_cache: ResultsCache = app["results_cache"]
+    for tier, stats in results_cache.stats.items():
+        add_cache(tier, stats.hits, stats.misses, stats.errors)
+
+    revalidation: Optional[RevalidationStore] = app.get("revalidation")
+    revalidations = Counter(
+        "filter_revalidations_total",
+        "Conditional requests for pages with stored results.",
+        ["outcome"],
+    )
+    if revalidation is not None:
+        for tier, stats in revalidation.stats.items():
+            add_cache(
+                f"validators_{tier}", stats.hits, stats.misses, stats.errors
+            )
+        revalidations.inc(revalidation.not_modified, outcome="not_modified")
+        revalidations.inc(revalidation.modified, outcome="modified")
+
+    scorer: ArticlesScorer = app["scorer"]
+    if scorer.lemma_cache is not None:
+        add_cache("lemma", scorer.lemma_cache.hits, scorer.lemma_cache.misses)
+    if scorer.scores_cache is not None:
+        add_cache(
+            "scores", scorer.scores_cache.hits, scorer.scores_cache.misses
+        )
+
+    coalesced = Counter(
+        "filter_coalesced_requests_total",
+        "Scoring requests joined to already running scoring of the url.",
+    )
+    coalesced.inc(scorer.coalesced)
+    cancelled = Counter(
+        "filter_cancelled_articles_total",
+        "Scorings cancelled because no request waited for them anymore.",
+    )
+    cancelled.inc(scorer.cancelled)
+    charged_words = Gauge(
+        "filter_charged_words",
+        "Entries of charged dictionary in use, by dictionary version.",
+        ["version"],
+    )
+    charged_words.set(
+        len(scorer.charged_words),
+        version=dictionary_version(scorer.charged_words),
+    )
+    in_flight = Gauge(
+        "filter_in_flight_articles", "Articles being scored right now."
+    )
+    in_flight.set(len(scorer.in_flight))
+
+    scheduler: Scheduler = app["scheduler"]
+    queue_wait_sum = Counter(
+        "filter_queue_wait_seconds_total",
+        "Total time spent waiting for scoring slot.",
+    )
+    queue_wait_sum.inc(scheduler.wait_stats.total)
+    queue_wait_count = Counter(
+        "filter_queue_waits_total",
+        "Number of waits for scoring slot.",
+    )
+    queue_wait_count.inc(scheduler.wait_stats.count)
+    queue_wait_max = Gauge(
+        "filter_queue_wait_seconds_max",
+        "Longest wait for scoring slot.",
+    )
+    queue_wait_max.set(scheduler.wait_stats.max)
+
+    scheduler_queue = Gauge(
+        "filter_scheduler_queue_depth",
+        "Urls of admitted requests waiting for a scoring slot.",
+    )
+    scheduler_queue.set(scheduler.waiting)
+    scheduler_running = Gauge(
+        "filter_scheduler_running", "Urls holding a scoring slot."
+    )
+    scheduler_running.set(scheduler.running)
+    scheduler_admitted = Gauge(
+        "filter_scheduler_admitted",
+        "Urls of admitted requests in progress.",
+    )
+    scheduler_admitted.set(scheduler.admitted_total)
+    scheduler_clients = Gauge(
+        "filter_scheduler_clients", "Clients with requests in progress."
+    )
+    scheduler_clients.set(len(scheduler.admitted))
+    scheduler_rejected = Counter(
+        "filter_scheduler_rejected_total",
+        "Requests rejected by scheduler: client over its share (429) "
+        "or server overloaded (503).",
+        ["reason"],
+    )
+    for reason, count in scheduler.rejected.items():
+        scheduler_rejected.inc(count, reason=reason)
+
+    return [
+        cache_hits, cache_misses, cache_errors, cache_hit_ratio,
+        revalidations, coalesced, cancelled, charged_words, in_flight,
+        queue_wait_sum, queue_wait_count, queue_wait_max,
+        scheduler_queue, scheduler_running, scheduler_admitted,
+        scheduler_clients, scheduler_rejected,
+    ]
+
+
+def collect(app: web.Application) -> List[Metric]:
+    """all metrics of this process"""
+    return [*REGISTRY.metrics.values(), *app_metrics(app)]
+
+
+def _snapshot_path(metrics_dir: str, worker: str) -> str:
+    return os.path.join(metrics_dir, f"{worker}.json")
+
+
+def write_snapshot(app: web.Application) -> None:
+    """saves metrics of this worker for other workers to read"""
+    path = _snapshot_path(app["metrics_dir"], app["worker"])
+    with open(path + ".tmp", "w") as f:
+        json.dump(dump(collect(app)), f)
+    os.replace(path + ".tmp", path)
+
+
+def collect_workers(app: web.Application) -> List[Metric]:
+    """metrics of all workers: own ones are fresh,
+    others are up to SNAPSHOT_INTERVAL old"""
+    metrics_dir: str = app["metrics_dir"]
+    dumps: Dict[str, List[Dict[str, Any]]] = {}
+    for filename in sorted(os.listdir(metrics_dir)):
+        worker, ext = os.path.splitext(filename)
+        if ext != ".json" or worker == app["worker"]:
+            continue
+        try:
+            with open(os.path.join(metrics_dir, filename)) as f:
+                dumps[worker] = json.load(f)
+        except (OSError, ValueError):
+            logger.exception("Couldn't read metrics of worker %s", worker)
+    dumps[app["worker"]] = dump(collect(app))
+    return merge(dict(sorted(dumps.items())))
+
+
+async def metrics_snapshots(
+        app: web.Application,
+) -> AsyncGenerator[None, None]:
+    """shares metrics with other workers in background, see cleanup_ctx"""
+    async def write_periodically() -> None:
+        while True:
+            try:
+                write_snapshot(app)
+            except OSError:
+                logger.exception("Couldn't save metrics snapshot")
+            await asyncio.sleep(SNAPSHOT_INTERVAL)
+
+    task = asyncio.ensure_future(write_periodically())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    with contextlib.suppress(OSError):
+        os.unlink(_snapshot_path(app["metrics_dir"], app["worker"]))
@@ -1,6 +1,6 @@
 from typing import Any
 
-from aiohttp import web as web
+from aiohttp import hdrs, web as web
 
 
 @web.middleware
@@ -8,4 +8,8 @@ async def error_middleware(request: web.Request, handler: Any) -> web.Response:
     try:
         return await handler(request)
     except web.HTTPException as ex:
-        return web.json_response({"error": ex.text}, status=ex.status_code)
+        headers = ex.headers.copy()
+        headers.popall(hdrs.CONTENT_TYPE, None)
+        return web.json_response(
+            {"error": ex.text}, status=ex.status_code, headers=headers
+        )
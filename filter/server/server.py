@@ -1,20 +1,65 @@
-import os.path
-from typing import AsyncGenerator, Optional
+import asyncio
+import contextlib
+import functools
+import hmac
+import json
+import logging
+import os
+import signal
+from typing import (
+    Any, AsyncGenerator, Iterable, List, Optional, Sequence, Set, Tuple,
+)
 
 import aiohttp
 import aiohttp.web as web
-import pymorphy2
 
-from aiocache import cached, Cache
-from aiocache.serializers import PickleSerializer
-
-
-from filter import BASE_DIR
-from filter.main import read_charged_words, score_article, ArticlesScorer
+from filter.cache import MemoryCache, ResultsCache
+from filter.codec import ResultSerializer, ValidatedSerializer
+from filter.metrics import REGISTRY, monitor_event_loop_lag, render
+from filter.main import (
+    read_charged_words, stream_score_article, ArticlesScorer
+)
+from filter.pool import create_pool
+from filter.revalidation import RevalidationStore
+from filter.scheduler import (
+    PRIORITY_BATCH, Admission, ClientOverloaded, Overloaded, Scheduler,
+)
+from filter.text_tools import (
+    LemmaCache, ChargedDictionary, SurfaceFormIndex, ScoresCache,
+    get_morph_analyzer,
+)
 from .encoder import dumps
+from .metrics import app_metrics, collect_workers
 from .middlewares import error_middleware
-from .utils import split_urls, is_url
-from .args import get_args, Config
+from .utils import split_urls, split_lines, is_url
+from .args import get_args, Config, DEFAULT_CHARGED_DICT
+
+# sent by workers to supervisor and by supervisor to workers,
+# reloads charged dictionary
+RELOAD_SIGNAL = signal.SIGUSR1
+
+logger = logging.getLogger(__name__)
+
+
+def client_id(request: web.Request) -> str:
+    """value of client_header or ip address, when there is no header"""
+    config: Config = request.app["filter_config"]
+    if config.client_header and config.client_header in request.headers:
+        return request.headers[config.client_header]
+    return request.remote or ""
+
+
+def admit(request: web.Request, count: int) -> Admission:
+    """reserves place for count urls in scheduler,
+    responds 429 or 503 with Retry-After when there is no room"""
+    scheduler: Scheduler = request.app["scheduler"]
+    try:
+        return scheduler.admit(client_id(request), count)
+    except Overloaded as ex:
+        error = web.HTTPTooManyRequests \
+            if isinstance(ex, ClientOverloaded) \
+            else web.HTTPServiceUnavailable
+        raise error(text=str(ex), headers={"Retry-After": str(ex.retry_after)})
 
 
 async def handle_news_list(request: web.Request) -> web.Response:
@@ -37,63 +82,443 @@ async def handle_news_list(request: web.Request) -> web.Response:
         raise web.HTTPBadRequest(text=msg)
 
     scorer: ArticlesScorer = request.app["scorer"]
-    results = await scorer.score_many_articles(
-        urls=urls,
-        session=request.app["http_client"],
-        request_timeout=config.request_timeout,
-        processing_timeout=config.processing_timeout,
-    )
+    with admit(request, urls_count) as admission:
+        results = await scorer.score_many_articles(
+            urls=urls,
+            session=request.app["http_client"],
+            request_timeout=config.request_timeout,
+            processing_timeout=config.processing_timeout,
+            deadline=config.deadline if config.deadline > 0 else None,
+            client=admission.client,
+        )
     return web.json_response(results, dumps=dumps)
 
 
+async def read_batch_urls(request: web.Request) -> List[str]:
+    """urls from json list, json object with "urls" key
+    or newline-delimited text"""
+    body = await request.text()
+    if request.content_type != "application/json":
+        return split_lines(body)
+
+    try:
+        data = json.loads(body)
+    except ValueError:
+        raise web.HTTPBadRequest(text="invalid json")
+    if isinstance(data, dict):
+        data = data.get("urls")
+    if not isinstance(data, list) or not all(
+            isinstance(x, str) for x in data
+    ):
+        raise web.HTTPBadRequest(text="should be a list of urls")
+    return list(dict.fromkeys(x.strip() for x in data if x.strip()))
+
+
+async def handle_batch(request: web.Request) -> web.StreamResponse:
+    """scores many urls, every result is sent as a line of json
+    as soon as it is ready"""
+    urls = await read_batch_urls(request)
+    if not urls:
+        raise web.HTTPBadRequest(text="should be at least one url")
+
+    if not all(is_url(x) for x in urls):
+        raise web.HTTPBadRequest(text="should contain urls only")
+
+    config: Config = request.app["filter_config"]
+    urls_limit = config.batch_urls_limit
+    if len(urls) > urls_limit:
+        msg = f"too many urls in request, should be less than {urls_limit}"
+        raise web.HTTPBadRequest(text=msg)
+
+    # no more than batch_concurrency urls are in progress at once
+    with admit(request, min(len(urls), config.batch_concurrency)) \
+            as admission:
+        response = web.StreamResponse()
+        response.content_type = "application/x-ndjson"
+        await response.prepare(request)
+
+        scorer: ArticlesScorer = request.app["scorer"]
+        results = scorer.score_as_completed(
+            urls=urls,
+            session=request.app["http_client"],
+            request_timeout=config.request_timeout,
+            processing_timeout=config.processing_timeout,
+            concurrency=config.batch_concurrency,
+            client=admission.client,
+            priority=PRIORITY_BATCH,
+        )
+        try:
+            async for result in results:
+                await response.write(dumps(result).encode() + b"\n")
+        finally:
+            await results.aclose()
+    await response.write_eof()
+    return response
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    if "metrics_dir" in request.app:  # one of several workers
+        text = render(collect_workers(request.app))
+    else:
+        text = REGISTRY.render(extra=app_metrics(request.app))
+    return web.Response(
+        text=text,
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def event_loop_monitor(
+        app: web.Application
+) -> AsyncGenerator[None, None]:
+    """measures event loop lag in background, see cleanup_ctx"""
+    task = asyncio.ensure_future(monitor_event_loop_lag())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
 async def aiohttp_client(app: web.Application) -> AsyncGenerator[None, None]:
     """reusable aiohttp client session, see cleanup_ctx"""
-    async with aiohttp.ClientSession() as session:
+    config: Config = app["filter_config"]
+    connector = aiohttp.TCPConnector(
+        limit=config.connections_limit,
+        limit_per_host=config.connections_per_host,
+        use_dns_cache=config.dns_cache_ttl > 0,
+        ttl_dns_cache=config.dns_cache_ttl,
+        keepalive_timeout=config.keepalive_timeout,
+    )
+    async with aiohttp.ClientSession(connector=connector) as session:
         app["http_client"] = session
         yield
 
 
+async def process_pool(app: web.Application) -> AsyncGenerator[None, None]:
+    """worker processes for text processing, see cleanup_ctx"""
+    config: Config = app["filter_config"]
+    scorer: ArticlesScorer = app["scorer"]
+    if (config.processing_workers <= 0 or config.streaming
+            or config.surface_index):
+        yield
+        return
+    executor = create_pool(
+        config.processing_workers, config.lemma_cache_size
+    )
+    scorer.executor = executor
+    try:
+        yield
+    finally:
+        scorer.executor = None
+        executor.shutdown()
+
+
+async def close_results_cache(app: web.Application) -> None:
+    await app["results_cache"].close()
+    if app.get("revalidation") is not None:
+        await app["revalidation"].close()
+
+
+def _redis_cache(config: Config, serializer: Any, namespace: str) -> Any:
+    # aiocache pulls aioredis in, import it only when configured
+    from aiocache import Cache
+
+    return Cache(
+        Cache.REDIS,
+        serializer=serializer,
+        endpoint=config.redis_host,
+        port=config.redis_port,
+        namespace=namespace,
+    )
+
+
+def build_charged_words(
+        files: Sequence[str],
+        surface_index_path: Optional[str] = None,
+) -> ChargedDictionary:
+    """reads charged dictionary, with surface_index_path
+    it is expanded into SurfaceFormIndex"""
+    entries = read_charged_words(list(files))
+    morph = get_morph_analyzer()
+    if surface_index_path is not None:
+        return SurfaceFormIndex.load_or_build(
+            surface_index_path, entries, morph
+        )
+    return ChargedDictionary(entries, morph=morph)
+
+
+@functools.lru_cache(maxsize=None)
+def load_charged_words(
+        files: Tuple[str, ...] = DEFAULT_CHARGED_DICT,
+        surface_index_path: Optional[str] = None,
+) -> ChargedDictionary:
+    """charged dictionary is read once per process and shared by all apps,
+    see build_charged_words"""
+    return build_charged_words(files, surface_index_path)
+
+
+def _surface_index_path(config: Config) -> Optional[str]:
+    return config.surface_index_path if config.surface_index else None
+
+
+def _charged_words(config: Config) -> ChargedDictionary:
+    return load_charged_words(
+        config.charged_dict, _surface_index_path(config)
+    )
+
+
+def _files_state(files: Iterable[str]) -> List[Optional[Tuple[int, int]]]:
+    """modification times and sizes of files, None for missing ones"""
+    state: List[Optional[Tuple[int, int]]] = []
+    for path in files:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            state.append(None)
+        else:
+            state.append((stat.st_mtime_ns, stat.st_size))
+    return state
+
+
+class ChargedWordsFiles:
+    """State of charged dictionary files at the last reload.
+
+    Started app can't be changed, so reloads change this object
+    kept in the app instead.
+    """
+
+    def __init__(self, paths: Sequence[str]) -> None:
+        self.paths = paths
+        self.state = _files_state(paths)
+        # RELOAD_SIGNAL sent to supervisor, it is relayed back to us too
+        self.own_signals = 0
+        # created lazily to be bound to the running loop
+        self._lock: Optional[asyncio.Lock] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """one reload at once"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def changed(self) -> bool:
+        return _files_state(self.paths) != self.state
+
+
+async def reload_charged_words(app: web.Application) -> ChargedDictionary:
+    """Builds charged dictionary from files again in a thread and swaps
+    it in scorer at once. Scoring in progress keeps the old dictionary,
+    results of the old one are not taken from caches (see cache_key)."""
+    config: Config = app["filter_config"]
+    files: ChargedWordsFiles = app["charged_words_files"]
+    async with files.lock:
+        files.state = _files_state(files.paths)
+        loop = asyncio.get_event_loop()
+        charged_words: ChargedDictionary = await loop.run_in_executor(
+            None,
+            build_charged_words,
+            config.charged_dict,
+            _surface_index_path(config),
+        )
+        scorer: ArticlesScorer = app["scorer"]
+        scorer.charged_words = charged_words
+    logger.info("Charged words reloaded, version %s", charged_words.version)
+    return charged_words
+
+
+def _check_reload_token(request: web.Request) -> None:
+    config: Config = request.app["filter_config"]
+    if not config.reload_token:
+        raise web.HTTPForbidden(text="reload is disabled, see --reload_token")
+    expected = f"Bearer {config.reload_token}".encode()
+    given = request.headers.get(aiohttp.hdrs.AUTHORIZATION, "").encode()
+    if not hmac.compare_digest(given, expected):
+        raise web.HTTPUnauthorized(
+            text="wrong reload token", headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+async def handle_reload_charged_words(request: web.Request) -> web.Response:
+    """Reloads charged dictionary of this process, needs reload_token.
+    One of several workers asks supervisor to reload the others too,
+    they reload in background (see charged_words_signal), so the
+    response describes the dictionary of this worker only."""
+    _check_reload_token(request)
+    try:
+        charged_words = await reload_charged_words(request.app)
+    except OSError:
+        logger.exception("Couldn't reload charged words")
+        raise web.HTTPInternalServerError(
+            text="couldn't read charged words files"
+        )
+    supervisor_pid = request.app.get("supervisor_pid")
+    if supervisor_pid is not None:
+        os.kill(supervisor_pid, RELOAD_SIGNAL)
+        files: ChargedWordsFiles = request.app["charged_words_files"]
+        files.own_signals += 1
+    return web.json_response({
+        "version": charged_words.version,
+        "words": len(charged_words.words),
+        "phrases": len(charged_words.phrases),
+    })
+
+
+async def charged_words_signal(
+        app: web.Application,
+) -> AsyncGenerator[None, None]:
+    """reloads charged dictionary on RELOAD_SIGNAL, see cleanup_ctx"""
+    loop = asyncio.get_event_loop()
+    tasks: Set[asyncio.Future] = set()
+
+    async def reload() -> None:
+        try:
+            await reload_charged_words(app)
+        except Exception:
+            logger.exception("Couldn't reload charged words")
+
+    def on_signal() -> None:
+        files: ChargedWordsFiles = app["charged_words_files"]
+        if files.own_signals:  # relayed back, reloaded already
+            files.own_signals -= 1
+            return
+        task = asyncio.ensure_future(reload())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    loop.add_signal_handler(RELOAD_SIGNAL, on_signal)
+    yield
+    loop.remove_signal_handler(RELOAD_SIGNAL)
+    for task in list(tasks):
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def charged_words_watcher(
+        app: web.Application,
+) -> AsyncGenerator[None, None]:
+    """reloads charged dictionary when its files change, see cleanup_ctx"""
+    config: Config = app["filter_config"]
+    interval = config.charged_dict_reload_interval
+    files: ChargedWordsFiles = app["charged_words_files"]
+
+    async def watch() -> None:
+        while True:
+            await asyncio.sleep(interval)
+            if not files.changed():
+                continue
+            try:
+                await reload_charged_words(app)
+            except Exception:
+                logger.exception("Couldn't reload charged words")
+
+    if interval <= 0:
+        yield
+        return
+    task = asyncio.ensure_future(watch())
+    yield
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+
+def preload(config: Config) -> None:
+    """Loads everything slow get_app needs, so app starts at once.
+
+    Call it before forking workers, so they share loaded dictionaries
+    and don't load their own.
+    """
+    _charged_words(config)
+    if config.redis_host:
+        import aiocache  # noqa: F401
+
+
 def get_app(config: Optional[Config] = None) -> web.Application:
 
     if config is None:
         config = Config()  # use default values
 
-    # could be configurable too, but who need it?
-    charged_words = read_charged_words([
-        os.path.join(BASE_DIR, "charged_dict/negative_words.txt"),
-        os.path.join(BASE_DIR, "charged_dict/positive_words.txt"),
-    ])
+    morph = get_morph_analyzer()
+    charged_words = _charged_words(config)
 
     app = web.Application(middlewares=[error_middleware])
     app["filter_config"] = config
+    app["charged_words_files"] = ChargedWordsFiles(config.charged_dict)
 
-    app.add_routes([web.get('/', handle_news_list)])
+    app.add_routes([
+        web.get('/', handle_news_list),
+        web.post('/batch', handle_batch),
+        web.get('/metrics', handle_metrics),
+        web.post('/charged_words/reload', handle_reload_charged_words),
+    ])
     app.cleanup_ctx.append(aiohttp_client)
+    app.cleanup_ctx.append(process_pool)
+    app.cleanup_ctx.append(event_loop_monitor)
+    app.cleanup_ctx.append(charged_words_watcher)
+    app.cleanup_ctx.append(charged_words_signal)
     scorer = ArticlesScorer(
         charged_words=charged_words,
-        morph=pymorphy2.MorphAnalyzer(),
+        morph=morph,
+        lemma_cache=LemmaCache(config.lemma_cache_size),
+        scores_cache=ScoresCache(config.scores_cache_size),
+        max_body_size=config.max_body_size,
     )
     app["scorer"] = scorer
 
-    if config.redis_host:
-        cache_decorator = cached(
-            cache=Cache.REDIS,
-            serializer=PickleSerializer(),
-            endpoint=config.redis_host,
-            port=config.redis_port,
-            namespace="main",
-            ttl=60,
+    if config.streaming:
+        scorer.score_article = stream_score_article
+
+    revalidation = None
+    if config.revalidation_cache_size > 0:
+        revalidation = RevalidationStore(
+            memory=MemoryCache(
+                config.revalidation_cache_size, config.revalidation_ttl
+            ),
+            shared=_redis_cache(
+                config, ValidatedSerializer(), "validators"
+            ) if config.redis_host else None,
+            ttl=config.revalidation_ttl,
         )
-        decorated_rate_article = cache_decorator(score_article)
-        scorer.score_article = decorated_rate_article  # use custom strategy
+        scorer.score_article = revalidation.decorate(scorer.score_article)
+    app["revalidation"] = revalidation
+
+    # the only limit of concurrent scoring, cache hits don't wait for it
+    scheduler = Scheduler(
+        config.concurrency_limit,
+        config.concurrency_per_host,
+        config.queue_size,
+        config.client_queue_size,
+    )
+    app["scheduler"] = scheduler
+    scorer.score_article = scheduler.decorate(scorer.score_article)
+
+    shared_cache = None
+    if config.redis_host:
+        shared_cache = _redis_cache(config, ResultSerializer(), "main")
+    results_cache = ResultsCache(
+        memory=MemoryCache(config.cache_size, config.cache_ttl),
+        shared=shared_cache,
+        ttl=config.cache_ttl,
+    )
+    app["results_cache"] = results_cache
+    app.on_cleanup.append(close_results_cache)
+    # use custom strategy
+    scorer.score_article = results_cache.decorate(scorer.score_article)
 
     return app
 
 
 def main() -> None:
     config = get_args()
+    preload(config)
+    if config.workers > 1:
+        from .supervisor import Supervisor
+        Supervisor(config).run()
+        return
     app = get_app(config)
-    web.run_app(app, port=config.port)
+    web.run_app(
+        app, port=config.port, shutdown_timeout=config.shutdown_timeout
+    )
 
 
 if __name__ == '__main__':
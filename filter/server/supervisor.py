@@ -0,0 +1,148 @@
+"""Several server processes listening on one port (SO_REUSEPORT).
+
+Dictionaries are loaded before forking, so workers share them.
+Crashed workers are restarted, SIGTERM or SIGINT stops all workers
+gracefully, SIGUSR1 makes all workers reload charged dictionary
+(POST /charged_words/reload sends it to supervisor).
+Every worker saves its metrics to a shared directory,
+so /metrics served by any worker covers all of them.
+Results cache is per worker, configure redis to share it.
+"""
+import logging
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from types import FrameType
+from typing import Dict, Optional
+
+import aiohttp.web as web
+
+from .args import Config
+from .metrics import metrics_snapshots
+from .server import RELOAD_SIGNAL, get_app
+
+POLL_INTERVAL = 0.1
+RESTART_DELAY = 1.0  # workers crashing at start are restarted not so often
+KILL_DELAY = 5.0  # after shutdown_timeout
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(config: Config, worker: str, metrics_dir: str) -> None:
+    app = get_app(config)
+    app["worker"] = worker
+    app["metrics_dir"] = metrics_dir
+    app["supervisor_pid"] = os.getppid()
+    app.cleanup_ctx.append(metrics_snapshots)
+    web.run_app(
+        app,
+        port=config.port,
+        reuse_port=True,
+        shutdown_timeout=config.shutdown_timeout,
+        print=print if worker == "0" else None,  # type: ignore
+    )
+
+
+class Supervisor:
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self.workers: Dict[int, str] = {}  # pid -> worker name
+        self.started: Dict[str, float] = {}
+        self.deadline: Optional[float] = None  # set when stopping
+        self.metrics_dir = ""
+
+    def run(self) -> None:
+        """forks workers and waits until they are stopped,
+        shared data is loaded before, see server.preload"""
+        self.metrics_dir = tempfile.mkdtemp(prefix="filter-metrics-")
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(RELOAD_SIGNAL, self.reload)
+        try:
+            for i in range(self.config.workers):
+                self.spawn(str(i))
+            self.wait()
+        finally:
+            shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+    def spawn(self, worker: str) -> None:
+        pid = os.fork()
+        if pid == 0:
+            self._run_child(worker)
+        self.workers[pid] = worker
+        self.started[worker] = time.monotonic()
+
+    def _run_child(self, worker: str) -> None:
+        """never returns"""
+        code = 1
+        try:
+            # own process group, so ctrl+c reaches supervisor only
+            os.setpgid(0, 0)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            # until worker's event loop handles it, see charged_words_signal
+            signal.signal(RELOAD_SIGNAL, signal.SIG_IGN)
+            run_worker(self.config, worker, self.metrics_dir)
+            code = 0
+        except BaseException:
+            logger.exception("Worker %s failed", worker)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def stop(
+            self,
+            signum: int = signal.SIGTERM,
+            frame: Optional[FrameType] = None,
+    ) -> None:
+        """signal handler, the second signal kills workers at once"""
+        if self.deadline is not None:
+            self.deadline = time.monotonic()
+            return
+        self.deadline = (
+            time.monotonic() + self.config.shutdown_timeout + KILL_DELAY
+        )
+        self._signal_workers(signal.SIGTERM)
+
+    def reload(
+            self,
+            signum: int = RELOAD_SIGNAL,
+            frame: Optional[FrameType] = None,
+    ) -> None:
+        """signal handler, passes reload of charged dictionary on
+        to all workers"""
+        if self.deadline is None:
+            self._signal_workers(RELOAD_SIGNAL)
+
+    def _signal_workers(self, signum: int) -> None:
+        for pid in self.workers:
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def wait(self) -> None:
+        while self.workers:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                if self.deadline is not None \
+                        and time.monotonic() >= self.deadline:
+                    logger.warning("Killing workers still running")
+                    self._signal_workers(signal.SIGKILL)
+                time.sleep(POLL_INTERVAL)
+                continue
+            worker = self.workers.pop(pid, None)
+            if worker is None or self.deadline is not None:
+                continue
+            logger.warning(
+                "Worker %s exited with status %s, restarting", worker, status
+            )
+            uptime = time.monotonic() - self.started[worker]
+            if uptime < RESTART_DELAY:
+                time.sleep(RESTART_DELAY - uptime)
+            if self.deadline is None:
+                self.spawn(worker)
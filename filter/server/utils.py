@@ -15,6 +15,13 @@ def split_urls(urls_string: Optional[str]) -> List[str]:
     return sorted({x.strip() for x in urls_string.split(",") if x.strip()})
 
 
+def split_lines(text: str) -> List[str]:
+    """converts newline-delimited string into list of stripped non-empty
+    lines, drops duplicates but keeps order"""
+    lines = (x.strip() for x in text.splitlines())
+    return list(dict.fromkeys(x for x in lines if x))
+
+
 def is_url(
         url: str,
         regexp: Pattern = URLS_REGEX
@@ -1,9 +1,73 @@
 import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import re
 import string
-from typing import List
+import tempfile
+import unicodedata
+from collections import OrderedDict
+from typing import (
+    Collection, Counter, Dict, Iterable, Iterator, List, Mapping, Optional,
+    Sequence, Tuple, Union,
+)
 
 import pymorphy2
 
+from filter.metrics import StageTimings, measure
+
+DEFAULT_LEMMA_CACHE_SIZE = 50000
+DEFAULT_SCORES_CACHE_SIZE = 10000
+SURFACE_INDEX_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def get_morph_analyzer() -> pymorphy2.MorphAnalyzer:
+    """MorphAnalyzer shared by the whole process, it loads dictionaries
+    for a while and takes a lot of memory. Processes forked after the first
+    call share it too."""
+    return pymorphy2.MorphAnalyzer()
+
+
+class LemmaCache:
+    """bounded LRU cache of normal forms keyed by cleaned surface form,
+    shared by all requests in the process"""
+
+    def __init__(self, maxsize: int = DEFAULT_LEMMA_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lemmas: 'OrderedDict[str, str]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._lemmas)
+
+    def get(self, word: str) -> Optional[str]:
+        try:
+            lemma = self._lemmas[word]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._lemmas.move_to_end(word)
+        self.hits += 1
+        return lemma
+
+    def put(self, word: str, lemma: str) -> None:
+        if self.maxsize <= 0:
+            return
+        self._lemmas[word] = lemma
+        self._lemmas.move_to_end(word)
+        if len(self._lemmas) > self.maxsize:
+            self._lemmas.popitem(last=False)  # evict least recently used
+
+    def clear(self) -> None:
+        self._lemmas.clear()
+        self.hits = self.misses = 0
+
 
 def _clean_word(word: str) -> str:
     word = word.replace('«', '').replace('»', '').replace('…', '')
@@ -12,34 +76,578 @@ def _clean_word(word: str) -> str:
     return word
 
 
+def _normalize_word(
+        morph: pymorphy2.MorphAnalyzer,
+        word: str,
+        lemma_cache: Optional[LemmaCache] = None,
+) -> str:
+    if lemma_cache is None:
+        return morph.parse(word)[0].normal_form
+    normalized_word = lemma_cache.get(word)
+    if normalized_word is None:
+        normalized_word = morph.parse(word)[0].normal_form
+        lemma_cache.put(word, normalized_word)
+    return normalized_word
+
+
+_DELETED_CHARS = str.maketrans('', '', '«»…')
+_PUNCTUATION = re.escape(string.punctuation)
+# whitespace separated token, punctuation around it is left out of the group
+_TOKEN_REGEX = re.compile(
+    rf"(?<!\S)[{_PUNCTUATION}]*(\S*?)[{_PUNCTUATION}]*(?!\S)"
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """the same as _clean_word applied to every word of text,
+    but done by one regex over the whole text, empty tokens are dropped"""
+    return [
+        token
+        for token in _TOKEN_REGEX.findall(text.translate(_DELETED_CHARS))
+        if token
+    ]
+
+
+def _is_word(normalized_word: str) -> bool:
+    """prepositions and other short words are not counted"""
+    return len(normalized_word) > 2 or normalized_word == 'не'
+
+
+def _lemmatize_unique(
+        morph: pymorphy2.MorphAnalyzer,
+        tokens: Iterable[str],
+        lemma_cache: Optional[LemmaCache] = None,
+) -> Dict[str, Optional[str]]:
+    """normal form of every distinct token, None for not counted ones"""
+    lemmas: Dict[str, Optional[str]] = {}
+    for token in tokens:
+        if token not in lemmas:
+            lemma = _normalize_word(morph, token, lemma_cache)
+            lemmas[token] = lemma if _is_word(lemma) else None
+    return lemmas
+
+
+def lemmatize_tokens(
+        morph: pymorphy2.MorphAnalyzer,
+        tokens: Iterable[str],
+        lemma_cache: Optional[LemmaCache] = None,
+) -> Iterator[str]:
+    """normal forms of cleaned tokens, without prepositions"""
+    for cleaned_word in tokens:
+        normalized_word = _normalize_word(morph, cleaned_word, lemma_cache)
+        if _is_word(normalized_word):
+            yield normalized_word
+
+
+def lemmatize_batch(
+        morph: pymorphy2.MorphAnalyzer,
+        tokens: Sequence[str],
+        lemma_cache: Optional[LemmaCache] = None,
+) -> List[str]:
+    """Batch version of lemmatize_tokens.
+
+    Every distinct word form is lemmatized once, lemmas are mapped back
+    to the tokens, so the order of words is kept.
+    """
+    lemmas = _lemmatize_unique(morph, tokens, lemma_cache)
+    return [lemma for lemma in map(lemmas.__getitem__, tokens) if lemma]
+
+
+def lemmatize_text(
+        morph: pymorphy2.MorphAnalyzer,
+        text: str,
+        lemma_cache: Optional[LemmaCache] = None,
+) -> List[str]:
+    """normal forms of words of text in order, see lemmatize_batch"""
+    return lemmatize_batch(morph, tokenize(text), lemma_cache)
+
+
+def count_lemmas(
+        morph: pymorphy2.MorphAnalyzer,
+        text: str,
+        lemma_cache: Optional[LemmaCache] = None,
+        charged_words: Optional['ChargedDictionary'] = None,
+) -> Counter[str]:
+    """Batch lemmatization returning number of occurrences of every lemma.
+
+    Word order is lost in counts, so if charged_words contains phrases,
+    phrases found in text are counted as a whole under space-joined key
+    instead of their words, see ChargedDictionary.counts().
+    """
+    if charged_words is not None and charged_words.phrases:
+        return charged_words.counts(lemmatize_text(morph, text, lemma_cache))
+    token_counts = Counter(tokenize(text))
+    lemmas = _lemmatize_unique(morph, token_counts, lemma_cache)
+    counts: Counter[str] = Counter()
+    for token, count in token_counts.items():
+        lemma = lemmas[token]
+        if lemma:
+            counts[lemma] += count
+    return counts
+
+
 async def split_by_words(
         morph: pymorphy2.MorphAnalyzer,
-        text: str
+        text: str,
+        lemma_cache: Optional[LemmaCache] = None,
+        timings: Optional[StageTimings] = None,
 ) -> List[str]:
     """Учитывает знаки пунктуации,
     регистр и словоформы, выкидывает предлоги."""
+    with measure(timings, "tokenize"):
+        tokens = tokenize(text)
     words = []
-    for word in text.split():
-        cleaned_word = _clean_word(word)
-        normalized_word = morph.parse(cleaned_word)[0].normal_form
-        if len(normalized_word) > 2 or normalized_word == 'не':
+    with measure(timings, "lemmatize"):
+        for normalized_word in lemmatize_tokens(morph, tokens, lemma_cache):
             words.append(normalized_word)
-        await asyncio.sleep(0)  # release event loop after each iteration
+            await asyncio.sleep(0)  # release event loop after each iteration
     return words
 
 
+_CLARIFICATION_REGEX = re.compile(r"\(.*?\)")
+_STRESS_MARK = "\u0301"
+
+
+def _normalize_entry(
+        entry: str,
+        morph: Optional[pymorphy2.MorphAnalyzer] = None,
+) -> Tuple[str, ...]:
+    """turns dictionary entry like "Му́ка" or "холод (собачий)"
+    into tuple of lowercase words without stress marks and clarifications"""
+    entry = unicodedata.normalize("NFD", entry.lower())
+    entry = unicodedata.normalize("NFC", entry.replace(_STRESS_MARK, ""))
+    entry = _CLARIFICATION_REGEX.sub(" ", entry)
+    words = [_clean_word(w) for w in entry.split()]
+    if morph is not None:
+        words = [morph.parse(w)[0].normal_form for w in words if w]
+    return tuple(w for w in words if w)
+
+
+class ChargedDictionary:
+    """Immutable lookup structure for "charged" words and phrases.
+
+    Entries are deduplicated and normalized, with morph given
+    they are also reduced to normal forms. Phrases (entries of several
+    words) are matched against consecutive article words.
+    """
+
+    def __init__(
+            self,
+            entries: Iterable[str],
+            morph: Optional[pymorphy2.MorphAnalyzer] = None,
+    ) -> None:
+        words = set()
+        phrases = set()
+        for entry in entries:
+            normalized = _normalize_entry(entry, morph)
+            if len(normalized) == 1:
+                words.add(normalized[0])
+            elif normalized:
+                phrases.add(normalized)
+
+        self.words = frozenset(words)
+        self.phrases = frozenset(phrases)
+        self.max_phrase_len = max(map(len, phrases), default=1)
+        self._phrase_keys = frozenset(" ".join(p) for p in phrases)
+        self.version = self._make_version()
+
+        phrases_by_head: Dict[str, List[Tuple[str, ...]]] = {}
+        for phrase in phrases:
+            phrases_by_head.setdefault(phrase[0], []).append(phrase)
+        # try longest phrases first
+        self._phrases_by_head: Dict[str, Tuple[Tuple[str, ...], ...]] = {
+            head: tuple(sorted(candidates, key=len, reverse=True))
+            for head, candidates in phrases_by_head.items()
+        }
+
+    def _make_version(self) -> str:
+        """changes with entries and with the way they are matched"""
+        digest = hashlib.sha1(self.__class__.__name__.encode())
+        for word in sorted(self.words):
+            digest.update(b"\0" + word.encode())
+        for phrase in sorted(self._phrase_keys):
+            digest.update(b"\1" + phrase.encode())
+        return digest.hexdigest()[:16]
+
+    def __contains__(self, word: object) -> bool:
+        return word in self.words
+
+    def __len__(self) -> int:
+        return len(self.words) + len(self.phrases)
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}"
+            f"(words={len(self.words)}, phrases={len(self.phrases)})"
+        )
+
+    def count(self, article_words: Sequence[str]) -> int:
+        """number of article words which are charged,
+        single pass over article_words"""
+        found, _ = self.count_prefix(article_words)
+        return found
+
+    def count_prefix(
+            self,
+            article_words: Sequence[str],
+            final: bool = True,
+    ) -> Tuple[int, int]:
+        """Counts charged words like count() and returns number of
+        consumed words too. If final is False, the last words that could
+        start a phrase continued in the next part of the article are left
+        unconsumed."""
+        words_count = len(article_words)
+        if not self._phrases_by_head:
+            found = sum(map(self.words.__contains__, article_words))
+            return found, words_count
+
+        stop = words_count if final else words_count - self.max_phrase_len + 1
+        found = 0
+        consumed = 0
+        for start, end in self._match(article_words, stop):
+            if end - start > 1 or article_words[start] in self.words:
+                found += end - start
+            consumed = end
+        return found, consumed
+
+    def counts(self, article_words: Sequence[str]) -> Counter[str]:
+        """Counts of article words with charged phrases matched the same
+        way as by count().
+
+        Key of a single word is the word itself, key of a phrase is its
+        words joined with a space. Lemmas never contain spaces, so keys
+        don't clash, see count_lemmas.
+        """
+        counts: Counter[str] = Counter()
+        for start, end in self._match(article_words, len(article_words)):
+            counts[" ".join(article_words[start:end])] += 1
+        return counts
+
+    def _match(
+            self,
+            article_words: Sequence[str],
+            stop: int,
+    ) -> Iterator[Tuple[int, int]]:
+        """Splits article words starting before stop into charged phrases
+        and single words, yields their start and end. The longest phrase
+        starting at a word wins, so matched phrases don't overlap."""
+        i = 0
+        while i < stop:
+            end = i + 1
+            for phrase in self._phrases_by_head.get(article_words[i], ()):
+                if tuple(article_words[i:i + len(phrase)]) == phrase:
+                    end = i + len(phrase)
+                    break
+            yield i, end
+            i = end
+
+    def count_lemmas(self, counts: 'LemmaCounts') -> Tuple[int, int]:
+        """number of charged words and number of all words in counts,
+        keys are single lemmas and space-joined phrases, see counts()"""
+        found = 0
+        total = 0
+        for key, count in counts.items():
+            if key in self.words:
+                found += count
+                total += count
+            elif key in self._phrase_keys:
+                words_in_phrase = key.count(" ") + 1
+                found += count * words_in_phrase
+                total += count * words_in_phrase
+            else:
+                total += count * (key.count(" ") + 1)
+        return found, total
+
+
+def _is_own_file(fd: int) -> bool:
+    """file belongs to current user, always true where there are no uids"""
+    if not hasattr(os, "getuid"):
+        return True
+    return os.fstat(fd).st_uid == os.getuid()
+
+
+class SurfaceFormIndex(ChargedDictionary):
+    """Charged dictionary expanded into all inflected forms of its words.
+
+    Articles scored with it are not lemmatized at all: a charged word
+    is found by lowercase form with a hash lookup, other words are only
+    counted. Forms are generated from lexemes of charged lemmas and
+    indexed only if their most probable parse, the one lemmatization
+    takes, has a charged normal form, so ambiguous forms like "стали"
+    are usually left out. That is close to lemmatization, not the same:
+    forms pymorphy2 doesn't generate from the lexemes are missed, and
+    short forms of longer lemmas (e.g. "им") are not counted as words.
+    """
+
+    def __init__(
+            self,
+            entries: Iterable[str],
+            morph: pymorphy2.MorphAnalyzer,
+            forms: Optional[Mapping[str, str]] = None,
+    ) -> None:
+        super().__init__(entries, morph)
+        lemmas = self.words.union(*self.phrases)
+        self.key = self._make_key(lemmas)
+        if forms is None:
+            forms = self._expand(morph, lemmas)
+        self.forms: Dict[str, str] = dict(forms)
+
+    @staticmethod
+    def _make_key(lemmas: Iterable[str]) -> str:
+        """index depends only on lemmas and pymorphy2 dictionaries"""
+        digest = hashlib.sha1(f"{SURFACE_INDEX_VERSION}".encode())
+        digest.update(pymorphy2.__version__.encode())
+        for lemma in sorted(lemmas):
+            digest.update(b"\0" + lemma.encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _expand(
+            morph: pymorphy2.MorphAnalyzer,
+            lemmas: Collection[str],
+    ) -> Dict[str, str]:
+        forms: Dict[str, str] = {}
+        for lemma in lemmas:
+            for parse in morph.parse(lemma):
+                for form in parse.lexeme:
+                    word = form.word
+                    for variant in {word, word.replace("ё", "е")}:
+                        if variant in forms:
+                            continue
+                        normal_form = morph.parse(variant)[0].normal_form
+                        if normal_form in lemmas:
+                            forms[variant] = normal_form
+        return forms
+
+    def lemmatize(self, tokens: Iterable[str]) -> List[str]:
+        """Stand-in for lemmatize_batch.
+
+        Charged words are replaced by normal forms, other words
+        by empty strings, short words are dropped.
+        """
+        words = []
+        forms = self.forms
+        for token in tokens:
+            token = token.lower()
+            lemma = forms.get(token)
+            if lemma is not None:
+                if _is_word(lemma):
+                    words.append(lemma)
+            elif _is_word(token):
+                words.append("")
+        return words
+
+    def save(self, path: str) -> None:
+        """atomically writes index to json file"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        data = {"key": self.key, "forms": self.forms}
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load_or_build(
+            cls,
+            path: str,
+            entries: Iterable[str],
+            morph: pymorphy2.MorphAnalyzer,
+    ) -> 'SurfaceFormIndex':
+        """Loads index saved to path by previous run.
+
+        Index is rebuilt and saved if file is missing, broken, made
+        for other dictionary or owned by another user, failure to save
+        it is not fatal.
+        """
+        index = cls(entries, morph, forms={})
+        try:
+            with open(path, encoding="utf-8") as f:
+                if not _is_own_file(f.fileno()):
+                    raise OSError(f"{path} is owned by another user")
+                data = json.load(f)
+            if data["key"] == index.key:
+                index.forms = data["forms"]
+                return index
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning("Rebuilding surface forms index %s", path,
+                           exc_info=True)
+        index.forms = cls._expand(morph, index.words.union(*index.phrases))
+        try:
+            index.save(path)
+        except OSError:
+            logger.exception("Couldn't save surface forms index to %s", path)
+        return index
+
+
+ChargedWords = Union[ChargedDictionary, Collection[str]]
+# lemma -> number of occurrences, as returned by count_lemmas
+LemmaCounts = Mapping[str, int]
+
+
+def dictionary_version(charged_words: ChargedWords) -> str:
+    """version of charged dictionary, plain collections have none"""
+    if isinstance(charged_words, ChargedDictionary):
+        return charged_words.version
+    return ""
+
+
+class ScoresCache:
+    """Bounded LRU cache of (score, words count) keyed by hash
+    of sanitized article text and version of charged dictionary,
+    so the same article under several urls is lemmatized once.
+    Plain collections of charged words have no version, so their
+    scores are not cached."""
+
+    def __init__(self, maxsize: int = DEFAULT_SCORES_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._scores: 'OrderedDict[str, Tuple[float, int]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    @staticmethod
+    def key(text: str, charged_words: ChargedWords) -> Optional[str]:
+        if not isinstance(charged_words, ChargedDictionary):
+            return None
+        digest = hashlib.blake2b(
+            text.encode("utf-8", "surrogatepass"), digest_size=16
+        )
+        return f"{charged_words.version}:{digest.hexdigest()}"
+
+    def get(
+            self,
+            text: str,
+            charged_words: ChargedWords,
+    ) -> Optional[Tuple[float, int]]:
+        key = self.key(text, charged_words)
+        if key is None or self.maxsize <= 0:
+            return None
+        try:
+            scored = self._scores[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._scores.move_to_end(key)
+        self.hits += 1
+        return scored
+
+    def put(
+            self,
+            text: str,
+            charged_words: ChargedWords,
+            score: float,
+            words_count: int,
+    ) -> None:
+        key = self.key(text, charged_words)
+        if key is None or self.maxsize <= 0:
+            return
+        self._scores[key] = (score, words_count)
+        self._scores.move_to_end(key)
+        if len(self._scores) > self.maxsize:
+            self._scores.popitem(last=False)  # evict least recently used
+
+    def clear(self) -> None:
+        self._scores.clear()
+        self.hits = self.misses = 0
+
+
+def _jaundice_rate(charged_words_count: int, words_count: int) -> float:
+    if not words_count:
+        return 0.0
+    return round(charged_words_count / words_count * 100, 2)
+
+
 def calculate_jaundice_rate(
-        article_words: List[str],
-        charged_words: List[str]
+        article_words: Union[Sequence[str], LemmaCounts],
+        charged_words: ChargedWords,
 ) -> float:
     """Расчитывает желтушность текста,
-    принимает список "заряженных" слов и ищет их внутри article_words."""
+    принимает "заряженные" слова и ищет их внутри article_words.
+    article_words - список слов статьи или их количества (count_lemmas)."""
 
     if not article_words:
         return 0.0
 
-    found_charged_words = [w for w in article_words if w in set(charged_words)]
+    if not isinstance(charged_words, ChargedDictionary):
+        charged_words = ChargedDictionary(charged_words)
+
+    if isinstance(article_words, Mapping):
+        return _jaundice_rate(*charged_words.count_lemmas(article_words))
+
+    found_charged_words = charged_words.count(article_words)
+
+    return _jaundice_rate(found_charged_words, len(article_words))
+
+
+class WordsCounter:
+    """Running counters of article words and charged words.
+
+    Text is fed in arbitrary chunks, e.g. while the article is still
+    downloading, words split between chunks are handled.
+    """
+
+    def __init__(
+            self,
+            morph: pymorphy2.MorphAnalyzer,
+            charged_words: ChargedWords,
+            lemma_cache: Optional[LemmaCache] = None,
+    ) -> None:
+        if not isinstance(charged_words, ChargedDictionary):
+            charged_words = ChargedDictionary(charged_words)
+        self.morph = morph
+        self.charged_words = charged_words
+        self.lemma_cache = lemma_cache
+        self.words_count = 0
+        self.charged_words_count = 0
+        self._tail = ""  # beginning of the word continued in the next chunk
+        self._pending: List[str] = []  # words which may start a phrase
+
+    @property
+    def score(self) -> float:
+        return _jaundice_rate(self.charged_words_count, self.words_count)
+
+    def feed(self, text: str) -> None:
+        self.feed_tokens(self.split(text))
+
+    def split(self, text: str) -> List[str]:
+        """tokens of text chunk, a word unfinished at the end of chunk
+        is kept for the next one"""
+        text = self._tail + text
+        tokens = text.split()
+        if tokens and not text[-1].isspace():
+            self._tail = tokens.pop()
+        else:
+            self._tail = ""
+        return tokens
+
+    def feed_tokens(self, tokens: List[str]) -> None:
+        """counts tokens returned by split, they may be fed in parts"""
+        self._count(tokens, final=False)
 
-    score = len(found_charged_words) / len(article_words) * 100
+    def finish(self) -> None:
+        tokens = [self._tail] if self._tail else []
+        self._tail = ""
+        self._count(tokens, final=True)
 
-    return round(score, 2)
+    def _count(self, tokens: List[str], final: bool) -> None:
+        cleaned_tokens = [_clean_word(token) for token in tokens]
+        if isinstance(self.charged_words, SurfaceFormIndex):
+            new_words = self.charged_words.lemmatize(cleaned_tokens)
+        else:
+            new_words = lemmatize_batch(
+                self.morph, cleaned_tokens, self.lemma_cache
+            )
+        self.words_count += len(new_words)
+        words = self._pending + new_words
+        found, consumed = self.charged_words.count_prefix(words, final)
+        self.charged_words_count += found
+        self._pending = words[consumed:]
@@ -0,0 +1,49 @@
+"""Normalization of article urls for cache lookups.
+
+Only changes that never point to another page are made: case of scheme
+and host, default port, fragment, order of query parameters and
+tracking parameters. Mirrors and AMP versions of the same article
+are recognized later by text, see text_tools.ScoresCache.
+"""
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+TRACKING_PARAMS_REGEX = re.compile(
+    r"^(utm_\w+|fbclid|gclid|yclid|_openstat|mc_cid|mc_eid)$",
+    flags=re.IGNORECASE,
+)
+
+
+def _is_tracking(param: str) -> bool:
+    name = param.split("=", 1)[0]
+    return bool(TRACKING_PARAMS_REGEX.match(name))
+
+
+def normalize_url(url: str) -> str:
+    """https://InoSMI.ru:443/a.html?utm_source=x&b=1&a=2#top
+    -> https://inosmi.ru/a.html?a=2&b=1, invalid urls are returned as is"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # ipv6
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{port}"
+    if "@" in parts.netloc:
+        host = parts.netloc.rsplit("@", 1)[0] + "@" + host
+    params = [
+        param for param in parts.query.split("&")
+        if param and not _is_tracking(param)
+    ]
+    # stable sort, so repeated parameters keep their order
+    params.sort(key=lambda param: param.split("=", 1)[0])
+    return urlunsplit(
+        (scheme, host, parts.path or "/", "&".join(params), "")
+    )
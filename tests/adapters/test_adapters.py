@@ -0,0 +1,46 @@
+import pytest
+
+from filter.adapters import (
+    ADAPTERS, ADAPTERS_BY_HOST, SANITIZERS, Adapter, ArticleNotFound,
+    UnsupportedSite, find_adapter, inosmi_ru, register,
+)
+
+
+@pytest.mark.parametrize("url", [
+    "https://inosmi.ru/politic/20191211/246417356.html",
+    "https://INOSMI.ru/",
+    "http://m.inosmi.ru/politic/20191211/246417356.html",
+])
+def test_find_adapter(url):
+    assert find_adapter(url) is inosmi_ru.ADAPTER
+
+
+@pytest.mark.parametrize("url", [
+    "https://example.com/",
+    "https://notinosmi.ru/",
+    "https://inosmi.ru.example.com/",
+    "not an url",
+])
+def test_find_adapter_unsupported(url):
+    with pytest.raises(UnsupportedSite):
+        find_adapter(url)
+    assert issubclass(UnsupportedSite, ArticleNotFound)
+
+
+def test_register():
+    adapter = Adapter("example", ["Example.com"], "div.post", [".ad"])
+    register(adapter)
+    register(inosmi_ru.ADAPTER, hosts=["mirror.example.org"])
+    try:
+        assert find_adapter("https://blog.example.com/1") is adapter
+        assert find_adapter("https://mirror.example.org/1") is (
+            inosmi_ru.ADAPTER
+        )
+        html = '<div class="post">Текст<p class="ad">реклама</p></div>'
+        assert SANITIZERS["example"](html, plaintext=True) == "Текст"
+        assert adapter.sanitize_soup(html, plaintext=True) == "Текст"
+    finally:
+        del ADAPTERS["example"]
+        del SANITIZERS["example"]
+        del ADAPTERS_BY_HOST["example.com"]
+        del ADAPTERS_BY_HOST["mirror.example.org"]
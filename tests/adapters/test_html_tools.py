@@ -0,0 +1,23 @@
+import pytest
+from bs4 import BeautifulSoup
+
+from filter.adapters.html_tools import compile_selector
+
+
+@pytest.mark.parametrize("selector,tag,attrs,result", [
+    ("aside", "aside", [], True),
+    ("aside", "div", [], False),
+    (".article-disclaimer", "div", [("class", "x article-disclaimer")], True),
+    (".article-disclaimer", "div", [("class", None)], False),
+    ("footer.article-footer", "footer", [("class", "article-footer")], True),
+    ("footer.article-footer", "footer", [], False),
+    ("article.a.b", "article", [("class", "b c a")], True),
+    ("article.a.b", "article", [("class", "a")], False),
+])
+def test_selector_matches(selector, tag, attrs, result):
+    assert compile_selector(selector).matches(tag, attrs) == result
+    html = "<{0}{1}></{0}>".format(
+        tag, "".join(f' {k}="{v}"' for k, v in attrs if v is not None)
+    )
+    soup_tag = BeautifulSoup(html, "html.parser").find(tag)
+    assert compile_selector(selector).matches_tag(soup_tag) == result
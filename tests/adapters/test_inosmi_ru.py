@@ -1,7 +1,9 @@
 import pytest
 
 from filter.adapters import ArticleNotFound
-from filter.adapters.inosmi_ru import sanitize
+from filter.adapters.inosmi_ru import (
+    sanitize, sanitize_plaintext, sanitize_soup, get_plaintext_extractor
+)
 
 
 def test_sanitize(inosmi_article):
@@ -33,3 +35,52 @@ def test_sanitize_plain(inosmi_article):
 def test_sanitize_unsupported_html(unsupported_html):
     with pytest.raises(ArticleNotFound):
         sanitize(unsupported_html)
+
+
+def test_sanitize_plaintext_same_as_soup(inosmi_article):
+    assert (sanitize_plaintext(inosmi_article) ==
+            sanitize_soup(inosmi_article, plaintext=True))
+
+
+def test_plaintext_extractor_chunked(inosmi_article):
+    extractor = get_plaintext_extractor()
+    chunks = []
+    for i in range(0, len(inosmi_article), 100):
+        extractor.feed(inosmi_article[i:i + 100])
+        chunks.append(extractor.pop_text())
+    chunks.append(extractor.get_text())
+    assert "".join(chunks).strip() == sanitize_plaintext(inosmi_article)
+
+
+@pytest.mark.parametrize("html", [
+    "<article>no class</article>",
+    '<article class="article">a</article><article class="article">b',
+], ids=["no article", "two articles"])
+def test_sanitize_plaintext_not_found(html):
+    with pytest.raises(ArticleNotFound):
+        sanitize_plaintext(html)
+
+
+ARTICLE_WITH_BUZZ = """<html><body>text outside
+    <article class="article main">
+    <h1>Title</h1><br><p>body &amp; <time>today</time>soul</p>
+    <div class="article-disclaimer">disclaimer</div>
+    <script>var x = "<p>";</script>
+    <footer class="article-footer"><p>footer</p></footer>
+    <footer>other footer</footer>{stray}
+    <aside>aside</aside>end
+    </article>after</body></html>"""
+
+
+def test_sanitize_plaintext_skips_buzz():
+    # stray closing tags are ignored, bs4 versions differ on them
+    html = ARTICLE_WITH_BUZZ.format(stray="\n    </p></span>")
+    text = sanitize_plaintext(html)
+    assert text == "Titlebody & soul\n\n\n\nother footer\n\nend"
+    for buzz in ["outside", "today", "disclaimer", "var", "aside", "after"]:
+        assert buzz not in text
+
+
+def test_sanitize_plaintext_matches_soup():
+    html = ARTICLE_WITH_BUZZ.format(stray="")
+    assert sanitize_plaintext(html) == sanitize_soup(html, plaintext=True)
@@ -0,0 +1,50 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+from filter.server.args import DEFAULT_SURFACE_INDEX_PATH, get_args
+
+
+@pytest.mark.parametrize("value,expected", [
+    (None, False),
+    ("", False),
+    ("0", False),
+    ("false", False),
+    ("no", False),
+    ("1", True),
+    ("true", True),
+    ("Yes", True),
+])
+def test_streaming_env(monkeypatch, value, expected):
+    monkeypatch.setattr(sys, "argv", ["serve"])
+    if value is None:
+        monkeypatch.delenv("FILTER_STREAMING", raising=False)
+    else:
+        monkeypatch.setenv("FILTER_STREAMING", value)
+    assert get_args().streaming is expected
+
+
+def test_streaming_flag(monkeypatch):
+    monkeypatch.setattr(sys, "argv", ["serve", "--streaming"])
+    monkeypatch.setenv("FILTER_STREAMING", "0")
+    assert get_args().streaming is True
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("0", False),
+    ("false", False),
+    ("1", True),
+])
+def test_surface_index_env(monkeypatch, value, expected):
+    monkeypatch.setattr(sys, "argv", ["serve"])
+    monkeypatch.setenv("FILTER_SURFACE_INDEX", value)
+    assert get_args().surface_index is expected
+
+
+def test_surface_index_path_is_per_user():
+    assert not DEFAULT_SURFACE_INDEX_PATH.startswith(tempfile.gettempdir())
+    assert DEFAULT_SURFACE_INDEX_PATH.startswith(
+        os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~")
+    )
@@ -1,7 +1,10 @@
+import dataclasses
 import json
 
+import pytest
+
 from filter.main import Result, ProcessingStatus
-from filter.server.encoder import dumps
+from filter.server.encoder import dumps, encode_result
 
 
 def test_dump():
@@ -33,3 +36,51 @@ def test_dump():
             "words_count": None
         }
     ])
+
+
+def _stdlib_dumps(obj):
+    """encoding of results before the fast path"""
+    def default(o):
+        if isinstance(o, Result):
+            return dataclasses.asdict(o)
+        if isinstance(o, ProcessingStatus):
+            return o.value
+        raise TypeError()
+    return json.dumps(obj, default=default)
+
+
+RESULTS = [
+    Result(ProcessingStatus.OK, "https://inosmi.ru/1.html", 33.33, 3),
+    Result(ProcessingStatus.OK, "https://inosmi.ru/путь?q=\"\\\n", 0.0, 0),
+    Result(ProcessingStatus.OK, "https://inosmi.ru/2.html", 1e-07, 10 ** 20),
+    Result(ProcessingStatus.OK, "", float("nan"), 1),
+    Result(ProcessingStatus.OK, "", float("inf"), 1),
+    Result(ProcessingStatus.OK, "", -float("inf"), 1),
+    Result(ProcessingStatus.PARSING_ERROR, "https://example.com"),
+    Result(ProcessingStatus.FETCH_ERROR, "https://example.com\U0001f600"),
+]
+
+
+@pytest.mark.parametrize("obj", [
+    *RESULTS,
+    RESULTS,
+    [],
+    {"results": RESULTS},
+    [RESULTS[0], ProcessingStatus.OK],
+], ids=lambda obj: type(obj).__name__)
+def test_dumps_identical_to_stdlib(obj):
+    assert dumps(obj) == _stdlib_dumps(obj)
+
+
+def test_encode_result():
+    assert encode_result(RESULTS[0]) == _stdlib_dumps(RESULTS[0])
+
+
+FIELDS = [field.name for field in dataclasses.fields(Result)]
+
+
+@pytest.mark.parametrize("result", RESULTS[:1] + RESULTS[-1:])
+def test_all_fields_encoded(result):
+    # encoders list fields by hand, a new field must be added to them
+    assert list(json.loads(encode_result(result))) == FIELDS
+    assert list(json.loads(dumps({"result": result}))["result"]) == FIELDS
@@ -1,9 +1,20 @@
+import asyncio
+import inspect
+import json
+import os
+import subprocess
+import sys
 from unittest.mock import patch
 
 import aiohttp
 import pytest
 
-from filter.server.server import get_app
+from filter.main import (
+    stream_score_article, ArticlesScorer, Result, ProcessingStatus,
+)
+from filter.server.args import Config
+from filter.server.server import RELOAD_SIGNAL, get_app
+from filter.text_tools import SurfaceFormIndex
 
 
 @pytest.fixture
@@ -75,3 +86,385 @@ async def test_success(filter_app: aiohttp.ClientSession):
                 "https://inosmi.ru/military/20191211/246418951.html")
         assert ratings[0]["words_count"] == 3
         assert 33.3 < ratings[0]["score"] < 33.4
+
+
+async def test_success_in_process_pool(aiohttp_client):
+    from tests.test_main import good_bytes_fetcher
+    config = Config()
+    config.processing_workers = 1
+    client = await aiohttp_client(get_app(config))
+    with patch("filter.main.fetch_article_bytes") as fake_fetcher:
+        fake_fetcher.side_effect = good_bytes_fetcher
+        url = "https://inosmi.ru/military/20191211/246418951.html"
+        resp: aiohttp.ClientResponse = await client.get("/", params={
+            "urls": url,
+        })
+        assert resp.status == 200
+        ratings = await resp.json()
+        assert ratings[0]["status"] == "OK"
+        assert ratings[0]["words_count"] == 3
+
+
+async def test_streaming_mode():
+    config = Config()
+    config.streaming = True
+    app = get_app(config)
+    assert inspect.unwrap(app["scorer"].score_article) is stream_score_article
+
+
+def test_apps_share_dictionaries():
+    first, second = get_app(), get_app()
+    assert first["scorer"].morph is second["scorer"].morph
+    assert first["scorer"].charged_words is second["scorer"].charged_words
+
+
+def test_optional_imports_are_deferred():
+    code = (
+        "import sys, filter.server.server as s; s.get_app(); "
+        "print(sorted({'bs4', 'aiocache', 'aioredis'} & set(sys.modules)))"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code])
+    assert output.strip() == b"[]"
+
+
+async def test_surface_index_mode(tmp_path):
+    config = Config()
+    config.surface_index = True
+    config.surface_index_path = str(tmp_path / "surface_index.json")
+    app = get_app(config)
+    charged_words = app["scorer"].charged_words
+    assert isinstance(charged_words, SurfaceFormIndex)
+    assert charged_words.forms["войной"] == "война"
+    assert (tmp_path / "surface_index.json").exists()
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"json": ["https://inosmi.ru/1.html", "https://inosmi.ru/2.html"]},
+    {"json": {"urls": ["https://inosmi.ru/1.html",
+                       "https://inosmi.ru/2.html"]}},
+    {"data": "https://inosmi.ru/1.html\nhttps://inosmi.ru/2.html\n"},
+], ids=["json list", "json object", "ndjson"])
+async def test_batch(filter_app: aiohttp.ClientSession, kwargs):
+    from tests.test_main import good_fetcher
+    with patch("filter.main.fetch_article") as fake_fetcher:
+        fake_fetcher.side_effect = good_fetcher
+        resp = await filter_app.post("/batch", **kwargs)
+        assert resp.status == 200
+        assert resp.content_type == "application/x-ndjson"
+        lines = (await resp.text()).splitlines()
+    results = [json.loads(line) for line in lines]
+    assert sorted(r["url"] for r in results) == [
+        "https://inosmi.ru/1.html", "https://inosmi.ru/2.html",
+    ]
+    assert all(r["status"] == "OK" for r in results)
+    assert all(r["words_count"] == 3 for r in results)
+
+
+@pytest.mark.parametrize("kwargs,error", [
+    ({"data": ""}, "should be at least one url"),
+    ({"json": []}, "should be at least one url"),
+    ({"json": {"urls": "https://inosmi.ru/"}}, "should be a list of urls"),
+    ({"data": "{", "headers": {"Content-Type": "application/json"}},
+     "invalid json"),
+    ({"data": "https://inosmi.ru/\nnot an url"}, "should contain urls only"),
+], ids=["empty", "empty json", "not a list", "invalid json", "not urls"])
+async def test_batch_bad_request(filter_app: aiohttp.ClientSession,
+                                 kwargs, error):
+    resp: aiohttp.ClientResponse = await filter_app.post("/batch", **kwargs)
+    assert resp.status == 400
+    assert error in await resp.text()
+
+
+async def test_batch_concurrency_window():
+    scorer = ArticlesScorer([], None)
+    active = []
+    max_active = []
+
+    async def strategy(url, **kwargs):
+        active.append(url)
+        max_active.append(len(active))
+        await asyncio.sleep(0.001)
+        active.remove(url)
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer.score_article = strategy
+    urls = [f"https://inosmi.ru/{i}.html" for i in range(50)]
+    results = [
+        r async for r in scorer.score_as_completed(urls, None, concurrency=5)
+    ]
+    assert sorted(r.url for r in results) == sorted(urls)
+    assert max(max_active) == 5
+
+
+async def test_metrics(filter_app: aiohttp.ClientSession):
+    from tests.test_main import good_fetcher
+    with patch("filter.main.fetch_article") as fake_fetcher:
+        fake_fetcher.side_effect = good_fetcher
+        url = "https://inosmi.ru/military/20191211/246418951.html"
+        for _ in range(2):
+            await filter_app.get("/", params={"urls": url})
+
+    resp: aiohttp.ClientResponse = await filter_app.get("/metrics")
+    assert resp.status == 200
+    assert resp.content_type == "text/plain"
+    text = await resp.text()
+    for stage in ["sanitize", "tokenize", "lemmatize", "score"]:
+        assert (
+            f'filter_stage_duration_seconds_count{{stage="{stage}"}}'
+            in text
+        )
+    assert 'filter_results_total{status="OK"}' in text
+    assert 'filter_cache_hits_total{cache="memory"} 1.0' in text
+    assert 'filter_cache_hit_ratio{cache="memory"} 0.5' in text
+    assert 'filter_cache_misses_total{cache="lemma"} 3.0' in text
+    assert "# TYPE filter_event_loop_lag_seconds histogram" in text
+    assert "filter_queue_waits_total 1.0" in text
+
+
+@pytest.fixture
+def busy_config():
+    config = Config()
+    config.concurrency_limit = 1
+    config.queue_size = 1
+    config.client_queue_size = 1
+    config.client_header = "X-Api-Key"
+    return config
+
+
+@pytest.mark.parametrize("busy_client,status", [
+    ("greedy", 429),
+    ("other", 503),
+])
+async def test_overloaded(aiohttp_client, busy_config, busy_client, status):
+    app = get_app(busy_config)
+    client = await aiohttp_client(app)
+    scheduler = app["scheduler"]
+    url = "https://inosmi.ru/military/20191211/246418951.html"
+    with scheduler.admit(busy_client, 2):
+        resp = await client.get(
+            "/", params={"urls": url}, headers={"X-Api-Key": "greedy"}
+        )
+        assert resp.status == status
+        assert int(resp.headers["Retry-After"]) >= 1
+        assert "error" in await resp.json()
+
+        resp = await client.post(
+            "/batch", data=url, headers={"X-Api-Key": "greedy"}
+        )
+        assert resp.status == status
+    assert not scheduler.admitted
+
+    metrics = await (await client.get("/metrics")).text()
+    reason = "client" if status == 429 else "overload"
+    assert f'filter_scheduler_rejected_total{{reason="{reason}"}} 2.0' \
+        in metrics
+    assert "filter_scheduler_queue_depth 0.0" in metrics
+
+
+async def test_admitted_client(aiohttp_client, busy_config):
+    from tests.test_main import good_fetcher
+    busy_config.queue_size = 0
+    app = get_app(busy_config)
+    client = await aiohttp_client(app)
+    url = "https://inosmi.ru/military/20191211/246418951.html"
+    with app["scheduler"].admit("greedy", 1), \
+            patch("filter.main.fetch_article") as fake_fetcher:
+        fake_fetcher.side_effect = good_fetcher
+        resp = await client.get(
+            "/", params={"urls": url}, headers={"X-Api-Key": "polite"}
+        )
+        assert resp.status == 200
+    assert "filter_scheduler_wait_seconds_count" in await (
+        await client.get("/metrics")
+    ).text()
+
+
+async def test_client_without_header_is_ip(aiohttp_client, busy_config):
+    app = get_app(busy_config)
+    client = await aiohttp_client(app)
+    url = "https://inosmi.ru/military/20191211/246418951.html"
+    with app["scheduler"].admit("127.0.0.1", 1):
+        resp = await client.get("/", params={"urls": url})
+        assert resp.status == 429
+
+
+async def test_fair_share_of_busy_host(aiohttp_client, busy_config):
+    busy_config.concurrency_limit = 10
+    busy_config.concurrency_per_host = 2
+    busy_config.queue_size = 0
+    busy_config.client_queue_size = 0
+    app = get_app(busy_config)
+    client = await aiohttp_client(app)
+    scheduler = app["scheduler"]
+    started = []
+    release = asyncio.Event()
+
+    async def slow_fetcher(session, url, *args, **kwargs):
+        started.append(url)
+        await release.wait()
+        return "<article>аттракцион</article>"
+
+    greedy = [f"https://inosmi.ru/{i}.html" for i in range(8)]
+    polite = "https://inosmi.ru/polite.html"
+
+    async def get(urls, api_key):
+        resp = await client.get(
+            "/", params={"urls": ",".join(urls)},
+            headers={"X-Api-Key": api_key},
+        )
+        assert resp.status == 200
+
+    async def wait_for(condition):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+    with patch("filter.main.fetch_article") as fake_fetcher:
+        fake_fetcher.side_effect = slow_fetcher
+        greedy_request = asyncio.ensure_future(get(greedy, "greedy"))
+        await wait_for(lambda: scheduler.waiting == len(greedy) - 2)
+        polite_request = asyncio.ensure_future(get([polite], "polite"))
+        await wait_for(lambda: scheduler.waiting == len(greedy) - 1)
+        release.set()
+        await asyncio.gather(greedy_request, polite_request)
+    # clients take turns for slots of the host, polite url doesn't
+    # wait for all urls of greedy client queued before it
+    assert started.index(polite) == 3
+
+
+async def test_cache_hit_takes_no_slot(aiohttp_client, busy_config):
+    from tests.test_main import good_fetcher
+    app = get_app(busy_config)
+    client = await aiohttp_client(app)
+    url = "https://inosmi.ru/military/20191211/246418951.html"
+    with patch("filter.main.fetch_article") as fake_fetcher:
+        fake_fetcher.side_effect = good_fetcher
+        resp = await client.get("/", params={"urls": url})
+        assert resp.status == 200
+    async with app["scheduler"].slot():  # the only slot is busy
+        resp = await asyncio.wait_for(
+            client.get("/", params={"urls": url}), timeout=1
+        )
+        assert (await resp.json())[0]["status"] == "OK"
+
+
+@pytest.fixture
+def dictionary_config(tmp_path):
+    path = tmp_path / "charged.txt"
+    path.write_text("аттракцион\n")
+    config = Config()
+    config.charged_dict = (str(path),)
+    config.charged_dict_reload_interval = 0
+    config.reload_token = "secret"
+    return config
+
+
+RELOAD_HEADERS = {"Authorization": "Bearer secret"}
+
+
+async def test_reload_charged_words(
+        aiohttp_client, dictionary_config, monkeypatch,
+):
+    from tests.test_main import good_fetcher
+    monkeypatch.setattr("filter.main.fetch_article", good_fetcher)
+    app = get_app(dictionary_config)
+    client = await aiohttp_client(app)
+    params = {"urls": "https://inosmi.ru/1.html"}
+
+    resp = await client.get("/", params=params)
+    assert (await resp.json())[0]["score"] == 33.33
+    old_version = app["scorer"].charged_words.version
+
+    with open(dictionary_config.charged_dict[0], "a") as f:
+        f.write("человек\n")
+    resp = await client.post("/charged_words/reload", headers=RELOAD_HEADERS)
+    assert resp.status == 200
+    reloaded = await resp.json()
+    assert reloaded["words"] == 2
+    assert reloaded["version"] != old_version
+    assert app["scorer"].charged_words.version == reloaded["version"]
+
+    # cached result of the old dictionary isn't returned
+    resp = await client.get("/", params=params)
+    assert (await resp.json())[0]["score"] == 66.67
+
+
+@pytest.mark.parametrize("token,headers,status", [
+    (None, RELOAD_HEADERS, 403),
+    ("secret", {}, 401),
+    ("secret", {"Authorization": "Bearer wrong"}, 401),
+])
+async def test_reload_charged_words_needs_token(
+        aiohttp_client, dictionary_config, token, headers, status,
+):
+    dictionary_config.reload_token = token
+    app = get_app(dictionary_config)
+    charged_words = app["scorer"].charged_words
+    client = await aiohttp_client(app)
+    resp = await client.post("/charged_words/reload", headers=headers)
+    assert resp.status == status
+    assert app["scorer"].charged_words is charged_words
+
+
+async def test_reload_charged_words_failure(aiohttp_client, dictionary_config):
+    app = get_app(dictionary_config)
+    charged_words = app["scorer"].charged_words
+    client = await aiohttp_client(app)
+    os.unlink(dictionary_config.charged_dict[0])
+    resp = await client.post("/charged_words/reload", headers=RELOAD_HEADERS)
+    assert resp.status == 500
+    assert app["scorer"].charged_words is charged_words
+
+
+async def test_charged_words_watcher(aiohttp_client, dictionary_config):
+    dictionary_config.charged_dict_reload_interval = 0.01
+    app = get_app(dictionary_config)
+    await aiohttp_client(app)
+    charged_words = app["scorer"].charged_words
+
+    with open(dictionary_config.charged_dict[0], "a") as f:
+        f.write("человек\n")
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if app["scorer"].charged_words is not charged_words:
+            break
+    assert app["scorer"].charged_words.words == {"аттракцион", "человек"}
+
+
+async def test_charged_words_signal(aiohttp_client, dictionary_config):
+    app = get_app(dictionary_config)
+    await aiohttp_client(app)
+    charged_words = app["scorer"].charged_words
+
+    with open(dictionary_config.charged_dict[0], "a") as f:
+        f.write("человек\n")
+    os.kill(os.getpid(), RELOAD_SIGNAL)
+    for _ in range(200):
+        await asyncio.sleep(0.01)
+        if app["scorer"].charged_words is not charged_words:
+            break
+    assert app["scorer"].charged_words.words == {"аттракцион", "человек"}
+
+
+async def test_reload_charged_words_of_all_workers(
+        aiohttp_client, dictionary_config,
+):
+    app = get_app(dictionary_config)
+    app["supervisor_pid"] = 12345  # one of several workers
+    client = await aiohttp_client(app)
+    with patch("filter.server.server.os.kill") as kill:
+        resp = await client.post(
+            "/charged_words/reload", headers=RELOAD_HEADERS
+        )
+    assert resp.status == 200
+    kill.assert_called_once_with(12345, RELOAD_SIGNAL)
+
+    # the signal relayed back by supervisor doesn't reload it again
+    charged_words = app["scorer"].charged_words
+    os.kill(os.getpid(), RELOAD_SIGNAL)
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+        if not app["charged_words_files"].own_signals:
+            break
+    await asyncio.sleep(0.05)
+    assert app["scorer"].charged_words is charged_words
+    assert app["charged_words_files"].own_signals == 0
@@ -0,0 +1,43 @@
+import asyncio
+import json
+
+import pytest
+
+from filter.metrics import Counter, dump, render
+from filter.server.metrics import (
+    collect_workers, metrics_snapshots, write_snapshot,
+)
+from filter.server.server import get_app
+
+
+def test_collect_workers(tmp_path):
+    app = get_app()
+    app["worker"] = "0"
+    app["metrics_dir"] = str(tmp_path)
+    app["scorer"].coalesced = 2
+
+    other = Counter("filter_coalesced_requests_total", "Coalesced.")
+    other.inc(3)
+    (tmp_path / "1.json").write_text(json.dumps(dump([other])))
+    (tmp_path / "2.json").write_text("broken")
+
+    text = render(collect_workers(app))
+    assert "filter_coalesced_requests_total 5.0" in text
+    assert 'filter_in_flight_articles{worker="0"} 0.0' in text
+
+    write_snapshot(app)
+    snapshot = json.loads((tmp_path / "0.json").read_text())
+    assert "filter_stage_duration_seconds" in [m["name"] for m in snapshot]
+
+
+async def test_metrics_snapshots(tmp_path):
+    app = get_app()
+    app["worker"] = "3"
+    app["metrics_dir"] = str(tmp_path)
+    snapshots = metrics_snapshots(app)
+    await snapshots.__anext__()
+    await asyncio.sleep(0)
+    assert (tmp_path / "3.json").exists()
+    with pytest.raises(StopAsyncIteration):
+        await snapshots.__anext__()
+    assert not (tmp_path / "3.json").exists()
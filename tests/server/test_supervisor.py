@@ -0,0 +1,128 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    not hasattr(socket, "SO_REUSEPORT") or not os.path.exists("/proc"),
+    reason="needs SO_REUSEPORT and procfs",
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def children(pid):
+    path = f"/proc/{pid}/task/{pid}/children"
+    with open(path) as f:
+        return set(map(int, f.read().split()))
+
+
+def wait_for(condition, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise TimeoutError()
+
+
+def test_workers_are_restarted_and_stopped_gracefully():
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "filter.server.server",
+         "--port", str(port), "--workers", "2"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        def metrics():
+            try:
+                url = f"http://127.0.0.1:{port}/metrics"
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    return response.read().decode()
+            except OSError:
+                return None
+
+        wait_for(lambda: len(children(process.pid)) == 2)
+        text = wait_for(
+            lambda: (metrics() or "").count("filter_in_flight_articles{") == 2
+            and metrics()
+        )
+        assert 'filter_in_flight_articles{worker="1"}' in text
+
+        workers = children(process.pid)
+        crashed = min(workers)
+        os.kill(crashed, signal.SIGKILL)
+        wait_for(lambda: len(children(process.pid) - workers) == 1)
+        assert crashed not in children(process.pid)
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=15) == 0
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_reload_reaches_all_workers(tmp_path):
+    dictionary = tmp_path / "charged.txt"
+    dictionary.write_text("аттракцион\n")
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "filter.server.server",
+         "--port", str(port), "--workers", "2",
+         "--charged_dict", str(dictionary),
+         "--charged_dict_reload_interval", "0",
+         "--reload_token", "secret"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def request(path, method="GET"):
+        try:
+            url = f"http://127.0.0.1:{port}{path}"
+            request = urllib.request.Request(
+                url, method=method,
+                headers={"Authorization": "Bearer secret"},
+            )
+            with urllib.request.urlopen(request, timeout=1) as response:
+                return response.read().decode()
+        except OSError:
+            return None
+
+    def charged_words(count):
+        """metrics, if all workers have count charged words"""
+        text = request("/metrics") or ""
+        lines = [
+            line for line in text.splitlines()
+            if line.startswith("filter_charged_words{")
+        ]
+        if len(lines) == 2 and all(
+                line.endswith(f" {count}.0") for line in lines
+        ):
+            return text
+        return None
+
+    try:
+        wait_for(lambda: charged_words(1))
+        with open(dictionary, "a") as f:
+            f.write("человек\n")
+        assert wait_for(lambda: request("/charged_words/reload", "POST"))
+        assert wait_for(lambda: charged_words(2))
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
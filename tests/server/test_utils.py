@@ -2,7 +2,7 @@
 
 import pytest
 
-from filter.server.utils import split_urls, is_url
+from filter.server.utils import split_urls, split_lines, is_url
 
 cases = {
     "None": (None, []),
@@ -42,3 +42,8 @@ def test_extract_urls(query, expected):
 )
 def test_is_url(url: str, result: bool):
     assert is_url(url) == result
+
+
+def test_split_lines():
+    text = "http://b.com\n\n  http://a.com  \r\nhttp://b.com\n"
+    assert split_lines(text) == ["http://b.com", "http://a.com"]
@@ -0,0 +1,276 @@
+import csv
+import dataclasses
+import gzip
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from filter.bulk import (
+    FORMATS, Checkpoint, Page, format_csv, read_directory, read_tarball,
+    read_warc, run, score_page,
+)
+from filter.main import ProcessingStatus, Result
+
+ARTICLE = """<html><article class="article">
+аттракцион привет человек
+</article></html>"""
+
+
+def warc_record(headers, block):
+    lines = ["WARC/1.0", *(f"{k}: {v}" for k, v in headers.items())]
+    lines.append(f"Content-Length: {len(block)}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + block + b"\r\n\r\n"
+
+
+def http_response(body, status="200 OK", headers=()):
+    head = "\r\n".join([f"HTTP/1.1 {status}", *headers])
+    return head.encode() + b"\r\n\r\n" + body
+
+
+@pytest.fixture
+def warc_path(tmp_path):
+    chunked = b"a\r\n" + ARTICLE.encode("cp1251")[:10] + b"\r\n" \
+        + f"{len(ARTICLE) - 10:x}".encode() + b"\r\n" \
+        + ARTICLE.encode("cp1251")[10:] + b"\r\n0\r\n\r\n"
+    records = [
+        warc_record({"WARC-Type": "warcinfo"}, b"software: test"),
+        warc_record(
+            {
+                "WARC-Type": "response",
+                "WARC-Target-URI": "https://inosmi.ru/1.html",
+                "Content-Type": "application/http; msgtype=response",
+            },
+            http_response(
+                gzip.compress(ARTICLE.encode()),
+                headers=["Content-Type: text/html",
+                         "Content-Encoding: gzip"],
+            ),
+        ),
+        warc_record(
+            {"WARC-Type": "request",
+             "WARC-Target-URI": "https://inosmi.ru/1.html"},
+            b"GET /1.html HTTP/1.1\r\n\r\n",
+        ),
+        warc_record(
+            {
+                "WARC-Type": "response",
+                "WARC-Target-URI": "<https://inosmi.ru/style.css>",
+                "Content-Type": "application/http; msgtype=response",
+            },
+            http_response(b"body {}", headers=["Content-Type: text/css"]),
+        ),
+        warc_record(
+            {
+                "WARC-Type": "response",
+                "WARC-Target-URI": "https://inosmi.ru/2.html",
+                "Content-Type": "application/http; msgtype=response",
+            },
+            http_response(
+                chunked,
+                headers=["Content-Type: text/html; charset=windows-1251",
+                         "Transfer-Encoding: chunked"],
+            ),
+        ),
+        warc_record(
+            {
+                "WARC-Type": "response",
+                "WARC-Target-URI": "https://inosmi.ru/404.html",
+                "Content-Type": "application/http; msgtype=response",
+            },
+            http_response(b"not found", status="404 Not Found"),
+        ),
+        warc_record(
+            {
+                "WARC-Type": "resource",
+                "WARC-Target-URI": "https://example.com/",
+                "Content-Type": "text/html",
+            },
+            ARTICLE.encode(),
+        ),
+    ]
+    path = tmp_path / "crawl.warc.gz"
+    with gzip.open(path, "wb") as f:
+        for record in records:  # gzip member per record, as usual
+            f.write(record)
+    return str(path)
+
+
+def test_read_warc(warc_path):
+    pages = list(read_warc(warc_path))
+    assert [page.url for page in pages] == [
+        "https://inosmi.ru/1.html",
+        "https://inosmi.ru/2.html",
+        "https://inosmi.ru/404.html",
+        "https://example.com/",
+    ]
+    assert pages[0].content == ARTICLE.encode()
+    assert pages[1].content == ARTICLE.encode("cp1251")
+    assert pages[1].charset == "windows-1251"
+    assert [page.http_status for page in pages] == [200, 200, 404, None]
+
+
+def test_read_warc_skips_malformed_records(tmp_path):
+    def response(url, http):
+        return warc_record({
+            "WARC-Type": "response",
+            "WARC-Target-URI": url,
+            "Content-Type": "application/http; msgtype=response",
+        }, http)
+
+    path = tmp_path / "broken.warc"
+    path.write_bytes(b"".join([
+        b"garbage\r\nmore garbage\r\n",
+        response("https://inosmi.ru/chunks.html", http_response(
+            b"zz\r\nbody\r\n0\r\n\r\n",
+            headers=["Transfer-Encoding: chunked"],
+        )),
+        response("https://inosmi.ru/status.html", b"HTTP/1.1 OK\r\n\r\n"),
+        b"WARC/1.0\r\nWARC-Type: response\r\nContent-Length: x\r\n\r\n",
+        b"WARC/1.0\r\nWARC-Type: response\r\nContent-Length: -1\r\n\r\n",
+        response("https://inosmi.ru/1.html", http_response(ARTICLE.encode())),
+    ]))
+    pages = list(read_warc(str(path)))
+    assert [page.url for page in pages] == ["https://inosmi.ru/1.html"]
+
+
+def test_score_page_failure(monkeypatch):
+    def broken(*args, **kwargs):
+        raise ValueError("broken page")
+
+    monkeypatch.setattr("filter.bulk.process_article", broken)
+    result = score_page(Page("https://inosmi.ru/1.html", ARTICLE.encode()))
+    assert result.status == ProcessingStatus.PARSING_ERROR
+
+
+@pytest.fixture
+def pages_dir(tmp_path):
+    root = tmp_path / "pages"
+    (root / "inosmi.ru" / "politic").mkdir(parents=True)
+    (root / "inosmi.ru" / "politic" / "1.html").write_text(ARTICLE)
+    (root / "inosmi.ru" / "2.html").write_text("<html>no article</html>")
+    (root / "inosmi.ru" / "image.png").write_bytes(b"png")
+    (root / "3.html").write_text(ARTICLE)
+    return str(root)
+
+
+def test_read_directory(pages_dir):
+    assert [page.url for page in read_directory(pages_dir)] == [
+        "3.html", "inosmi.ru/2.html", "inosmi.ru/politic/1.html",
+    ]
+
+
+def test_read_tarball(pages_dir, tmp_path):
+    path = str(tmp_path / "pages.tar.gz")
+    with tarfile.open(path, "w:gz") as tar:
+        tar.add(pages_dir, arcname="site")
+    pages = list(read_tarball(path))
+    assert sorted(page.url for page in pages) == [
+        "site/3.html",
+        "site/inosmi.ru/2.html",
+        "site/inosmi.ru/politic/1.html",
+    ]
+
+
+@pytest.mark.parametrize("page,status,words_count", [
+    (Page("inosmi.ru/1.html", ARTICLE.encode()), ProcessingStatus.OK, 3),
+    (Page("1.html", ARTICLE.encode()), ProcessingStatus.PARSING_ERROR, None),
+    (
+        Page("1.html", ARTICLE.encode(), adapter="inosmi_ru"),
+        ProcessingStatus.OK, 3,
+    ),
+    (
+        Page("https://inosmi.ru/1.html", b"", http_status=500),
+        ProcessingStatus.FETCH_ERROR, None,
+    ),
+    (
+        Page("https://inosmi.ru/1.html", ARTICLE.encode(), charset="nope"),
+        ProcessingStatus.OK, 3,
+    ),
+], ids=["host/path", "unsupported", "adapter", "http error", "charset"])
+def test_score_page(page, status, words_count):
+    result = score_page(page)
+    assert result.status == status
+    assert result.url == page.url
+    assert result.words_count == words_count
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_run_warc(warc_path, tmp_path, workers):
+    output = str(tmp_path / "results.jsonl")
+    statuses = run(warc_path, output, workers=workers)
+    assert statuses == {"OK": 2, "FETCH_ERROR": 1, "PARSING_ERROR": 1}
+    with open(output) as f:
+        results = [json.loads(line) for line in f]
+    assert results[0] == {
+        "status": "OK", "url": "https://inosmi.ru/1.html",
+        "score": 33.33, "words_count": 3,
+    }
+    assert results[1] == dict(results[0], url="https://inosmi.ru/2.html")
+    assert [r["status"] for r in results[2:]] == [
+        "FETCH_ERROR", "PARSING_ERROR",
+    ]
+    assert not os.path.exists(output + ".checkpoint")
+
+
+def test_run_csv(pages_dir, tmp_path):
+    output = str(tmp_path / "results.csv")
+    run(pages_dir, output, output_format="csv", adapter="inosmi_ru")
+    with open(output, newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [(row["url"], row["status"], row["words_count"]) for row in rows] \
+        == [
+            ("3.html", "OK", "3"),
+            ("inosmi.ru/2.html", "PARSING_ERROR", ""),
+            ("inosmi.ru/politic/1.html", "OK", "3"),
+        ]
+
+
+def test_format_csv_has_all_fields():
+    result = Result(ProcessingStatus.OK, "https://inosmi.ru/1.html", 1.5, 3)
+    fields = [field.name for field in dataclasses.fields(Result)]
+    header = FORMATS["csv"][0].decode().strip().split(",")
+    row = next(csv.reader(io.StringIO(format_csv(result).decode())))
+    assert header == fields
+    assert row == ["OK", "https://inosmi.ru/1.html", "1.5", "3"]
+
+
+def test_run_resumes_from_checkpoint(pages_dir, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    run(pages_dir, output, adapter="inosmi_ru")
+    with open(output, "rb") as f:
+        expected = f.read()
+
+    # job was killed after the checkpoint of the first page was saved
+    first_line = expected.split(b"\n")[0] + b"\n"
+    with open(output, "wb") as f:
+        f.write(first_line + b'{"status": "OK", "url": "unsav')
+    Checkpoint(os.path.abspath(pages_dir), 1, len(first_line)).save(
+        output + ".checkpoint"
+    )
+    statuses = run(pages_dir, output, adapter="inosmi_ru")
+    assert sum(statuses.values()) == 2
+    with open(output, "rb") as f:
+        assert f.read() == expected
+
+
+def test_checkpoint_of_other_input(pages_dir, tmp_path):
+    output = str(tmp_path / "results.jsonl")
+    Checkpoint("/other", 1, 10).save(output + ".checkpoint")
+    with pytest.raises(ValueError):
+        run(pages_dir, output)
+
+
+def test_checkpoints_saved(pages_dir, tmp_path, monkeypatch):
+    saved = []
+    monkeypatch.setattr(
+        Checkpoint, "save",
+        lambda self, path: saved.append((self.done, self.output_size)),
+    )
+    output = str(tmp_path / "results.jsonl")
+    run(pages_dir, output, adapter="inosmi_ru", checkpoint_every=2)
+    with open(output, "rb") as f:
+        lines = io.BytesIO(f.read()).readlines()
+    assert saved == [(2, len(lines[0]) + len(lines[1]))]
@@ -0,0 +1,141 @@
+import pytest
+from aiocache import SimpleMemoryCache
+
+from filter.cache import MemoryCache, ResultsCache, cache_key
+from filter.main import Result, ProcessingStatus
+from filter.text_tools import ChargedDictionary
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_cache_ttl():
+    clock = FakeClock()
+    cache = MemoryCache(maxsize=10, ttl=60, clock=clock)
+    cache.set("a", 1)
+    clock.now = 59
+    assert cache.get("a") == 1
+    clock.now = 60
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_memory_cache_lru():
+    cache = MemoryCache(maxsize=2, ttl=None)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+
+
+@pytest.fixture
+async def shared():
+    cache = SimpleMemoryCache()  # storage is shared by all instances
+    await cache.clear()
+    yield cache
+    await cache.clear()
+
+
+def ok_result(url):
+    return Result(ProcessingStatus.OK, url, 10.0, 100)
+
+
+@pytest.mark.asyncio
+async def test_results_cache_tiers(shared):
+    cache = ResultsCache(MemoryCache(), shared)
+    url = "https://inosmi.ru/1.html"
+    assert await cache.get(url) is None
+
+    await shared.set(url, ok_result(url))
+    assert await cache.get(url) == ok_result(url)  # from shared cache
+    await shared.clear()
+    assert await cache.get(url) == ok_result(url)  # promoted to memory
+
+    assert cache.stats["memory"].hits == 1
+    assert cache.stats["memory"].misses == 2
+    assert cache.stats["shared"].hits == 1
+    assert cache.stats["shared"].misses == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("status,cached", [
+    (ProcessingStatus.OK, True),
+    (ProcessingStatus.PARSING_ERROR, True),
+    (ProcessingStatus.TIMEOUT, False),
+    (ProcessingStatus.FETCH_ERROR, False),
+])
+async def test_results_cache_statuses(shared, status, cached):
+    cache = ResultsCache(MemoryCache(), shared)
+    url = "https://inosmi.ru/1.html"
+    await cache.set(url, Result(status, url))
+    assert (cache.memory.get(url) is not None) == cached
+    assert (await shared.get(url) is not None) == cached
+
+
+class BrokenCache:
+    async def get(self, key):
+        raise ConnectionError
+
+    async def set(self, key, value, ttl=None):
+        raise ConnectionError
+
+
+@pytest.mark.asyncio
+async def test_results_cache_shared_errors():
+    cache = ResultsCache(MemoryCache(), BrokenCache())
+    url = "https://inosmi.ru/1.html"
+    await cache.set(url, ok_result(url))
+    cache.memory.clear()
+    assert await cache.get(url) is None
+    assert cache.stats["shared"].errors == 2
+
+
+@pytest.mark.asyncio
+async def test_decorate():
+    calls = []
+
+    async def strategy(url, **kwargs):
+        calls.append((url, kwargs))
+        return ok_result(url)
+
+    cache = ResultsCache(MemoryCache())
+    cached_strategy = cache.decorate(strategy)
+    url = "https://inosmi.ru/1.html"
+    for _ in range(3):
+        assert await cached_strategy(url=url, session=None) == ok_result(url)
+    assert calls == [(url, {"session": None})]
+
+
+@pytest.mark.asyncio
+async def test_decorate_normalizes_urls():
+    calls = []
+
+    async def strategy(url, **kwargs):
+        calls.append(url)
+        return ok_result(url)
+
+    cached_strategy = ResultsCache(MemoryCache()).decorate(strategy)
+    url = "https://inosmi.ru/1.html?b=2&a=1"
+    other_url = "https://INOSMI.ru:443/1.html?a=1&utm_source=feed&b=2#top"
+    assert await cached_strategy(url=url) == ok_result(url)
+    assert await cached_strategy(url=other_url) == ok_result(other_url)
+    assert calls == [url]
+
+
+def test_cache_key_depends_on_dictionary():
+    url = "https://inosmi.ru/1.html"
+    first = ChargedDictionary(["один"])
+    second = ChargedDictionary(["один", "два"])
+    assert cache_key(url) == url
+    assert cache_key(url, ["один"]) == url  # plain words have no version
+    assert cache_key(url, first) == f"{first.version}:{url}"
+    assert cache_key(url, first) != cache_key(url, second)
+    assert cache_key(url + "#top", first) == cache_key(url, first)
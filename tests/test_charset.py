@@ -0,0 +1,62 @@
+import codecs
+
+import pytest
+
+from filter.charset import decode_html, find_charset, sniff_charset
+from filter.metrics import CHARSETS
+
+TEXT = "<p>Привет, мир</p>"
+
+
+@pytest.mark.parametrize("body,charset,source", [
+    (b"<html><p>hello</p></html>", None, "none"),
+    (codecs.BOM_UTF8 + TEXT.encode(), "utf-8-sig", "bom"),
+    (codecs.BOM_UTF16_LE + TEXT.encode("utf-16-le"), "utf-16", "bom"),
+    (b'<meta charset="windows-1251">', "cp1251", "meta"),
+    (b"<META CHARSET=KOI8-R>", "koi8-r", "meta"),
+    (
+        b'<meta http-equiv="Content-Type" '
+        b'content="text/html; charset=utf-8">',
+        "utf-8", "meta",
+    ),
+    (b'<meta charset="no-such-charset">', None, "none"),
+    (b" " * 5000 + b'<meta charset="cp1251">', None, "none"),
+])
+def test_sniff_charset(body, charset, source):
+    assert sniff_charset(body) == (charset, source)
+
+
+def test_find_charset_prefers_header():
+    body = b'<meta charset="koi8-r">'
+    header = CHARSETS.values.get(("header",), 0)
+    assert find_charset(body, "Windows-1251") == "cp1251"
+    assert CHARSETS.values[("header",)] == header + 1
+    assert find_charset(body, "unknown") == "koi8-r"
+    assert find_charset(body) == "koi8-r"
+
+
+@pytest.mark.parametrize("body,charset", [
+    (TEXT.encode(), None),
+    (TEXT.encode("cp1251"), "cp1251"),
+    (codecs.BOM_UTF8 + TEXT.encode(), "utf-8-sig"),
+])
+def test_decode_html(body, charset):
+    assert decode_html(body, charset) == TEXT
+
+
+def test_decode_undeclared_not_utf8(monkeypatch):
+    detected = []
+
+    def detect(body):
+        detected.append(body)
+        return "cp1251"
+
+    monkeypatch.setattr("filter.charset._detect", detect)
+    assert decode_html(TEXT.encode()) == TEXT  # utf-8 isn't detected
+    assert not detected
+    assert decode_html(TEXT.encode("cp1251")) == TEXT
+    assert detected == [TEXT.encode("cp1251")]
+
+
+def test_wrong_charset_doesnt_fail():
+    assert decode_html(b"\xff\xfe\xfa", "utf-8") == "�" * 3
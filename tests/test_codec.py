@@ -0,0 +1,78 @@
+import pickle
+
+import pytest
+
+from filter.codec import (
+    encode_result, decode_result, ResultSerializer, STATUS_CODES,
+    encode_validated, decode_validated, ValidatedSerializer,
+)
+from filter.main import Result, ProcessingStatus
+from filter.revalidation import Validated
+
+
+@pytest.mark.parametrize("result", [
+    Result(ProcessingStatus.OK, "https://inosmi.ru/1.html", 33.33, 120),
+    Result(ProcessingStatus.OK, "https://inosmi.ru/пусто.html", 0.0, 0),
+    Result(ProcessingStatus.TIMEOUT, "https://inosmi.ru/2.html"),
+    Result(ProcessingStatus.PARSING_ERROR, "https://example.com/"),
+    Result(ProcessingStatus.FETCH_ERROR, ""),
+])
+def test_roundtrip(result):
+    data = encode_result(result)
+    assert decode_result(data) == result
+    assert len(data) < len(pickle.dumps(result))
+
+
+def test_all_statuses_have_codes():
+    assert set(STATUS_CODES) == set(ProcessingStatus)
+    assert len(set(STATUS_CODES.values())) == len(ProcessingStatus)
+
+
+ENCODED = encode_result(Result(ProcessingStatus.OK, "https://a.b/", 1.0, 1))
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x01\x00",
+    pickle.dumps(Result(ProcessingStatus.OK, "https://a.b/", 1.0, 1)),
+    b"\x02" + ENCODED[1:],
+    b"\x01\xff" + ENCODED[2:],
+], ids=["empty", "short", "pickle", "unknown version", "unknown status"])
+def test_unknown_data_ignored(data):
+    assert decode_result(data) is None
+
+
+def test_serializer():
+    serializer = ResultSerializer()
+    result = Result(ProcessingStatus.OK, "https://inosmi.ru/1.html", 1.5, 10)
+    assert serializer.loads(serializer.dumps(result)) == result
+    assert serializer.loads(None) is None
+
+
+RESULT = Result(ProcessingStatus.OK, "https://inosmi.ru/1.html", 1.5, 10)
+
+
+@pytest.mark.parametrize("validated", [
+    Validated(RESULT, '"abc"', "Wed, 11 Dec 2019 10:00:00 GMT"),
+    Validated(RESULT, 'W/"тег"'),
+    Validated(RESULT, None, "Wed, 11 Dec 2019 10:00:00 GMT"),
+    Validated(RESULT, ""),
+])
+def test_validated_roundtrip(validated):
+    assert decode_validated(encode_validated(validated)) == validated
+
+
+@pytest.mark.parametrize("data", [
+    b"",
+    b"\x02" + encode_validated(Validated(RESULT, "x"))[1:],
+    encode_result(RESULT),
+])
+def test_unknown_validated_ignored(data):
+    assert decode_validated(data) is None
+
+
+def test_validated_serializer():
+    serializer = ValidatedSerializer()
+    validated = Validated(RESULT, '"abc"')
+    assert serializer.loads(serializer.dumps(validated)) == validated
+    assert serializer.loads(None) is None
@@ -3,8 +3,21 @@ from unittest.mock import patch
 
 import aiohttp
 import pymorphy2
+import pytest
+from aiohttp import web
 
-from filter.main import score_article, ProcessingStatus
+from filter.adapters import ADAPTERS_BY_HOST, inosmi_ru
+from filter.adapters.inosmi_ru import sanitize
+from filter.main import (
+    score_article, stream_score_article, ProcessingStatus, Result,
+    ArticlesScorer, fetch_article, fetch_article_bytes, count_words,
+    fetch_article_chunks,
+)
+from filter.metrics import OVERSIZED, RESULTS, StageTimings
+from filter.text_tools import (
+    split_by_words, calculate_jaundice_rate, SurfaceFormIndex,
+    ChargedDictionary, ScoresCache, WordsCounter,
+)
 
 
 async def sleeper(*args, **kwargs):
@@ -19,6 +32,11 @@ async def good_fetcher(*args, **kwargs):
     </html>"""
 
 
+async def good_bytes_fetcher(*args, **kwargs):
+    html = await good_fetcher()
+    return html.encode("cp1251"), "windows-1251"
+
+
 async def bad_fetcher(*args, **kwargs):
     return r"""<html>
     <div class="article">will not parsed"</div>
@@ -33,7 +51,7 @@ async def test_fetch_timeout():
     with patch("filter.main.fetch_article") as mock:
         mock.side_effect = sleeper
         res = await score_article(
-            url="http://example.com/",
+            url="https://inosmi.ru/politic/20191211/246417356.html",
             session=None,
             morph=None,
             charged_words=[],
@@ -47,7 +65,7 @@ async def test_parse_error():
     with patch("filter.main.fetch_article") as fetch_mock:
         fetch_mock.side_effect = bad_fetcher
         res = await score_article(
-            url="http://example.com/",
+            url="https://inosmi.ru/politic/20191211/246417356.html",
             session=None,
             morph=None,
             charged_words=[],
@@ -61,7 +79,7 @@ async def test_fetch_error():
     with patch("filter.main.fetch_article") as fetch_mock:
         fetch_mock.side_effect = broken_fetcher
         res = await score_article(
-            url="http://example.com/",
+            url="https://inosmi.ru/politic/20191211/246417356.html",
             session=None,
             morph=None,
             charged_words=[],
@@ -77,7 +95,7 @@ async def test_processing_timeout():
         with patch("filter.main.split_by_words") as split_mock:
             split_mock.side_effect = sleeper
             res = await score_article(
-                url="http://example.com/",
+                url="https://inosmi.ru/politic/20191211/246417356.html",
                 session=None,
                 morph=None,
                 charged_words=[],
@@ -103,3 +121,384 @@ async def test_happy_path():
         assert res.words_count == 3
         assert res.url == url
         assert 33.3 < res.score < 33.4
+
+
+async def test_same_text_scored_once():
+    morph = pymorphy2.MorphAnalyzer()
+    charged_words = ChargedDictionary(["аттракцион"], morph)
+    scores_cache = ScoresCache()
+    urls = [
+        "https://inosmi.ru/economic/20190629/245384784.html",
+        "https://inosmi.ru/economic/20190629/245384784.html?utm_source=x",
+    ]
+    with patch("filter.main.fetch_article") as fetch_mock, \
+            patch("filter.main.split_by_words") as split_mock:
+        fetch_mock.side_effect = good_fetcher
+        split_mock.side_effect = split_by_words
+        results = [
+            await score_article(
+                url=url,
+                session=None,
+                morph=morph,
+                charged_words=charged_words,
+                scores_cache=scores_cache,
+            )
+            for url in urls
+        ]
+    assert split_mock.call_count == 1
+    assert [r.url for r in results] == urls
+    assert results[0].score == results[1].score
+    assert results[1].words_count == 3
+    assert (scores_cache.hits, scores_cache.misses) == (1, 1)
+
+
+async def test_unsupported_site_is_not_fetched():
+    with patch("filter.main.fetch_article") as fetch_mock:
+        res = await score_article(
+            url="http://example.com/",
+            session=None,
+            morph=None,
+            charged_words=[],
+        )
+    assert res.status == ProcessingStatus.PARSING_ERROR
+    fetch_mock.assert_not_called()
+
+
+@pytest.fixture
+def article_server(loop, aiohttp_server, inosmi_article, monkeypatch):
+    # test server pages are inosmi.ru articles
+    monkeypatch.setitem(ADAPTERS_BY_HOST, "127.0.0.1", inosmi_ru.ADAPTER)
+
+    async def article(request):
+        response = web.StreamResponse()
+        response.content_type = "text/html"
+        response.charset = "utf-8"
+        await response.prepare(request)
+        body = inosmi_article.encode()
+        for i in range(0, len(body), 1000):
+            await response.write(body[i:i + 1000])
+        return response
+
+    async def slow(request):
+        await asyncio.sleep(10)
+        return web.Response(text="")
+
+    async def meta_charset(request):
+        return web.Response(body=META_CHARSET_HTML, content_type="text/html")
+
+    app = web.Application()
+    app.add_routes([
+        web.get("/article.html", article),
+        web.get("/slow.html", slow),
+        web.get("/meta.html", meta_charset),
+    ])
+    return loop.run_until_complete(aiohttp_server(app))
+
+
+META_CHARSET_HTML = """<html><head>
+<meta http-equiv="Content-Type" content="text/html; charset=windows-1251">
+</head><body><article class="article">
+аттракцион привет человек
+</article></body></html>""".encode("cp1251")
+
+
+async def test_fetch_article_meta_charset(article_server):
+    url = str(article_server.make_url("/meta.html"))
+    async with aiohttp.ClientSession() as session:
+        body, charset = await fetch_article_bytes(session, url)
+        html = await fetch_article(session, url)
+    assert body == META_CHARSET_HTML
+    assert charset == "cp1251"
+    assert "аттракцион привет человек" in html
+
+
+@pytest.mark.parametrize("chunk_size", [16, 64 * 1024])
+async def test_fetch_article_chunks_meta_charset(article_server, chunk_size):
+    url = str(article_server.make_url("/meta.html"))
+    async with aiohttp.ClientSession() as session:
+        chunks = [
+            chunk async for chunk in fetch_article_chunks(
+                session, url, chunk_size=chunk_size
+            )
+        ]
+    # <meta> is not in the first read of small chunks
+    assert "".join(chunks) == META_CHARSET_HTML.decode("cp1251")
+
+
+@pytest.mark.parametrize("strategy", [score_article, stream_score_article])
+@pytest.mark.parametrize("path", ["/article.html", "/meta.html"])
+async def test_body_too_large(article_server, strategy, path):
+    url = str(article_server.make_url(path))
+    oversized = OVERSIZED.values.get((), 0)
+    async with aiohttp.ClientSession() as session:
+        result = await strategy(
+            url=url,
+            session=session,
+            morph=pymorphy2.MorphAnalyzer(),
+            charged_words=["аттракцион"],
+            max_body_size=100,
+        )
+    assert result.status == ProcessingStatus.FETCH_ERROR
+    assert OVERSIZED.values[()] == oversized + 1
+
+
+async def test_stream_score_article_meta_charset(article_server):
+    url = str(article_server.make_url("/meta.html"))
+    async with aiohttp.ClientSession() as session:
+        result = await stream_score_article(
+            url=url,
+            session=session,
+            morph=pymorphy2.MorphAnalyzer(),
+            charged_words=["аттракцион"],
+        )
+    assert result.status == ProcessingStatus.OK
+    assert result.words_count == 3
+    assert result.score == 33.33
+
+
+async def test_stream_score_article(article_server, inosmi_article):
+    morph = pymorphy2.MorphAnalyzer()
+    charged_words = ["сделка", "президент", "китай", "переговоры"]
+    words = await split_by_words(
+        morph, sanitize(inosmi_article, plaintext=True)
+    )
+    async with aiohttp.ClientSession() as session:
+        res = await stream_score_article(
+            url=str(article_server.make_url("/article.html")),
+            session=session,
+            morph=morph,
+            charged_words=charged_words,
+        )
+    assert res.status == ProcessingStatus.OK
+    assert res.words_count == len(words)
+    assert res.score == calculate_jaundice_rate(words, charged_words)
+    assert res.score > 0
+
+
+async def test_count_words_releases_event_loop():
+    counter = WordsCounter(pymorphy2.MorphAnalyzer(), ["президент"])
+    timings = StageTimings()
+    steps = []
+
+    async def other_task():
+        while True:
+            steps.append(counter.words_count)
+            await asyncio.sleep(0)
+
+    task = asyncio.ensure_future(other_task())
+    await asyncio.sleep(0)
+    await count_words(counter, "президент сказал " * 10, timings, step=4)
+    task.cancel()
+    assert counter.words_count == 20
+    # other task ran between steps of 4 words
+    assert steps[:6] == [0, 0, 4, 8, 12, 16]
+    assert "lemmatize" in timings.durations
+
+
+@pytest.mark.parametrize("strategy", [score_article, stream_score_article])
+async def test_score_article_surface_form_index(
+        article_server, inosmi_article, strategy,
+):
+    morph = pymorphy2.MorphAnalyzer()
+    charged_words = ["сделка", "президент", "китай", "переговоры"]
+    index = SurfaceFormIndex(charged_words, morph)
+    words = await split_by_words(
+        morph, sanitize(inosmi_article, plaintext=True)
+    )
+    async with aiohttp.ClientSession() as session:
+        with patch("filter.main.split_by_words") as split_mock:
+            res = await strategy(
+                url=str(article_server.make_url("/article.html")),
+                session=session,
+                morph=morph,
+                charged_words=index,
+            )
+    split_mock.assert_not_called()
+    assert res.status == ProcessingStatus.OK
+    assert abs(res.words_count - len(words)) <= 5
+    assert res.score == pytest.approx(
+        calculate_jaundice_rate(words, charged_words), abs=0.05
+    )
+
+
+@pytest.mark.parametrize("path,request_timeout,processing_timeout,status", [
+    ("/slow.html", 0.1, 3, ProcessingStatus.TIMEOUT),
+    ("/article.html", 3, 0, ProcessingStatus.TIMEOUT),
+    ("/not_found.html", 3, 3, ProcessingStatus.FETCH_ERROR),
+])
+async def test_stream_score_article_errors(
+        article_server, path, request_timeout, processing_timeout, status
+):
+    async with aiohttp.ClientSession() as session:
+        res = await stream_score_article(
+            url=str(article_server.make_url(path)),
+            session=session,
+            morph=pymorphy2.MorphAnalyzer(),
+            charged_words=[],
+            request_timeout=request_timeout,
+            processing_timeout=processing_timeout,
+        )
+    assert res.status == status
+
+
+async def test_stream_score_article_unsupported_site():
+    fetched = []
+
+    async def fetcher(*args, **kwargs):
+        fetched.append(True)
+        yield await good_fetcher()
+
+    with patch("filter.main.fetch_article_chunks") as fetch_mock:
+        fetch_mock.side_effect = fetcher
+        res = await stream_score_article(
+            url="http://example.com/",
+            session=None,
+            morph=None,
+            charged_words=[],
+        )
+    assert res.status == ProcessingStatus.PARSING_ERROR
+    assert not fetched
+
+
+async def test_stream_score_article_parse_error():
+    with patch("filter.main.fetch_article_chunks") as fetch_mock:
+        fetch_mock.return_value = _aiter([await bad_fetcher()])
+        res = await stream_score_article(
+            url="https://inosmi.ru/politic/20191211/246417356.html",
+            session=None,
+            morph=None,
+            charged_words=[],
+        )
+        assert res.status == ProcessingStatus.PARSING_ERROR
+
+
+async def _aiter(items):
+    for item in items:
+        yield item
+
+
+async def test_coalesced_by_normalized_url():
+    calls = []
+
+    async def strategy(url, **kwargs):
+        calls.append(url)
+        await asyncio.sleep(0.01)
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer = ArticlesScorer([], None, score_article=strategy)
+    urls = [
+        "https://inosmi.ru/1.html?utm_source=x",
+        "https://INOSMI.ru/1.html#comments",
+    ]
+    first, second = await asyncio.gather(
+        scorer.score_one_article(urls[0], None),
+        scorer.score_one_article(urls[1], None),
+    )
+    assert calls == urls[:1]
+    assert scorer.coalesced == 1
+    assert [first.url, second.url] == urls  # every caller gets its url
+
+
+async def test_concurrent_scoring_coalesced():
+    calls = []
+    release = asyncio.Event()
+
+    async def slow_strategy(url, **kwargs):
+        calls.append(url)
+        await release.wait()
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer = ArticlesScorer([], None, score_article=slow_strategy)
+    urls = ["https://inosmi.ru/1.html", "https://inosmi.ru/2.html"]
+    first = asyncio.ensure_future(scorer.score_many_articles(urls, None))
+    second = asyncio.ensure_future(scorer.score_many_articles(urls, None))
+    third = asyncio.ensure_future(scorer.score_many_articles(urls[:1], None))
+    await asyncio.sleep(0.01)
+    assert sorted(calls) == urls
+    assert scorer.coalesced == 3
+
+    ok_before = RESULTS.values.get(("OK",), 0)
+    first.cancel()  # client went away, others still wait for the results
+    await asyncio.sleep(0.01)
+    release.set()
+    assert len(await second) == 2
+    assert [r.url for r in await third] == urls[:1]
+    assert first.cancelled()
+    assert sorted(calls) == urls
+    # every scoring is counted once, not once per waiting request
+    assert RESULTS.values[("OK",)] - ok_before == 2
+    assert not scorer.in_flight
+
+
+async def test_deadline_returns_partial_results():
+    cancelled = []
+
+    async def strategy(url, **kwargs):
+        if "slow" in url:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer = ArticlesScorer([], None, score_article=strategy)
+    urls = ["https://inosmi.ru/slow.html", "https://inosmi.ru/fast.html"]
+    results = await scorer.score_many_articles(urls, None, deadline=0.05)
+    assert results == [
+        Result(ProcessingStatus.TIMEOUT, urls[0]),
+        Result(ProcessingStatus.OK, urls[1], 0.0, 1),
+    ]
+    assert cancelled == urls[:1]
+    assert scorer.cancelled == 1
+    assert not scorer.in_flight
+
+
+async def test_scoring_cancelled_with_last_caller():
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def strategy(url, **kwargs):
+        started.set()
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    scorer = ArticlesScorer([], None, score_article=strategy)
+    url = "https://inosmi.ru/1.html"
+    first = asyncio.ensure_future(scorer.score_many_articles([url], None))
+    second = asyncio.ensure_future(scorer.score_one_article(url, None))
+    await started.wait()
+
+    first.cancel()  # client went away, second caller still waits
+    await asyncio.sleep(0.01)
+    assert not cancelled.is_set()
+
+    second.cancel()
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert scorer.cancelled == 1
+    assert not scorer.in_flight
+
+
+async def test_caller_after_cancelled_scoring_starts_new_one():
+    calls = []
+
+    async def strategy(url, **kwargs):
+        calls.append(url)
+        if len(calls) == 1:
+            await asyncio.sleep(10)
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer = ArticlesScorer([], None, score_article=strategy)
+    url = "https://inosmi.ru/1.html"
+    first = asyncio.ensure_future(scorer.score_one_article(url, None))
+    await asyncio.sleep(0)
+    first.cancel()
+    await asyncio.sleep(0)  # first caller is gone, scoring is cancelling
+    assert first.cancelled()
+    result = await scorer.score_one_article(url, None)
+    assert result == Result(ProcessingStatus.OK, url, 0.0, 1)
+    assert calls == [url, url]
+    assert scorer.coalesced == 0
@@ -0,0 +1,112 @@
+import asyncio
+import json
+
+import pytest
+
+from filter.metrics import (
+    Counter, Gauge, Histogram, Metric, Registry, StageTimings,
+    monitor_event_loop_lag, render, dump, merge,
+)
+
+
+def test_metric_is_abstract():
+    with pytest.raises(TypeError):
+        Metric("name", "Documentation.")
+
+
+def test_counter_and_gauge():
+    counter = Counter("requests_total", "Requests.", ["status"])
+    counter.inc(status="OK")
+    counter.inc(2, status="OK")
+    counter.inc(status="TIMEOUT")
+    gauge = Gauge("temperature", "Temperature.")
+    gauge.set(36.6)
+    gauge.set(0.5)
+    assert render([counter, gauge]) == (
+        '# HELP requests_total Requests.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total{status="OK"} 3.0\n'
+        'requests_total{status="TIMEOUT"} 1.0\n'
+        '# HELP temperature Temperature.\n'
+        '# TYPE temperature gauge\n'
+        'temperature 0.5\n'
+    )
+
+
+def test_histogram():
+    histogram = Histogram("latency", "Latency.", ["stage"], buckets=[0.1, 1])
+    for value in [0.05, 0.1, 0.5, 2]:
+        histogram.observe(value, stage="fetch")
+    assert render([histogram]).splitlines()[2:] == [
+        'latency_bucket{stage="fetch",le="0.1"} 2.0',
+        'latency_bucket{stage="fetch",le="1.0"} 3.0',
+        'latency_bucket{stage="fetch",le="+Inf"} 4.0',
+        'latency_sum{stage="fetch"} 2.65',
+        'latency_count{stage="fetch"} 4.0',
+    ]
+
+
+def test_label_escaping():
+    counter = Counter("c", "C.", ["url"])
+    counter.inc(url='a"b\\c\n')
+    assert 'c{url="a\\"b\\\\c\\n"} 1.0' in render([counter])
+
+
+def test_stage_timings():
+    histogram = Histogram("stages", "Stages.", ["stage"])
+    timings = StageTimings()
+    timings.add("fetch", 0.5)
+    timings.add("fetch", 0.25)
+    with timings.measure("score"):
+        pass
+    timings.update({"sanitize": 0.1})
+    timings.observe(histogram)
+    assert set(timings.durations) == {"fetch", "score", "sanitize"}
+    assert histogram.values[("fetch",)].sum == 0.75
+    assert histogram.values[("fetch",)].count == 1
+
+
+def test_registry_extra():
+    registry = Registry()
+    registry.register(Counter("a_total", "A."))
+    text = registry.render(extra=[Gauge("b", "B.")])
+    assert "# TYPE a_total counter" in text
+    assert "# TYPE b gauge" in text
+
+
+@pytest.mark.asyncio
+async def test_monitor_event_loop_lag():
+    histogram = Histogram("lag", "Lag.")
+    task = asyncio.ensure_future(monitor_event_loop_lag(0.01, histogram))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert histogram.values[()].count >= 2
+
+
+def test_dump_and_merge():
+    def worker_metrics(value):
+        counter = Counter("c_total", "C.", ["status"])
+        counter.inc(value, status="OK")
+        gauge = Gauge("g", "G.")
+        gauge.set(value)
+        histogram = Histogram("h", "H.", buckets=[1])
+        histogram.observe(value)
+        return dump([counter, gauge, histogram])
+
+    dumps = json.loads(json.dumps({"0": worker_metrics(0.5),
+                                   "1": worker_metrics(2)}))
+    assert render(merge(dumps)) == (
+        '# HELP c_total C.\n'
+        '# TYPE c_total counter\n'
+        'c_total{status="OK"} 2.5\n'
+        '# HELP g G.\n'
+        '# TYPE g gauge\n'
+        'g{worker="0"} 0.5\n'
+        'g{worker="1"} 2.0\n'
+        '# HELP h H.\n'
+        '# TYPE h histogram\n'
+        'h_bucket{le="1.0"} 1.0\n'
+        'h_bucket{le="+Inf"} 2.0\n'
+        'h_sum 2.5\n'
+        'h_count 2.0\n'
+    )
@@ -0,0 +1,49 @@
+from unittest.mock import patch
+
+import pytest
+
+from filter.adapters import ArticleNotFound
+from filter.adapters.inosmi_ru import sanitize
+from filter.main import score_article, ProcessingStatus
+from filter.pool import create_pool, process_in_pool
+from filter.text_tools import split_by_words
+
+
+@pytest.fixture(scope="module")
+def pool():
+    executor = create_pool(workers=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_process_in_pool(pool, morph, inosmi_article):
+    words = await process_in_pool(pool, inosmi_article, "inosmi_ru")
+    article_text = sanitize(inosmi_article, plaintext=True)
+    assert words == await split_by_words(morph, article_text)
+
+
+@pytest.mark.asyncio
+async def test_process_in_pool_not_found(pool, unsupported_html):
+    with pytest.raises(ArticleNotFound):
+        await process_in_pool(pool, unsupported_html, "inosmi_ru")
+
+
+@pytest.mark.asyncio
+async def test_score_article_in_pool(pool):
+    from tests.test_main import good_bytes_fetcher
+    with patch("filter.main.fetch_article_bytes") as fetch_mock:
+        fetch_mock.side_effect = good_bytes_fetcher
+        url = "https://inosmi.ru/economic/20190629/245384784.html"
+        res = await score_article(
+            url=url,
+            session=None,
+            morph=None,
+            charged_words=["аттракцион"],
+            request_timeout=1,
+            processing_timeout=3,
+            executor=pool,
+        )
+        assert res.status == ProcessingStatus.OK
+        assert res.words_count == 3
+        assert 33.3 < res.score < 33.4
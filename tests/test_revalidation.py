@@ -0,0 +1,113 @@
+import aiohttp
+import pytest
+from aiohttp import web
+
+from filter.adapters import ADAPTERS_BY_HOST, inosmi_ru
+from filter.cache import MemoryCache
+from filter.main import score_article, stream_score_article, ProcessingStatus
+from filter.metrics import STAGE_DURATION
+from filter.revalidation import RevalidationStore, Validated
+from filter.text_tools import get_morph_analyzer
+
+ARTICLE = """<html><article class="article">
+аттракцион привет человек
+</article></html>"""
+
+
+@pytest.fixture
+def article_server(loop, aiohttp_server, monkeypatch):
+    monkeypatch.setitem(ADAPTERS_BY_HOST, "127.0.0.1", inosmi_ru.ADAPTER)
+    requests = []
+
+    async def article(request):
+        requests.append(dict(request.headers))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(
+            text=ARTICLE, content_type="text/html",
+            headers={"ETag": '"v1"',
+                     "Last-Modified": "Wed, 11 Dec 2019 10:00:00 GMT"},
+        )
+
+    async def no_validators(request):
+        requests.append(dict(request.headers))
+        return web.Response(text=ARTICLE, content_type="text/html")
+
+    app = web.Application()
+    app.add_routes([
+        web.get("/article.html", article),
+        web.get("/plain.html", no_validators),
+    ])
+    server = loop.run_until_complete(aiohttp_server(app))
+    server.requests = requests
+    return server
+
+
+def _fetch_count():
+    histogram = STAGE_DURATION.values.get(("fetch",))
+    return histogram.count if histogram is not None else 0
+
+
+@pytest.mark.parametrize("strategy", [score_article, stream_score_article])
+async def test_not_modified(article_server, strategy):
+    store = RevalidationStore(MemoryCache(10))
+    score = store.decorate(strategy)
+    url = str(article_server.make_url("/article.html"))
+    async with aiohttp.ClientSession() as session:
+        kwargs = dict(
+            url=url, session=session, morph=get_morph_analyzer(),
+            charged_words=["аттракцион"],
+        )
+        first = await score(**kwargs)
+        fetches = _fetch_count()
+        second = await score(**kwargs)
+
+    assert first.status == ProcessingStatus.OK
+    assert second == first
+    assert store.not_modified == 1
+    assert _fetch_count() == fetches + 1  # 304 is measured too
+    assert "If-None-Match" not in article_server.requests[0]
+    assert article_server.requests[1]["If-None-Match"] == '"v1"'
+    assert article_server.requests[1]["If-Modified-Since"] == (
+        "Wed, 11 Dec 2019 10:00:00 GMT"
+    )
+
+
+async def test_modified(article_server):
+    store = RevalidationStore(MemoryCache(10))
+    url = str(article_server.make_url("/plain.html"))
+    outdated = Validated(
+        result=None, etag='"old"', last_modified=None,
+    )
+    await store.set(url, outdated)
+    score = store.decorate(score_article)
+    async with aiohttp.ClientSession() as session:
+        result = await score(
+            url=url, session=session, morph=get_morph_analyzer(),
+            charged_words=["аттракцион"],
+        )
+    assert result.status == ProcessingStatus.OK
+    assert article_server.requests[0]["If-None-Match"] == '"old"'
+    assert store.modified == 1
+    assert store.memory.get(url) is None  # page has no validators anymore
+
+
+class BrokenCache:
+    async def get(self, *args, **kwargs):
+        raise ConnectionError()
+
+    async def set(self, *args, **kwargs):
+        raise ConnectionError()
+
+
+async def test_shared_store_failures(article_server):
+    store = RevalidationStore(MemoryCache(0), shared=BrokenCache())
+    score = store.decorate(score_article)
+    url = str(article_server.make_url("/article.html"))
+    async with aiohttp.ClientSession() as session:
+        result = await score(
+            url=url, session=session, morph=get_morph_analyzer(),
+            charged_words=[],
+        )
+    assert result.status == ProcessingStatus.OK
+    assert store.stats["shared"].errors == 2
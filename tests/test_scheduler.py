@@ -0,0 +1,224 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from filter.main import ArticlesScorer, Result, ProcessingStatus
+from filter.scheduler import (
+    PRIORITY_BATCH, ClientOverloaded, Overloaded, Scheduler,
+)
+
+
+async def run_scheduled(scheduler, jobs):
+    """jobs are (client, priority) pairs, returns them in order of start"""
+    started = []
+
+    async def job(client, priority):
+        async with scheduler.slot(client=client, priority=priority):
+            started.append((client, priority))
+            await asyncio.sleep(0.001)
+
+    await asyncio.gather(*[job(*x) for x in jobs])
+    return started
+
+
+@pytest.mark.asyncio
+async def test_round_robin():
+    scheduler = Scheduler(slots=1)
+    jobs = [("greedy", 0)] * 4 + [("a", 0), ("b", 0)]
+    started = await run_scheduled(scheduler, jobs)
+    # first one gets free slot at once, then clients take turns
+    assert [client for client, _ in started] == [
+        "greedy", "greedy", "a", "b", "greedy", "greedy",
+    ]
+    assert scheduler.running == 0
+    assert scheduler.waiting == 0
+    assert not scheduler._queues
+    assert not scheduler._hosts
+
+
+@pytest.mark.asyncio
+async def test_priority():
+    scheduler = Scheduler(slots=1)
+    jobs = [("a", PRIORITY_BATCH)] * 3 + [("b", 0), ("c", 0)]
+    started = await run_scheduled(scheduler, jobs)
+    assert started == [
+        ("a", PRIORITY_BATCH), ("b", 0), ("c", 0),
+        ("a", PRIORITY_BATCH), ("a", PRIORITY_BATCH),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_no_limit():
+    scheduler = Scheduler()
+    started = await run_scheduled(scheduler, [("a", 0)] * 10)
+    assert len(started) == 10
+    assert scheduler.waiting == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter():
+    scheduler = Scheduler(slots=1)
+    release = asyncio.Event()
+
+    async def job():
+        async with scheduler.slot(client="a"):
+            await release.wait()
+
+    first, second, third = [asyncio.ensure_future(job()) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert (scheduler.running, scheduler.waiting) == (1, 2)
+    second.cancel()
+    release.set()  # slot is passed on to third one, not to cancelled one
+    await asyncio.gather(first, third)
+    assert second.cancelled()
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_after_slot_is_given():
+    scheduler = Scheduler(slots=1)
+    tasks = []
+
+    async def job(i):
+        async with scheduler.slot(client="a"):
+            await asyncio.sleep(0)
+        if i == 0:
+            # slot is given to second one, but it hasn't run yet
+            assert scheduler.running == 1
+            tasks[1].cancel()
+
+    tasks.extend(asyncio.ensure_future(job(i)) for i in range(3))
+    await asyncio.wait(tasks)
+    assert tasks[1].cancelled()
+    assert tasks[2].done() and not tasks[2].cancelled()
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+def test_admission():
+    scheduler = Scheduler(slots=2, queue_size=3, client_queue_size=4)
+    first = scheduler.admit("a", 4)
+    with pytest.raises(ClientOverloaded) as ex:
+        scheduler.admit("a", 1)
+    assert ex.value.retry_after >= 1
+    second = scheduler.admit("b", 1)
+    with pytest.raises(Overloaded) as ex:
+        scheduler.admit("c", 1)
+    assert not isinstance(ex.value, ClientOverloaded)
+    assert scheduler.rejected == {"client": 1, "overload": 1}
+
+    with first:
+        pass
+    assert scheduler.admitted == {"b": 1}
+    with scheduler.admit("c", 4):
+        assert scheduler.admitted_total == 5
+    second.release()
+    second.release()  # released once
+    assert scheduler.admitted_total == 0
+    assert not scheduler.admitted
+
+
+def test_large_request_is_admitted_when_idle():
+    scheduler = Scheduler(slots=1, queue_size=1, client_queue_size=1)
+    with scheduler.admit("a", 10):
+        with pytest.raises(Overloaded):
+            scheduler.admit("b", 1)
+
+
+async def run_limited(scheduler, urls):
+    active = Counter()
+    max_active = Counter()
+
+    async def strategy(url, **kwargs):
+        host = url.split("/")[2]
+        for key in [host, "total"]:
+            active[key] += 1
+            max_active[key] = max(max_active[key], active[key])
+        await asyncio.sleep(0.001)
+        for key in [host, "total"]:
+            active[key] -= 1
+        return Result(ProcessingStatus.OK, url)
+
+    limited = scheduler.decorate(strategy)
+    await asyncio.gather(*[limited(url=url) for url in urls])
+    return max_active
+
+
+URLS = [
+    *[f"https://inosmi.ru/{i}.html" for i in range(20)],
+    *[f"https://example.com/{i}.html" for i in range(20)],
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("limit,per_host,total,host", [
+    (0, 0, 40, 20),
+    (5, 0, 5, 5),
+    (0, 3, 6, 3),
+    (4, 3, 4, 3),
+])
+async def test_limits(limit, per_host, total, host):
+    scheduler = Scheduler(limit, per_host)
+    max_active = await run_limited(scheduler, URLS)
+    assert max_active["total"] == total
+    assert max_active["inosmi.ru"] == host
+    assert max_active["example.com"] == host
+    assert scheduler.wait_stats.count == len(URLS)
+    assert not scheduler._hosts  # per-host slots are released
+    assert (scheduler.running, scheduler.waiting) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_wait_stats():
+    scheduler = Scheduler(slots=1)
+    await run_limited(scheduler, URLS[:3])
+    assert scheduler.wait_stats.max >= 0.002
+    assert scheduler.wait_stats.total >= scheduler.wait_stats.max
+
+
+@pytest.mark.asyncio
+async def test_busy_host_lets_next_client_go():
+    scheduler = Scheduler(slots=3, limit_per_host=1)
+    started = []
+
+    async def job(url, client):
+        async with scheduler.slot(url, client):
+            started.append(url)
+            await asyncio.sleep(0.001)
+
+    await asyncio.gather(
+        job("https://inosmi.ru/1.html", "a"),
+        job("https://inosmi.ru/2.html", "a"),
+        job("https://inosmi.ru/3.html", "b"),
+        job("https://example.com/1.html", "b"),
+    )
+    # b's url of busy host waits, its other url goes ahead of a's one
+    assert started[:2] == [
+        "https://inosmi.ru/1.html", "https://example.com/1.html",
+    ]
+    # a, skipped while the host was busy, keeps its turn
+    assert started[2:] == [
+        "https://inosmi.ru/2.html", "https://inosmi.ru/3.html",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_scorer_shares_slots_between_clients():
+    scheduler = Scheduler(slots=1)
+    scorer = ArticlesScorer([], None)
+    started = []
+
+    async def strategy(url, **kwargs):
+        started.append(url)
+        await asyncio.sleep(0.001)
+        return Result(ProcessingStatus.OK, url, 0.0, 1)
+
+    scorer.score_article = scheduler.decorate(strategy)
+    greedy = [f"https://inosmi.ru/{i}.html" for i in range(5)]
+    polite = ["https://example.com/1.html"]
+    await asyncio.gather(
+        scorer.score_many_articles(greedy, None, client="greedy"),
+        scorer.score_many_articles(polite, None, client="polite"),
+    )
+    assert started.index(polite[0]) <= 2
+    assert scheduler.running == 0
@@ -1,6 +1,14 @@
+import json
+import os
+
 import pytest
 
-from filter.text_tools import split_by_words, calculate_jaundice_rate
+from filter.adapters.inosmi_ru import sanitize
+from filter.text_tools import (
+    split_by_words, calculate_jaundice_rate, LemmaCache, ChargedDictionary,
+    WordsCounter, tokenize, lemmatize_text, count_lemmas, SurfaceFormIndex,
+    get_morph_analyzer, ScoresCache,
+)
 
 
 @pytest.mark.parametrize("text,result", [
@@ -16,9 +24,212 @@ async def test_split_by_words(morph, text, result):
     assert await split_by_words(morph, text) == result
 
 
+@pytest.mark.asyncio
+async def test_split_by_words_with_cache(morph):
+    cache = LemmaCache(maxsize=100)
+    text = 'Во-первых, он хочет, чтобы он хочет'
+    expected = await split_by_words(morph, text)
+    assert await split_by_words(morph, text, cache) == expected
+    assert cache.misses == 4
+    assert cache.hits == 2
+    assert await split_by_words(morph, text, cache) == expected
+    assert cache.hits == 8
+
+
+def test_tokenize():
+    text = '«Во-первых», он… сказал: "т.е. -- да!"\n—'
+    assert tokenize(text) == ["Во-первых", "он", "сказал", "т.е", "да", "—"]
+
+
+@pytest.mark.asyncio
+async def test_lemmatize_text(morph):
+    text = "Он хочет, он хочет, чтобы «это» стало началом… и не только"
+    cache = LemmaCache(maxsize=100)
+    assert lemmatize_text(morph, text, cache) == await split_by_words(
+        morph, text
+    )
+    assert cache.misses == 10  # every distinct form is lemmatized once
+    assert cache.hits == 0
+
+
+def test_count_lemmas(morph):
+    text = "Война, войны, и войной — он хочет войны"
+    assert count_lemmas(morph, text) == {"война": 4, "хотеть": 1}
+
+
+def test_count_lemmas_with_phrases(morph):
+    charged = ChargedDictionary(["новый год", "война"], morph)
+    text = "Новый год, новая война. Новый — год!"
+    counts = count_lemmas(morph, text, charged_words=charged)
+    assert counts == {"новый год": 2, "новый": 1, "война": 1}
+    assert calculate_jaundice_rate(counts, charged) == calculate_jaundice_rate(
+        lemmatize_text(morph, text), charged
+    ) == round(5 / 6 * 100, 2)
+
+
+def test_get_morph_analyzer():
+    assert get_morph_analyzer() is get_morph_analyzer()
+
+
+def test_lemma_cache_eviction():
+    cache = LemmaCache(maxsize=2)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    assert cache.get("a") == "1"  # "b" becomes least recently used
+    cache.put("c", "3")
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_lemma_cache_disabled():
+    cache = LemmaCache(maxsize=0)
+    cache.put("a", "1")
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+def test_scores_cache():
+    morph = get_morph_analyzer()
+    dictionary = ChargedDictionary(["аттракцион"], morph)
+    cache = ScoresCache(maxsize=2)
+    cache.put("текст", dictionary, 50.0, 2)
+    assert cache.get("текст", dictionary) == (50.0, 2)
+    assert cache.get("другой текст", dictionary) is None
+    # scores depend on dictionary, other dictionary is other version
+    other = ChargedDictionary(["аттракцион", "побег"], morph)
+    assert other.version != dictionary.version
+    assert cache.get("текст", other) is None
+    same = ChargedDictionary(["Аттракцион"], morph)
+    assert cache.get("текст", same) == (50.0, 2)
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_scores_cache_plain_words_not_cached():
+    cache = ScoresCache()
+    cache.put("текст", ["аттракцион"], 50.0, 2)
+    assert cache.get("текст", ["аттракцион"]) is None
+    assert len(cache) == 0
+
+
 @pytest.mark.parametrize("left,right,text,words", [
     (-0.01, 0.01, [], []),
     (33.0, 34.0, ["все", "аутсайдер", "побег"], ["аутсайдер", "банкротство"]),
 ], ids=["0", "1/3"])
 def test_calculate_jaundice_rate(left, right, text, words):
     assert left < calculate_jaundice_rate(text, words) < right
+
+
+def test_calculate_jaundice_rate_counts():
+    counts = {"все": 2, "аутсайдер": 1, "побег": 1}
+    assert calculate_jaundice_rate(counts, ["аутсайдер"]) == 25
+    assert calculate_jaundice_rate({}, ["аутсайдер"]) == 0
+
+
+def test_charged_dictionary_normalization(morph):
+    charged = ChargedDictionary(
+        ["Му́ка", "холод (собачий)", "  ", "деньги", "деньги", "новый год"],
+        morph=morph,
+    )
+    assert "мука" in charged
+    assert "холод" in charged
+    assert "деньга" in charged
+    assert ("новый", "год") in charged.phrases
+    assert "новый" not in charged
+    assert len(charged) == 4
+
+
+def test_charged_dictionary_count():
+    charged = ChargedDictionary(["война", "медовый месяц", "медовый"])
+    words = ["медовый", "месяц", "война", "медовый", "война", "месяц"]
+    assert charged.count(words) == 5
+    assert charged.count([]) == 0
+    assert charged.count(["месяц"]) == 0
+    assert charged.counts(words) == {
+        "медовый месяц": 1, "война": 2, "медовый": 1, "месяц": 1,
+    }
+    # counts are scored the same as words
+    assert charged.count_lemmas(charged.counts(words)) == (5, 6)
+
+
+def test_calculate_jaundice_rate_with_phrases():
+    charged = ChargedDictionary(["новый год"])
+    words = ["новый", "год", "ель", "шар"]
+    assert calculate_jaundice_rate(words, charged) == 50
+
+
+@pytest.mark.asyncio
+async def test_words_counter_chunks(morph):
+    text = "Новый год, новый год — медовый месяц и война. Новый го"
+    charged = ChargedDictionary(["новый год", "война", "месяц"])
+    words = await split_by_words(morph, text + "д")
+    for size in [1, 3, 7, len(text)]:
+        counter = WordsCounter(morph, charged)
+        for i in range(0, len(text), size):
+            counter.feed(text[i:i + size])
+        counter.feed("д")
+        counter.finish()
+        assert counter.words_count == len(words)
+        assert counter.charged_words_count == charged.count(words) == 8
+        assert counter.score == calculate_jaundice_rate(words, charged)
+
+
+def test_surface_form_index(morph, inosmi_article):
+    entries = ["война", "переговоры", "новый год", "ад"]
+    index = SurfaceFormIndex(entries, morph)
+    assert index.forms["войной"] == "война"
+    assert index.forms["переговорах"] == "переговоры"
+    assert index.forms["новому"] == "новый"
+    assert "стали" not in index.forms  # parsed as "стать", not "сталь"
+
+    text = "Войны, переговоры и НОВЫЙ год — ад. Война!"
+    forms = index.lemmatize(tokenize(text))
+    assert forms[:4] == ["война", "переговоры", "новый", "год"]
+    # "ад" is lemmatized differently by versions of pymorphy2 dictionaries
+    assert forms == lemmatize_text(morph, text)
+
+    text = sanitize(inosmi_article, plaintext=True)
+    lemmas = lemmatize_text(morph, text)
+    forms = index.lemmatize(tokenize(text))
+    assert index.count(forms) == index.count(lemmas) > 0
+    assert abs(len(forms) - len(lemmas)) / len(lemmas) < 0.01
+
+
+def test_surface_form_index_persistence(morph, tmp_path):
+    path = str(tmp_path / "index" / "forms.json")
+    index = SurfaceFormIndex.load_or_build(path, ["война"], morph)
+    assert index.forms["войне"] == "война"
+
+    with open(path, "w") as f:
+        json.dump({"key": index.key, "forms": {"мир": "война"}}, f)
+    loaded = SurfaceFormIndex.load_or_build(path, ["война"], morph)
+    assert loaded.forms == {"мир": "война"}
+
+    other = SurfaceFormIndex.load_or_build(path, ["мир"], morph)
+    assert other.forms["миру"] == "мир"  # other dictionary, rebuilt
+    with open(path) as f:
+        assert json.load(f)["key"] == other.key
+
+
+def test_surface_form_index_of_other_user(morph, tmp_path, monkeypatch):
+    path = str(tmp_path / "forms.json")
+    index = SurfaceFormIndex.load_or_build(path, ["война"], morph)
+    with open(path, "w") as f:
+        json.dump({"key": index.key, "forms": {"мир": "война"}}, f)
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(path).st_uid + 1)
+    loaded = SurfaceFormIndex.load_or_build(path, ["война"], morph)
+    assert loaded.forms["войне"] == "война"  # planted file is ignored
+    assert "мир" not in loaded.forms
+
+
+def test_words_counter_surface_form_index(morph):
+    text = "Новый год, новый год — медовый месяц и война. Новый го"
+    index = SurfaceFormIndex(["новый год", "война", "месяц"], morph)
+    counter = WordsCounter(morph, index)
+    for i in range(0, len(text), 5):
+        counter.feed(text[i:i + 5])
+    counter.feed("д")
+    counter.finish()
+    assert (counter.words_count, counter.charged_words_count) == (9, 8)
@@ -0,0 +1,23 @@
+import pytest
+
+from filter.urls import normalize_url
+
+
+@pytest.mark.parametrize("url,normalized", [
+    ("https://inosmi.ru/1.html", "https://inosmi.ru/1.html"),
+    ("HTTPS://InoSMI.ru/1.html", "https://inosmi.ru/1.html"),
+    ("https://inosmi.ru:443/1.html", "https://inosmi.ru/1.html"),
+    ("http://inosmi.ru:443/1.html", "http://inosmi.ru:443/1.html"),
+    ("https://inosmi.ru", "https://inosmi.ru/"),
+    ("https://inosmi.ru/1.html#comments", "https://inosmi.ru/1.html"),
+    ("https://inosmi.ru/?b=1&a=2&b=0", "https://inosmi.ru/?a=2&b=1&b=0"),
+    (
+        "https://inosmi.ru/1.html?utm_source=tg&UTM_MEDIUM=x&fbclid=1&id=5",
+        "https://inosmi.ru/1.html?id=5",
+    ),
+    ("https://inosmi.ru/Path.html", "https://inosmi.ru/Path.html"),
+    ("https://[::1]:443/", "https://[::1]/"),
+    ("https://inosmi.ru:port/", "https://inosmi.ru:port/"),
+])
+def test_normalize_url(url, normalized):
+    assert normalize_url(url) == normalized